@@ -23,6 +23,10 @@ long_description = '\n\n'.join(
 dev_require = []
 if sys.version_info < (2, 7):
     dev_require += ['unittest2']
+install_require = ['setuptools', 'requests']
+if sys.version_info < (3,):
+    # backports of concurrent.futures and os.scandir
+    install_require += ['futures', 'scandir']
 
 
 setup(name='eudat.accounting.client',
@@ -47,20 +51,23 @@ setup(name='eudat.accounting.client',
       namespace_packages=['eudat', 'eudat.accounting'],
       include_package_data=True,
       zip_safe=False,
-      install_requires=[
-          # 3rd party
-          'setuptools',
-          'requests',
-          ],
+      install_requires=install_require,
       entry_points={
           'console_scripts': [
               'addRecord=eudat.accounting.client.__main__:main',
               'iRODScollector=eudat.accounting.client.iRODScollector:main',
-              'B2SHAREcollector=eudat.accounting.b2share.b2share_collector:main'
+              'POSIXcollector=eudat.accounting.client.POSIXcollector:main',
+              'B2SHAREcollector=eudat.accounting.b2share.b2share_collector:main',
+              'runCollectors=eudat.accounting.client.orchestrator:main',
+              'accountingHistory=eudat.accounting.client.history:main',
           ]
           },
       tests_require=dev_require,
       test_suite='tests.all_tests',
       extras_require={
-          'dev': dev_require
+          'dev': dev_require,
+          # direct access to a PostgreSQL iCAT database
+          'icat': ['psycopg2'],
+          # vectorized aggregation of catalog dumps
+          'dump': ['numpy'],
       })
@@ -20,8 +20,19 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+import math
+import os
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 import requests
 
+from eudat.accounting.client import utils
+from eudat.accounting.b2share.cassette import Cassette
+
 
 """
 Controls how many results one reply from B2SHARE can contain.
@@ -35,6 +46,53 @@ be included in used storage calculation.
 """
 INCLUDE_DRAFT_RECORDS = True
 
+"""
+Checkpoints older than this (in hours) are not resumed from.
+"""
+CHECKPOINT_MAX_AGE = 24
+
+"""
+Number of search result pages fetched at the same time once the total
+number of hits is known. 0 follows the 'next' links one page at a time.
+"""
+PAGE_WORKERS = 0
+
+"""
+Number of records used to validate a server side aggregation of the file
+sizes against their exact sizes. 0 trusts the aggregation as it is.
+"""
+AGGREGATION_SAMPLE = 5
+
+"""
+Maximum relative difference between aggregated and exact sizes of the
+validation sample.
+"""
+AGGREGATION_TOLERANCE = 0.01
+
+"""
+Number of hits of a search that can be paged through, the default
+index.max_result_window of Elasticsearch.
+"""
+RESULT_WINDOW = 10000
+
+"""
+Confidence level of the interval given for an estimated total size.
+"""
+ESTIMATE_CONFIDENCE = 0.95
+
+"""
+Number of records sized before an estimate may be accepted and the
+number of records at which estimating stops in any case.
+"""
+ESTIMATE_MIN_SAMPLE = 30
+ESTIMATE_MAX_SAMPLE = 1000
+
+"""
+Number of further records sized before the error of an estimate is
+checked again.
+"""
+ESTIMATE_BATCH = 10
+
 class B2SHAREAccounting(object):
 
     def __init__(self, conf, logger):
@@ -44,15 +102,46 @@ class B2SHAREAccounting(object):
         self.api_token = conf.api_token
         self.page_size = PAGE_SIZE
         self.drafts_included = INCLUDE_DRAFT_RECORDS
+        self.checkpoint_file = conf.checkpoint_file
+        self.checkpoint_max_age = conf.checkpoint_max_age
+        self.page_workers = conf.page_workers
+        self.aggregation = conf.aggregation
+        self.aggregation_sample = conf.aggregation_sample
+        self.aggregation_tolerance = conf.aggregation_tolerance
+        self.estimate_error = conf.estimate_error
+        self.estimate_confidence = conf.estimate_confidence
+        self.estimate_min_sample = conf.estimate_min_sample
+        self.estimate_max_sample = conf.estimate_max_sample
+        # records resp. replays the HTTP traffic of the crawl if set
+        self.cassette = None
+        if conf.cassette:
+            self.cassette = Cassette(conf.cassette, conf.cassette_mode,
+                                     token=self.api_token,
+                                     latency=conf.replay_latency)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.deadline = utils.Deadline()
+        # Set by report(); False if the totals do not cover all records
+        self.complete = False
+        # Set by report(); fraction of the records covered by the totals
+        # resp. sized for an estimate if the deadline was reached
+        self.deadline_reached = False
+        self.completeness = 0.0
+        # Set by report() if the total size has been estimated: the
+        # bounds of its confidence interval, the confidence level,
+        # the number of records sampled and the relative error reached
+        self.estimate = None
 
-    def _create_search_url(self):
-        """Creates search url to query for records from B2SHARE REST API."""
+    def _create_search_url(self, query=None, page_size=None):
+        """Creates search url to query for records from B2SHARE REST API.
+
+        By default all records of the community are searched for."""
         url = '{url}/api/records/?' \
-              'q=community:{community}&size={page_size}' \
+              'q={query}&size={page_size}' \
               .format(
                   url=self.url,
-                  community=self.community,
-                  page_size=self.page_size)
+                  query=query or 'community:{}'.format(self.community),
+                  page_size=self.page_size if page_size is None else page_size)
 
         # Add an access_token if one is provided
         if self.api_token:
@@ -74,13 +163,13 @@ class B2SHAREAccounting(object):
         record_size = 0
 
         if record['links'].get('self'):
-            r = requests.get(record['links']['self'] + '?access_token=' + self.api_token, verify=True)
+            r = self._get(record['links']['self'] + '?access_token=' + self.api_token)
             # Check that 200 OK was given
             # (i.e. access token contains enough permissions)
             if r.status_code == requests.codes.ok:
                 reply = r.json()
                 if reply['links'].get('files'):
-                    r = requests.get(reply['links']['files'] + '?access_token=' + self.api_token, verify=True)
+                    r = self._get(reply['links']['files'] + '?access_token=' + self.api_token)
                     if r.status_code == requests.codes.ok:
                         reply = r.json()
                         record_size = reply.get('size')
@@ -91,13 +180,13 @@ class B2SHAREAccounting(object):
         record_size = 0
 
         if record['links'].get('publication'):
-            r = requests.get(record['links']['publication'] + '?access_token=' + self.api_token, verify=True)
+            r = self._get(record['links']['publication'] + '?access_token=' + self.api_token)
             # Check that 200 OK was given
             # (i.e. access token contains enough permissions)
             if r.status_code == requests.codes.ok:
                 reply = r.json()
                 if reply['links'].get('files'):
-                    r = requests.get(reply['links']['files'] + '?access_token=' + self.api_token, verify=True)
+                    r = self._get(reply['links']['files'] + '?access_token=' + self.api_token)
                     if r.status_code == requests.codes.ok:
                         reply = r.json()
                         record_size = reply.get('size')
@@ -158,11 +247,19 @@ class B2SHAREAccounting(object):
         }
         """  # noqa
 
-        url = self._create_search_url()
-
-        total_amount = 0
+        self.complete = False
+        self.deadline = utils.Deadline.fromArgs(args)
+        self.deadline_reached = False
+        self.completeness = 0.0
+        self.estimate = None
+        self._estimate_cut = False
+        self._pages_done = 0
+        # records sized so far, used if the deadline is reached
+        self._total_hits = 0
+        self._done_hits = 0
+        self._done_amount = 0
         total_hits = 0
-        total_pages = 0
+        total_amount = 0
 
         try:
 
@@ -170,49 +267,491 @@ class B2SHAREAccounting(object):
             # NOTE: Check won't guarantee that api_token has superadmin rights.
             if self.api_token:
                 token_check_url = '{url}/api/user/?{token}'.format(url=self.url, token=self.api_token)
-                token_check_response = requests.get(token_check_url, verify=True)
+                token_check_response = self._get(token_check_url)
                 if token_check_response.json() == '{}':
                     # Since nothing was returned token is considered to be invalid.
                     raise requests.exceptions.RequestException('Provide API token is not valid.')
-            r = requests.get(url, verify=True)
 
-            while r:
-                if r.status_code != requests.codes.ok:
-                    self.logger.warn(
-                        'get community records status code:' + r.status_code)
+            aggregated = None
+            if self.aggregation:
+                aggregated = self._report_aggregated()
+            if aggregated:
+                total_hits, total_amount = aggregated
+                self._pages_done = 1
+            elif self.estimate_error:
+                total_hits, total_amount = self._estimate()
+            elif self.page_workers:
+                total_hits, total_amount = self._crawl_parallel()
+            else:
+                total_hits, total_amount = self._crawl_sequential()
 
-                reply = r.json()
+            if self._estimate_cut:
+                # an estimate from the sample sized before the deadline
+                self.deadline_reached = True
+                self.completeness = \
+                    float(self.estimate['sample']) / total_hits
+            else:
+                self.complete = True
+                self.completeness = 1.0
+            self._remove_checkpoint()
 
-                total_hits = reply['hits']['total']
-                total_pages += 1
-
-                for record in reply['hits']['hits']:
-                    # Check if record is actually a draft.
-                    if record['metadata']['publication_state'] == 'draft':
-                        record_size = self._calculate_storage_for_draft(record)
-                    else:
-                        # Record has been published
-                        record_size = self._calculate_storage_for_record(record)
-                    
-                    total_amount += record_size
-
-                # Continue if there are multiple pages of search results.
-                if r.links.get('next'):
-                    next_url = r.links['next']['url']
-
-                    # NOTE: Due to bug in B2SHARE REST API
-                    #       '&access_token' and '&drafts=1' query params
-                    #       need to be added manually
-                    if self.drafts_included:
-                        next_url = next_url + '&access_token={}&drafts=1'.format(self.api_token)
-                    r = requests.get(next_url, verify=True)
-                else:
-                    r = False
-
-        except requests.exceptions.RequestException as e:
-            self.logger.error('get community records request failed:' + str(e))
+        except (requests.exceptions.RequestException,
+                utils.DeadlineExceeded) as e:
+            if self.deadline.expired():
+                self.deadline_reached = True
+                if self._total_hits:
+                    self.completeness = \
+                        float(self._done_hits) / self._total_hits
+                total_hits, total_amount = self._done_hits, self._done_amount
+                self.logger.warning(
+                    'deadline reached after sizing %s of %s records',
+                    self._done_hits, self._total_hits)
+            else:
+                self.logger.error(
+                    'get community records request failed:%s', e)
+            if self.checkpoint_file:
+                self.logger.error(
+                    'crawl stopped after %s pages, the next run resumes '
+                    'from there', self._pages_done)
+        finally:
+            if self.cassette and self.cassette.mode == 'record':
+                self.cassette.save()
+                self.logger.info('recorded %s requests in %s',
+                                 len(self.cassette.interactions),
+                                 self.cassette.path)
 
         self.logger.debug(
-            'get community records request contained {} pages.'.format(
-                total_pages))
+            'get community records request contained %s pages.',
+            self._pages_done)
         return (total_hits, total_amount)
+
+    def _report_aggregated(self):
+        """Gets the number of records and their total size from the
+        configured aggregation of the search instead of crawling.
+
+        The aggregation is validated against the exact sizes of a sample
+        of records first. Returns (total_hits, total_amount) or None if
+        the aggregation is not available or not trustworthy."""
+        result = self._aggregate()
+        if result is None:
+            self.logger.info(
+                'aggregation %s not available, crawling records',
+                self.aggregation)
+            return None
+
+        if self.aggregation_sample:
+            records = self._sample_records(result[0])
+            if records:
+                exact = sum(self._calculate_storage_for_record_or_draft(r)
+                            for r in records)
+                query = 'community:{} AND id:({})'.format(
+                    self.community,
+                    ' OR '.join(str(r['id']) for r in records))
+                sample = self._aggregate(query)
+                if sample is None or sample[0] != len(records) or \
+                        abs(sample[1] - exact) > \
+                        self.aggregation_tolerance * max(exact, 1):
+                    self.logger.warning(
+                        'aggregation %s does not match the sample of %s '
+                        'records (%s instead of %s bytes), crawling '
+                        'records', self.aggregation, len(records),
+                        sample and sample[1], exact)
+                    return None
+
+        self.logger.info(
+            'using aggregation %s: %s records, %s bytes',
+            self.aggregation, result[0], result[1])
+        return result
+
+    def _sample_records(self, total_hits):
+        """Returns a simple random sample of `aggregation_sample` of the
+        `total_hits` records of the search, each fetched as a page of
+        one record.
+
+        The search refuses pages beyond its result window, so the sample
+        is drawn from the first RESULT_WINDOW hits."""
+        population = min(total_hits, RESULT_WINDOW)
+        records = []
+        for index in sorted(random.sample(
+                range(population), min(self.aggregation_sample, population))):
+            reply = self._check_reply(self._get(
+                self._create_search_url(page_size=1) +
+                '&page={}'.format(index + 1)))
+            records.extend(reply['hits']['hits'])
+        return records
+
+    def _aggregate(self, query=None):
+        """Returns (hits, size) according to the configured aggregation of
+        a search returning no records or None if it is missing."""
+        reply = self._check_reply(self._get(self._create_search_url(
+            query=query, page_size=0)))
+        aggregation = reply.get('aggregations', {}).get(self.aggregation)
+        if not isinstance(aggregation, dict) or \
+                aggregation.get('value') is None:
+            return None
+        return (reply['hits']['total'], int(aggregation['value']))
+
+    def _estimate(self):
+        """Estimates the total size of the records from the sizes of a
+        simple random sample of them instead of crawling all records.
+
+        Records are drawn at random from all hits of the search, their
+        pages fetched as needed, until the confidence interval of the
+        estimated total is within the requested relative error or the
+        maximum sample size is reached. If the deadline is reached the
+        estimate of the sample sized so far is used.
+
+        The search refuses pages beyond its result window, so with more
+        hits the sample is drawn from the first RESULT_WINDOW of them.
+
+        Returns (total_hits, estimated total_amount)."""
+        pages = {}
+        reply = self._check_reply(self._get(self._page_url(1)))
+        total_hits = self._total_hits = reply['hits']['total']
+        pages[1] = reply['hits']['hits']
+        if not total_hits:
+            return (0, 0)
+
+        page_size = int(self.page_size)
+        z = _normal_quantile(0.5 + self.estimate_confidence / 2)
+        population = min(total_hits, RESULT_WINDOW)
+        if population < total_hits:
+            self.logger.warning(
+                'sampling the first %s of %s records only, the search '
+                'refuses pages beyond its result window', population,
+                total_hits)
+        limit = min(self.estimate_max_sample, population)
+        drawn = set()
+        sizes = []
+
+        def size_record(index):
+            page = index // page_size + 1
+            if page not in pages:
+                reply = self._check_reply(self._get(self._page_url(page)))
+                pages[page] = reply['hits']['hits']
+            records = pages[page]
+            if index % page_size >= len(records):
+                # the search results changed since the total was taken
+                return None
+            return self._calculate_storage_for_record_or_draft(
+                records[index % page_size]) or 0
+
+        pool = ThreadPool(self.page_workers) if self.page_workers else None
+        try:
+            while len(drawn) < limit:
+                count = min(max(self.estimate_min_sample - len(sizes),
+                                ESTIMATE_BATCH), limit - len(drawn))
+                batch = []
+                while len(batch) < count:
+                    index = random.randrange(population)
+                    if index not in drawn:
+                        drawn.add(index)
+                        batch.append(index)
+                results = pool.map(size_record, batch) if pool \
+                    else [size_record(index) for index in batch]
+                sizes.extend(size for size in results if size is not None)
+                self._pages_done = len(pages)
+                if len(sizes) >= self.estimate_min_sample:
+                    total, error = _estimate_total(sizes, total_hits, z)
+                    if error <= self.estimate_error * total:
+                        break
+        except (requests.exceptions.RequestException,
+                utils.DeadlineExceeded):
+            # requests still running at the deadline time out
+            if not self.deadline.expired() or len(sizes) < 2:
+                raise
+            self.logger.warning(
+                'deadline reached, estimating from %s records', len(sizes))
+            self._estimate_cut = True
+        finally:
+            if pool:
+                pool.close()
+
+        total, error = _estimate_total(sizes, total_hits, z)
+        self.estimate = {
+            'lower': max(0, int(round(total - error))),
+            'upper': int(round(total + error)),
+            'confidence': self.estimate_confidence,
+            'sample': len(sizes),
+            'relative_error': error / total if total else 0.0,
+        }
+        self.logger.info(
+            'estimated %d bytes in %s records from a sample of %s: '
+            '%d%% confidence interval %s to %s bytes',
+            round(total), total_hits, len(sizes),
+            round(100 * self.estimate_confidence), self.estimate['lower'],
+            self.estimate['upper'])
+        if self.estimate['relative_error'] > self.estimate_error:
+            self.logger.warning(
+                'estimate has a relative error of %.2f%% instead of '
+                '%.2f%%', 100 * self.estimate['relative_error'],
+                100 * self.estimate_error)
+        return (total_hits, int(round(total)))
+
+    def _crawl_sequential(self):
+        """Follows the 'next' links of the search one page at a time.
+
+        Returns (total_hits, total_amount)."""
+        url = self._create_search_url()
+        total_amount = 0
+        total_hits = 0
+
+        checkpoint = self._load_checkpoint('sequential')
+        if checkpoint:
+            url = self._next_page_url(checkpoint['next_url'])
+            total_amount = checkpoint['total_amount']
+            total_hits = checkpoint['total_hits']
+            self._pages_done = checkpoint['total_pages']
+            self._count(checkpoint.get('total_records', 0), total_amount)
+            self.logger.info(
+                'resuming crawl after page %s from checkpoint',
+                self._pages_done)
+
+        r = self._get(url)
+        found = checkpoint and self._check_reply(r)['hits']['total']
+        if checkpoint and found != total_hits:
+            # the page boundaries have moved since the checkpoint
+            self.logger.warning(
+                '%s records instead of %s since the checkpoint, '
+                'restarting the crawl', found, total_hits)
+            self._remove_checkpoint()
+            total_amount = 0
+            self._pages_done = 0
+            with self._lock:
+                self._done_hits = self._done_amount = 0
+            r = self._get(self._create_search_url())
+
+        while r is not None:
+            reply = self._check_reply(r)
+
+            total_hits = self._total_hits = reply['hits']['total']
+            total_amount += self._calculate_storage_for_page(reply)
+            self._pages_done += 1
+
+            # Continue if there are multiple pages of search results.
+            if r.links.get('next'):
+                next_url = r.links['next']['url']
+                self._save_checkpoint('sequential', {
+                    'next_url': next_url,
+                    'total_amount': total_amount,
+                    'total_hits': total_hits,
+                    'total_pages': self._pages_done,
+                    'total_records': self._done_hits,
+                })
+                r = self._get(self._next_page_url(next_url))
+            else:
+                r = None
+
+        return (total_hits, total_amount)
+
+    def _crawl_parallel(self):
+        """Fetches the first page of the search to learn the total number
+        of hits and all further pages concurrently.
+
+        Returns (total_hits, total_amount)."""
+        checkpoint = self._load_checkpoint('parallel')
+        pages = checkpoint['pages'] if checkpoint else {}
+        if pages:
+            reply = self._check_reply(self._get(
+                self._create_search_url(page_size=0)))
+            if reply['hits']['total'] != checkpoint['total_hits']:
+                # the pages done before no longer line up with the others
+                self.logger.warning(
+                    '%s records instead of %s since the checkpoint, '
+                    'restarting the crawl', reply['hits']['total'],
+                    checkpoint['total_hits'])
+                self._remove_checkpoint()
+                pages = {}
+        if pages:
+            self.logger.info(
+                'resuming crawl with %s pages done from checkpoint',
+                len(pages))
+
+        for hits, amount in pages.values():
+            self._count(hits, amount)
+
+        if '1' in pages:
+            total_hits = self._total_hits = checkpoint['total_hits']
+        else:
+            reply = self._check_reply(self._get(self._page_url(1)))
+            total_hits = self._total_hits = reply['hits']['total']
+            pages['1'] = [len(reply['hits']['hits']),
+                          self._calculate_storage_for_page(reply)]
+            self._save_checkpoint('parallel', {'total_hits': total_hits,
+                                               'pages': pages})
+        self._pages_done = len(pages)
+
+        page_size = int(self.page_size)
+        page_count = max(1, (total_hits + page_size - 1) // page_size)
+        todo = [page for page in range(2, page_count + 1)
+                if str(page) not in pages]
+        self.logger.debug('fetching %s of %s pages with %s workers',
+                          len(todo), page_count, self.page_workers)
+
+        lock = threading.Lock()
+
+        def crawl_page(page):
+            reply = self._check_reply(self._get(self._page_url(page)))
+            if reply['hits']['total'] != total_hits:
+                raise requests.exceptions.RequestException(
+                    'total number of hits changed during crawl')
+            result = [len(reply['hits']['hits']),
+                      self._calculate_storage_for_page(reply)]
+            with lock:
+                pages[str(page)] = result
+                self._pages_done = len(pages)
+                self._save_checkpoint('parallel', {'total_hits': total_hits,
+                                                   'pages': pages})
+
+        if todo:
+            pool = ThreadPool(min(self.page_workers, len(todo)))
+            try:
+                pool.map(crawl_page, todo)
+            finally:
+                pool.close()
+
+        hit_count = sum(hits for hits, amount in pages.values())
+        if hit_count != total_hits:
+            raise requests.exceptions.RequestException(
+                'pages contained {} hits instead of {}'.format(hit_count,
+                                                             total_hits))
+        return (total_hits, sum(amount for hits, amount in pages.values()))
+
+    def _calculate_storage_for_page(self, reply):
+        """Returns the storage used by the records of one search reply."""
+        page_amount = 0
+        for record in reply['hits']['hits']:
+            self.deadline.check()
+            record_size = self._calculate_storage_for_record_or_draft(record)
+            page_amount += record_size
+            self._count(1, record_size)
+        return page_amount
+
+    def _calculate_storage_for_record_or_draft(self, record):
+        # Check if record is actually a draft.
+        if record['metadata']['publication_state'] == 'draft':
+            return self._calculate_storage_for_draft(record)
+        # Record has been published
+        return self._calculate_storage_for_record(record)
+
+    def _count(self, hits, amount):
+        """Adds to the number and size of the records sized so far."""
+        with self._lock:
+            self._done_hits += hits
+            self._done_amount += amount
+
+    def _check_reply(self, r):
+        """Returns the decoded reply of a search request."""
+        if r.status_code != requests.codes.ok:
+            # Don't count a failed page as an empty one.
+            raise requests.exceptions.RequestException(
+                'get community records status code: {}'.format(
+                    r.status_code))
+        return r.json()
+
+    def _get(self, url):
+        """GET `url` reusing one connection pool per thread.
+
+        No request is started once the deadline has been reached and none
+        takes longer than the time remaining. With a cassette the
+        requests are recorded resp. replayed."""
+        self.deadline.check()
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            if self.cassette:
+                self.cassette.mount(session)
+        return session.get(url, verify=True, timeout=self.deadline.timeout())
+
+    def _page_url(self, page):
+        """Returns the url of the given page of the search.
+
+        The access token and drafts parameter are part of the search url
+        already, so this is not affected by the bug of the 'next' links."""
+        return self._create_search_url() + '&page={}'.format(page)
+
+    def _next_page_url(self, next_url):
+        """Returns the url to fetch for a 'next' link of a search reply."""
+        # NOTE: Due to bug in B2SHARE REST API
+        #       '&access_token' and '&drafts=1' query params
+        #       need to be added manually
+        if self.drafts_included and self.api_token:
+            next_url = next_url + '&access_token={}&drafts=1'.format(self.api_token)
+        return next_url
+
+    def _load_checkpoint(self, mode):
+        """Returns the checkpoint of an unfinished crawl of the same
+        community done in the same `mode` or None if there is none or if
+        it is too old."""
+        if not self.checkpoint_file or \
+                not os.path.exists(self.checkpoint_file):
+            return None
+        age = time.time() - os.path.getmtime(self.checkpoint_file)
+        if age > self.checkpoint_max_age * 3600:
+            self.logger.info('ignoring outdated checkpoint %s',
+                             self.checkpoint_file)
+            return None
+        with open(self.checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('community') != self.community or \
+                checkpoint.get('drafts_included') != self.drafts_included or \
+                checkpoint.get('mode') != mode:
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, mode, checkpoint):
+        """Atomically replaces the checkpoint file.
+
+        The stored 'next' link never contains the access token."""
+        if not self.checkpoint_file:
+            return
+        checkpoint['community'] = self.community
+        checkpoint['drafts_included'] = self.drafts_included
+        checkpoint['mode'] = mode
+        tmp = self.checkpoint_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(checkpoint, f)
+        os.rename(tmp, self.checkpoint_file)
+
+    def _remove_checkpoint(self):
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+
+def _estimate_total(sizes, population, z):
+    """Returns the total of a population of the given size estimated
+    from the `sizes` of a simple random sample drawn without replacement
+    and the half width of its confidence interval for the quantile `z`.
+
+    >>> _estimate_total([1, 2, 3], 3, 1.96)
+    (6.0, 0.0)
+    >>> total, error = _estimate_total([1, 2, 3, 4], 100, 1.96)
+    >>> total, round(error, 1)
+    (250.0, 124.0)
+    """
+    n = len(sizes)
+    mean = float(sum(sizes)) / n
+    variance = 0.0
+    if n > 1:
+        variance = sum((size - mean) ** 2 for size in sizes) / (n - 1)
+    # finite population correction, no error once all records are sized
+    correction = max(0.0, 1.0 - float(n) / population)
+    return (population * mean,
+            z * population * math.sqrt(variance / n * correction))
+
+
+def _normal_quantile(p):
+    """Returns the quantile of the standard normal distribution for the
+    probability `p`.
+
+    >>> round(_normal_quantile(0.975), 2)
+    1.96
+    """
+    low, high = -10.0, 10.0
+    for i in range(60):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
@@ -5,10 +5,8 @@ eudat.accounting.b2share_collector
 ===============================
 """
 
-import json
 import argparse
 import logging
-import logging.handlers
 import sys
 import os
 
@@ -18,10 +16,16 @@ except ImportError:
     # Python 3
     from configparser import SafeConfigParser
 
-from eudat.accounting.client import __version__, LOG, utils
+from eudat.accounting.client import __version__, LOG, utils, profiling, \
+    singleflight, asynclog, history
 from eudat.accounting.client.__main__ import Application as ApplicationBase
+from eudat.accounting.client.record import AccountingRecord
 
-from eudat.accounting.b2share.b2share_accounting import B2SHAREAccounting
+from eudat.accounting.b2share.b2share_accounting import B2SHAREAccounting, \
+    CHECKPOINT_MAX_AGE, PAGE_WORKERS, AGGREGATION_SAMPLE, \
+    AGGREGATION_TOLERANCE, ESTIMATE_CONFIDENCE, ESTIMATE_MIN_SAMPLE, \
+    ESTIMATE_MAX_SAMPLE
+from eudat.accounting.b2share.cassette import CASSETTE_MODES
 
 
 ################################################################################
@@ -54,23 +58,51 @@ class Configuration(object):
         self.service_uuid = self.fileparser.get('Report', 'service_uuid')
         self.b2share_community = self.fileparser.get('B2SHARE', 'community')
         self.b2share_url = self.fileparser.get('B2SHARE', 'url')
+        self.checkpoint_file = utils.getOption(self.fileparser, 'B2SHARE',
+                                               'checkpoint_file')
+        self.checkpoint_max_age = float(utils.getOption(
+            self.fileparser, 'B2SHARE', 'checkpoint_max_age',
+            CHECKPOINT_MAX_AGE))
+        self.page_workers = int(utils.getOption(self.fileparser, 'B2SHARE',
+                                                'page_workers', PAGE_WORKERS))
+        self.aggregation = utils.getOption(self.fileparser, 'B2SHARE',
+                                           'aggregation')
+        self.aggregation_sample = int(utils.getOption(
+            self.fileparser, 'B2SHARE', 'aggregation_sample',
+            AGGREGATION_SAMPLE))
+        self.aggregation_tolerance = float(utils.getOption(
+            self.fileparser, 'B2SHARE', 'aggregation_tolerance',
+            AGGREGATION_TOLERANCE))
+        self.estimate_error = float(utils.getOption(
+            self.fileparser, 'B2SHARE', 'estimate_error', 0))
+        self.estimate_confidence = float(utils.getOption(
+            self.fileparser, 'B2SHARE', 'estimate_confidence',
+            ESTIMATE_CONFIDENCE))
+        self.estimate_min_sample = int(utils.getOption(
+            self.fileparser, 'B2SHARE', 'estimate_min_sample',
+            ESTIMATE_MIN_SAMPLE))
+        self.estimate_max_sample = int(utils.getOption(
+            self.fileparser, 'B2SHARE', 'estimate_max_sample',
+            ESTIMATE_MAX_SAMPLE))
+        if not 0 < self.estimate_confidence < 1:
+            raise ValueError("estimate_confidence must be between 0 and 1, "\
+                             "not %r" % self.estimate_confidence)
+        self.cassette = utils.getOption(self.fileparser, 'B2SHARE',
+                                        'cassette')
+        self.cassette_mode = utils.getOption(self.fileparser, 'B2SHARE',
+                                             'cassette_mode', 'replay')
+        self.replay_latency = float(utils.getOption(
+            self.fileparser, 'B2SHARE', 'replay_latency', 1.0))
+        if self.cassette_mode not in CASSETTE_MODES:
+            raise ValueError("cassette_mode must be one of %s, not %r"
+                             % (', '.join(CASSETTE_MODES),
+                                self.cassette_mode))
 
         # Configuration provided with environment variables
         self.api_token = os.getenv('B2SHARE_SUPERADMIN_API_KEY', None)
 
-        # create a file handler
-        handler = logging.handlers.RotatingFileHandler(self.logfile, \
-                                                       maxBytes=10000000, \
-                                                       backupCount=9)
-        handler.setLevel(logging.INFO)
-
-        # create a logging format
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s\
-                                            - %(message)s', "%Y-%m-%d %H:%M:%S")
-        handler.setFormatter(formatter)
-
-        # add the handlers to the logger
-        self.logger.addHandler(handler)
+        # write the log file from a background thread
+        asynclog.addLogFile(self.logger, self.logfile)
 
 
 ################################################################################
@@ -91,39 +123,73 @@ class EUDATAccounting(object):
         self.logger = logger
         self.b2share_accounting = B2SHAREAccounting(conf, logger)
 
-    def _toAccountingRecord(self, stats):
+    def _toAccountingRecord(self, stats, args):
         """
         Cast to format of an eudat accounting record
         """
-        return {
-            'account': self.conf.account,
-            'number': stats[0],
-            'value': stats[1],
-        }
+        return AccountingRecord.fromArgs(args,
+                                         account=self.conf.account,
+                                         number=stats[0],
+                                         value=stats[1])
 
-    def reportStatistics(self, args):
+    def collectRecords(self, args):
         """
-        Report statistical data on resource consumption to remote server
+        Collect the accounting records without reporting them
         """
         data = self.b2share_accounting.report(args)
+        record = self._toAccountingRecord(data, args)
+        estimate = self.b2share_accounting.estimate
+        if estimate:
+            # keep the error bound of an estimated size with the record
+            record.meta.update(estimate_lower=estimate['lower'],
+                               estimate_upper=estimate['upper'],
+                               estimate_confidence=estimate['confidence'],
+                               estimate_sample=estimate['sample'])
+            record.quality = 'estimated'
+        if self.b2share_accounting.deadline_reached and estimate:
+            # the estimate covers all records already, but its sample was
+            # cut short by the deadline
+            record = utils.applyPartialPolicy(
+                args, record, self.b2share_accounting.completeness,
+                self.logger, extrapolate=False,
+                reason='deadline reached, estimated from %s records'
+                       % estimate['sample'])
+            if record is None:
+                msg = "Deadline reached, estimate not reported"
+                self.logger.warning(msg)
+                sys.exit(msg)
+        elif self.b2share_accounting.deadline_reached:
+            record = utils.applyPartialPolicy(
+                args, record, self.b2share_accounting.completeness,
+                self.logger)
+            if record is None:
+                msg = "Deadline reached, partial result not reported"
+                self.logger.warning(msg)
+                sys.exit(msg)
+        elif not self.b2share_accounting.complete:
+            # never report partial totals as if they were complete
+            msg = "B2SHARE crawl incomplete, not reporting partial totals"
+            self.logger.error(msg)
+            sys.exit(msg)
 
         acctRecords = []
-        acctRecords.append(self._toAccountingRecord(data))
-        # adding the data to the args so other command line args
-        # resp their defaults are available as well
-        args.account = acctRecords[0]['account']
-        args.value = acctRecords[0]['value']
-        args.number = acctRecords[0]['number']
-        pretty_data = json.dumps(acctRecords, indent=4)
-        self.logger.info('Data: ' + pretty_data)
+        acctRecords.append(record)
+        return acctRecords
+
+    def reportStatistics(self, args):
+        """
+        Report statistical data on resource consumption to remote server
+        """
+        acctRecords = self.collectRecords(args)
+        self.logger.info('Data: %s', acctRecords)
 
         credentials = utils.getCredentials(self.conf)
         self.logger.info("Credentials found")
-        self.logger.debug("Credentials: " + str(credentials))
+        self.logger.debug("Credentials: %s", credentials)
         url = utils.getUrl(self.conf)
-        self.logger.info("URL to call: " + url)
-        data = utils.getData(args)
-        self.logger.info("Data as query string: " + data)
+        self.logger.info("URL to call: %s", url)
+        data = acctRecords[0].toQueryString()
+        self.logger.info("Data as query string: %s", data)
 
         if args.test:
             print("Test: Would send the following data: " \
@@ -132,25 +198,26 @@ class EUDATAccounting(object):
 
         response = utils.call(credentials, url, data)
 
-        self.logger.info('Data sent. Status code: ' \
-                         + str(response.status_code))
+        self.logger.info('Data sent. Status code: %s',
+                         response.status_code)
         if args.verbose:
             print("\nData sent. Status code: " \
                 + str(response.status_code))
             print("Key of generated accounting record: " \
                 + response.text)
+        return acctRecords
 
 
 def main(argv=sys.argv):
-    logging.basicConfig(filename='.accounting.log',
-                        level=logging.INFO,
-                        format='%(asctime)s - %(name)s \
-                        - %(levelname)s - %(message)s')
+    asynclog.configureLogging()
     exit_code = 1
     try:
         app = Application(argv)
-        app.run()
+        singleflight.runSingleFlight(app.args, profiling.runProfiled,
+                                     app.args, app.run)
         exit_code = 0
+    except singleflight.RunInProgress:
+        exit_code = singleflight.SKIPPED_EXIT_CODE
     except KeyboardInterrupt:
         exit_code = 0
     except Exception as exc:
@@ -174,6 +241,9 @@ class Application(ApplicationBase):
                              'Default: "./b2sharecollector.cfg" (in the current working directory)')
 
         utils.addCommonArguments(ap)
+        utils.addDeadlineArguments(ap)
+        singleflight.addSingleFlightArguments(ap)
+        history.addHistoryArguments(ap)
 
         self.args = ap.parse_args(args=argv[1:])
         # sneak in some default values that the utility functions expect
@@ -183,7 +253,7 @@ class Application(ApplicationBase):
         """Arguments of your app"""
 
     def run(self):
-        LOG.info("B2SHAREcollector called with: " + str(self.args))
+        LOG.info("B2SHAREcollector called with: %s", self.args)
         print("B2SHAREcollector called with: %s" % str(self.args))
 
         fileparser = SafeConfigParser()
@@ -198,5 +268,6 @@ class Application(ApplicationBase):
 
         eurep = EUDATAccounting(configuration, logger)
         logger.info("Accounting starting ...")
-        eurep.reportStatistics(self.args)
+        acctRecords = eurep.reportStatistics(self.args)
         logger.info("Accounting finished")
+        return acctRecords
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Recording and replaying the HTTP traffic of a B2SHARE crawl.
+
+A cassette holds the replies to all requests of a crawl together with
+their latencies. Access tokens are replaced by a placeholder before
+anything is stored, so a cassette recorded against a production
+instance can be shared. Replaying it serves the same requests offline,
+which makes crawling strategies comparable on the same data.
+"""
+
+import gzip
+import json
+import re
+import threading
+import time
+from datetime import timedelta
+
+try:
+    from urlparse import urlsplit, parse_qsl
+except ImportError:
+    # Python 3
+    from urllib.parse import urlsplit, parse_qsl
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+"""
+Replaces the access tokens in the urls and bodies stored.
+"""
+REDACTED = 'REDACTED'
+
+"""
+Reply headers kept in a cassette; the 'next' links of a search are sent
+in the Link header.
+"""
+KEPT_HEADERS = ('Content-Type', 'Link')
+
+CASSETTE_MODES = ('record', 'replay')
+
+TOKEN_PATTERN = re.compile(r'(access_token=)[^&"\s>]*')
+
+
+def redact(text, token=None):
+    """Replaces access tokens in `text`, given as parameter or literally
+
+        >>> redact('/api/records/?q=x&access_token=abc&drafts=1')
+        '/api/records/?q=x&access_token=REDACTED&drafts=1'
+        >>> redact('/api/user/?secret', 'secret')
+        '/api/user/?REDACTED'
+    """
+    if token:
+        text = text.replace(token, REDACTED)
+    return TOKEN_PATTERN.sub(r'\g<1>' + REDACTED, text)
+
+
+class Cassette(object):
+    """The recorded replies of a crawl, stored as (gzipped if the name
+    ends with '.gz') JSON in `path`.
+
+    In 'record' mode the sessions mounted get the replies from the
+    server and add them to the cassette, which is written by `save`.
+    In 'replay' mode the replies are served from the cassette after
+    their recorded latency multiplied by `latency`; 0 replies at once.
+    Repeated requests of the same url get the replies in the order
+    recorded, the last one again once they are used up."""
+
+    def __init__(self, path, mode='replay', token=None, latency=1.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError("cassette mode must be one of %s, not %r"
+                             % (', '.join(CASSETTE_MODES), mode))
+        self.path = path
+        self.mode = mode
+        self.token = token
+        self.latency = latency
+        self.interactions = []
+        self._replies = {}
+        self._lock = threading.Lock()
+        if mode == 'replay':
+            self.load()
+
+    def key(self, method, url):
+        """Identifies a request independent of the order and quoting of
+        its query parameters, so that a page fetched through a 'next'
+        link matches the same page fetched by its number. The first page
+        is the same with and without 'page=1'."""
+        parts = urlsplit(redact(url, self.token))
+        query = '&'.join('%s=%s' % param for param in
+                         sorted(parse_qsl(parts.query, True))
+                         if param != ('page', '1'))
+        return '%s %s://%s%s?%s' % (method, parts.scheme, parts.netloc,
+                                    parts.path, query)
+
+    def adapter(self):
+        """Returns a transport adapter recording resp. replaying"""
+        if self.mode == 'record':
+            return RecordingAdapter(self)
+        return ReplayAdapter(self)
+
+    def mount(self, session):
+        """Sends all requests of `session` through this cassette"""
+        adapter = self.adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def add(self, request, response, elapsed):
+        """Stores the reply to `request` with the token redacted"""
+        headers = dict((name, redact(response.headers[name], self.token))
+                       for name in KEPT_HEADERS if name in response.headers)
+        interaction = {
+            'method': request.method,
+            'url': redact(request.url, self.token),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': headers,
+            'body': redact(response.content.decode('utf-8', 'replace'),
+                           self.token),
+            'elapsed': round(elapsed, 6),
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def reply(self, request):
+        """Returns the next recorded interaction for `request` or None"""
+        key = self.key(request.method, request.url)
+        with self._lock:
+            replies = self._replies.get(key)
+            if not replies:
+                return None
+            if len(replies) > 1:
+                return replies.pop(0)
+            return replies[0]
+
+    def load(self):
+        with self._open('rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+        self.interactions = data['interactions']
+        self._replies = {}
+        for interaction in self.interactions:
+            key = self.key(interaction['method'], interaction['url'])
+            self._replies.setdefault(key, []).append(interaction)
+
+    def save(self):
+        """Writes the interactions recorded so far"""
+        with self._lock:
+            data = json.dumps({'version': 1,
+                               'interactions': self.interactions},
+                              separators=(',', ':'))
+        with self._open('wb') as f:
+            f.write(data.encode('utf-8'))
+
+    def _open(self, mode):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode)
+        return open(self.path, mode)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends the requests and adds the replies to a cassette"""
+
+    def __init__(self, cassette, **kwargs):
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        # reads the whole body, also within the time measured
+        response.content
+        self.cassette.add(request, response, time.time() - start)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Serves the requests from a cassette without network access"""
+
+    def __init__(self, cassette):
+        super(ReplayAdapter, self).__init__()
+        self.cassette = cassette
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        interaction = self.cassette.reply(request)
+        if interaction is None:
+            raise requests.exceptions.ConnectionError(
+                'no reply to %s recorded in %s' % (
+                    self.cassette.key(request.method, request.url),
+                    self.cassette.path), request=request)
+
+        delay = interaction['elapsed'] * self.cassette.latency
+        if isinstance(timeout, tuple):
+            timeout = timeout[1]
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(
+                'replayed reply took longer than %s seconds' % timeout,
+                request=request)
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction.get('reason')
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response._content = interaction['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=delay)
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+===============================
+eudat.accounting.POSIXcollector
+===============================
+"""
+
+import os
+import argparse
+import logging
+import sys
+import threading
+
+try:
+    from ConfigParser import SafeConfigParser
+except ImportError:
+    # Python 3
+    from configparser import SafeConfigParser
+
+try:
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 2 needs the scandir backport
+    from scandir import scandir
+
+from eudat.accounting.client import __version__, LOG, utils, profiling, \
+    singleflight, asynclog, history
+from eudat.accounting.client.__main__ import Application as ApplicationBase
+from eudat.accounting.client.record import AccountingRecord
+
+# st_blocks is always counted in units of 512 bytes
+BLOCK_SIZE = 512
+
+################################################################################
+# Configuration Class #
+################################################################################
+
+
+class Configuration(object):
+    """
+    Get configuration parameters from configuration file
+    """
+
+    def __init__(self, file, logger, fileparser):
+
+        self.file = file
+        self.logger = logger
+        self.fileparser = fileparser
+
+    def parseConf(self):
+
+        """Parse configuration file"""
+
+        print('Configuration file: %s \n'%self.file)
+
+        self.logfile        =  self.fileparser.get('Logging','log_file')
+        self.base_url       =  self.fileparser.get('Report','base_url')
+        self.domain         =  self.fileparser.get('Report','domain')
+        self.account        =  self.fileparser.get('Report','account')
+        self.user           =  self.fileparser.get('Report','user')
+        self.password       =  self.fileparser.get('Report','password')
+        self.service_uuid   =  self.fileparser.get('Report','service_uuid')
+        self.directories    =  self.fileparser.get('Directories','dlist')
+
+        self.workers        =  int(utils.getOption(self.fileparser,
+                                                   'Walker', 'workers', 8))
+        self.size           =  utils.getOption(self.fileparser,
+                                               'Walker', 'size', 'apparent')
+        self.one_filesystem =  utils.getOption(self.fileparser,
+                                               'Walker', 'one_filesystem',
+                                               'no').lower() in \
+                                               ('yes', 'true', 'on', '1')
+        if self.size not in ('apparent', 'allocated'):
+            raise ValueError("size must be 'apparent' or 'allocated', "\
+                             "not %r" % self.size)
+
+        # write the log file from a background thread
+        asynclog.addLogFile(self.logger, self.logfile)
+
+################################################################################
+# Tree walker Class #
+################################################################################
+
+
+def distinctRoots(paths):
+    """Returns the normalized `paths` without those below another one,
+    which would be walked twice
+
+        >>> distinctRoots(['/data/a/', '/data/a/b', '/data/ab', '/data/a'])
+        ['/data/a', '/data/ab']
+    """
+    roots = []
+    for path in sorted(set(os.path.normpath(path) for path in paths)):
+        if not any(path == root or
+                   path.startswith(root.rstrip(os.sep) + os.sep)
+                   for root in roots):
+            roots.append(path)
+    return roots
+
+
+
+class TreeWalker(object):
+    """
+    Parallel walker counting the regular files below a set of directories
+    and adding up their sizes.
+
+    Directories are handed out to a pool of threads through a queue, so
+    that the latency of network file systems is hidden by having many
+    directories read at once. Files with more than one hard link are
+    counted only once. Symbolic links are neither followed nor counted.
+    """
+
+    def __init__(self, workers=8, allocated=False, one_filesystem=False,
+                 logger=LOG):
+        self.workers = workers
+        self.allocated = allocated
+        self.one_filesystem = one_filesystem
+        self.logger = logger
+        self.errors = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def walk(self, paths):
+        """
+        Walk the trees below `paths` and return (number of files, size).
+        Paths below another one, also through symbolic links, are skipped.
+        """
+        roots = distinctRoots(os.path.realpath(path) for path in paths)
+        if len(roots) < len(paths):
+            self.logger.info("Walking %s of %s paths, the others are "\
+                             "below them", len(roots), len(paths))
+        queue = Queue()
+        for path in roots:
+            queue.put((path, os.stat(path).st_dev))
+        totals = []
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      args=(queue, totals))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        queue.join()
+        for thread in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+        return (sum(files for files, size in totals),
+                sum(size for files, size in totals))
+
+    def _work(self, queue, totals):
+        files = 0
+        size = 0
+        while True:
+            item = queue.get()
+            if item is None:
+                queue.task_done()
+                break
+            try:
+                found, used = self._scan(queue, *item)
+                files += found
+                size += used
+            except Exception as e:
+                # keep the worker alive so that the queue is drained
+                self._error(e)
+            finally:
+                queue.task_done()
+        with self._lock:
+            totals.append((files, size))
+
+    def _scan(self, queue, path, dev):
+        """
+        Count the files in directory `path` and queue its sub-directories
+        """
+        files = 0
+        size = 0
+        try:
+            entries = scandir(path)
+        except OSError as e:
+            self._error(e)
+            return files, size
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.one_filesystem and \
+                       entry.stat(follow_symlinks=False).st_dev != dev:
+                        continue
+                    queue.put((entry.path, dev))
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError as e:
+                self._error(e)
+                continue
+            if st.st_nlink > 1:
+                inode = (st.st_dev, st.st_ino)
+                with self._lock:
+                    if inode in self._seen:
+                        continue
+                    self._seen.add(inode)
+            files += 1
+            if self.allocated:
+                size += st.st_blocks * BLOCK_SIZE
+            else:
+                size += st.st_size
+        if hasattr(entries, 'close'):
+            entries.close()
+        return files, size
+
+    def _error(self, e):
+        with self._lock:
+            self.errors += 1
+        self.logger.warn("Skipping: %s", e)
+
+################################################################################
+# EUDAT accounting Class #
+################################################################################
+
+
+class EUDATAccounting(object):
+    """
+    Class implementing the computation of statistics about resource consumption.
+    """
+
+    def __init__( self, conf, logger ):
+        """
+        Initialize object with configuration parameters.
+        """
+        self.conf = conf
+        self.logger = logger
+        # number of files and directories that could not be read
+        self.errors = 0
+
+    def _walk(self):
+        """
+        Walk the configured directories for number of files and used
+        space in bytes
+        """
+        directories = self.conf.directories.split()
+        print("Directories to be accounted:")
+        for directory in directories:
+            print(directory)
+        walker = TreeWalker(self.conf.workers,
+                            self.conf.size == 'allocated',
+                            self.conf.one_filesystem,
+                            self.logger)
+        used_objects, used_space = walker.walk(directories)
+        self.logger.info("Found %s files using %s bytes (%s size)",
+                         used_objects, used_space, self.conf.size)
+        self.errors = walker.errors
+        if walker.errors:
+            self.logger.warn("%s files or directories could not be read",
+                             walker.errors)
+        return used_objects, used_space
+
+    def _toAccountingRecord(self, stats, args):
+        """
+        Cast to format of an eudat accounting record
+        """
+        return AccountingRecord.fromArgs(args,
+                                         account=self.conf.account,
+                                         number=stats[0],
+                                         value=stats[1])
+
+    def collectRecords(self, args):
+        """
+        Collect the accounting records without reporting them
+        """
+        data = self._walk()
+        record = self._toAccountingRecord(data, args)
+        if self.errors:
+            # the totals miss what could not be read, by an unknown share
+            record = utils.applyPartialPolicy(
+                args, record, None, self.logger,
+                reason="%s files or directories could not be read"
+                % self.errors)
+            if record is None:
+                msg = "Unreadable files or directories, partial result "\
+                      "not reported"
+                self.logger.warning(msg)
+                sys.exit(msg)
+
+        acctRecords = []
+        acctRecords.append(record)
+        return acctRecords
+
+    def reportStatistics(self, args):
+        """
+        Report statistical data on resource consumption to remote server
+        """
+        acctRecords = self.collectRecords(args)
+        self.logger.info('Data: %s', acctRecords)
+
+        credentials = utils.getCredentials(self.conf)
+        self.logger.info("Credentials found")
+        self.logger.debug("Credentials: %s", credentials)
+        url = utils.getUrl(self.conf)
+        self.logger.info("URL to call: %s", url)
+        data = acctRecords[0].toQueryString()
+        self.logger.info("Data as query string: %s", data)
+
+        if args.test:
+            print("Test: Would send the following data: " \
+                + data)
+            return None
+
+        response = utils.call(credentials, url, data)
+
+        self.logger.info('Data sent. Status code: %s',
+                         response.status_code)
+        if args.verbose:
+            print("\nData sent. Status code: " \
+                + str(response.status_code))
+            print("Key of generated accounting record: " \
+                + response.text)
+        return acctRecords
+
+
+def main(argv=sys.argv):
+    """
+    Main function called from console command
+    """
+    asynclog.configureLogging()
+    exit_code = 1
+    try:
+        app = Application(argv)
+        singleflight.runSingleFlight(app.args, profiling.runProfiled,
+                                     app.args, app.run)
+        exit_code = 0
+    except singleflight.RunInProgress:
+        exit_code = singleflight.SKIPPED_EXIT_CODE
+    except KeyboardInterrupt:
+        exit_code = 0
+    except Exception as exc:
+        LOG.exception(exc)
+    sys.exit(exit_code)
+
+
+class Application(ApplicationBase):
+    """
+    The main Application class of the POSIXcollector
+
+    :param argv: The command line as a list as ``sys.argv``
+    """
+
+    def __init__(self, argv):
+        ap = argparse.ArgumentParser()
+        ap.add_argument('--version', action='version', version=__version__)
+
+        ap.add_argument('-c', '--configpath', default='./posixcollector.cfg',
+                        help='path to configuration file. '\
+                        'Default: "./posixcollector.cfg" (in the current working directory)')
+
+        utils.addCommonArguments(ap)
+        utils.addDeadlineArguments(ap)
+        singleflight.addSingleFlightArguments(ap)
+        history.addHistoryArguments(ap)
+
+        self.args = ap.parse_args(args=argv[1:])
+        # sneak in some default values that the utility functions expect
+        self.args.unit = 'byte'
+        self.args.service = '(default)'  # XXX TODO: should this come from the config?
+        self.args.object_type = 'file'
+        """Arguments of your app"""
+
+
+    def run(self):
+        LOG.info("POSIXcollector called with: %s", self.args)
+        print("POSIXcollector called with: %s" % str(self.args))
+
+        fileparser = SafeConfigParser()
+        fileparser.read(self.args.configpath)
+
+        logger = logging.getLogger('StorageAccounting')
+        logger.setLevel(logging.INFO)
+
+        configuration = Configuration(self.args.configpath,
+                                      logger, fileparser)
+        configuration.parseConf()
+
+        eurep = EUDATAccounting(configuration, logger)
+        logger.info("Accounting starting ...")
+        acctRecords = eurep.reportStatistics(self.args)
+        logger.info("Accounting finished")
+        return acctRecords
@@ -8,21 +8,20 @@ Command line handling
 """
 
 import argparse
-import logging
 import sys
 
-from eudat.accounting.client import __version__, LOG, utils
+from eudat.accounting.client import __version__, LOG, utils, profiling, \
+    asynclog
 
 
 def main(argv=sys.argv):
     """Main function called from console command
     """
-    logging.basicConfig(filename='.accounting.log', level=logging.INFO,
-                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asynclog.configureLogging()
     exit_code = 1
     try:
         app = Application(argv)
-        app.run()
+        profiling.runProfiled(app.args, app.run)
         exit_code = 0
     except KeyboardInterrupt:
         exit_code = 0
@@ -88,7 +87,7 @@ class Application(object):
         """Arguments of your app"""
 
     def run(self):
-        LOG.info("addRecord called with: " + str(self.args))
+        LOG.info("addRecord called with: %s", self.args)
         credentials = utils.getCredentials(self.args)
         url = utils.getUrl(self.args)
         data = utils.getData(self.args)
@@ -97,10 +96,10 @@ class Application(object):
             if self.args.verbose:
                 print(response.text)
             if not response.ok:
-                LOG.error("status: %s" % response.status_code)
+                LOG.error("status: %s", response.status_code)
                 sys.exit(str(response.status_code))
-            LOG.info("status: %s -- record key: %s" % (response.status_code,
-                                                       response.text))
+            LOG.info("status: %s -- record key: %s", response.status_code,
+                     response.text)
         else:
             print("Dry run; would call %s with %s" % (url, data))
 
@@ -0,0 +1,85 @@
+# attribution of collections to accounts for the collectors of
+# eudat.accounting.client
+
+
+def parseAccounts(text):
+    """Returns the (collection prefix, account) pairs of the whitespace
+    separated `text` of an [Accounts] map. Raises ValueError if a prefix
+    has no account.
+
+        >>> parseAccounts('''/zone/home/a 11100/aaa
+        ...                  /zone/home/b 11100/bbb''')
+        [('/zone/home/a', '11100/aaa'), ('/zone/home/b', '11100/bbb')]
+    """
+    words = text.split()
+    if len(words) % 2:
+        raise ValueError("No account given for collection %s" % words[-1])
+    return list(zip(words[0::2], words[1::2]))
+
+
+class AccountTrie(object):
+    """Maps collections to the account of their longest configured prefix.
+
+    Prefixes match whole path components, so '/zone/home/a' covers
+    '/zone/home/a/x' but not '/zone/home/ab'. A collection below several
+    nested prefixes belongs to the innermost one only.
+
+        >>> trie = AccountTrie([('/zone/home', 'all'),
+        ...                     ('/zone/home/a', 'A')])
+        >>> trie.account('/zone/home/a/data'), trie.account('/zone/home/ab')
+        ('A', 'all')
+        >>> trie.account('/other') is None
+        True
+    """
+
+    def __init__(self, prefixes=()):
+        # nested dictionaries per path component, the account of a prefix
+        # is stored under None
+        self._root = {}
+        for prefix, account in prefixes:
+            self.add(prefix, account)
+
+    def add(self, prefix, account):
+        node = self._root
+        for part in _parts(prefix):
+            node = node.setdefault(part, {})
+        node[None] = account
+
+    def account(self, collection):
+        """Returns the account of `collection` or None"""
+        node = self._root
+        found = node.get(None)
+        for part in _parts(collection):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+    def attribute(self, rows):
+        """Adds up the (collection, objects, space) `rows` per account.
+
+        Returns a dictionary mapping each account to [objects, space] and
+        the [objects, space] of the collections without an account.
+
+            >>> trie = AccountTrie([('/z/a', 'A'), ('/z/a/b', 'B')])
+            >>> totals, unmatched = trie.attribute([('/z/a', 1, 10),
+            ...     ('/z/a/b/c', 2, 20), ('/z/a/x', 3, 30), ('/z/c', 4, 40)])
+            >>> sorted(totals.items()), unmatched
+            ([('A', [4, 40]), ('B', [2, 20])], [4, 40])
+        """
+        totals = {}
+        unmatched = [0, 0]
+        for collection, objects, space in rows:
+            account = self.account(collection)
+            if account is None:
+                total = unmatched
+            else:
+                total = totals.setdefault(account, [0, 0])
+            total[0] += objects
+            total[1] += space
+        return totals, unmatched
+
+
+def _parts(path):
+    return [part for part in path.split('/') if part]
@@ -0,0 +1,218 @@
+# programmatic interface of eudat.accounting.client
+# lets services submit accounting records without blocking their hot paths
+
+
+DEFAULT_BASE_URL = 'https://accounting.eudat.eu'
+DEFAULT_DOMAIN = 'eudat'
+BATCH_WINDOW = 0.05
+MAX_BATCH = 100
+MAX_PENDING = 10000
+
+import threading
+import time
+from concurrent.futures import Future, wait
+from multiprocessing.pool import ThreadPool
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    # Python 3
+    from queue import Queue, Empty, Full
+
+try:
+    import asyncio
+except ImportError:
+    # Python 2
+    asyncio = None
+
+import requests
+
+from eudat.accounting.client import LOG, utils
+
+
+class AccountingError(Exception):
+    """Raised resp. set on the future if a record could not be submitted"""
+
+
+class AccountingClient(object):
+    """Submits AccountingRecords to an accounting server.
+
+    Submissions are collected for up to `batch_window` seconds (or until
+    `max_batch` records are waiting) and then sent together over a pool
+    of `workers` connections. Records with the same account and key
+    submitted within one window are coalesced: only the last one is sent,
+    as it would overwrite the others anyway. At most `max_pending`
+    records are queued; beyond that `submit` waits for up to `timeout`
+    seconds if `block` is set and raises AccountingError otherwise.
+
+    User and password are looked up in the environment variables
+    ACCOUNTING_USER and ACCOUNTING_PW if not given. With `test` set
+    nothing is sent and the futures resolve to None.
+
+        >>> from eudat.accounting.client.record import AccountingRecord
+        >>> with AccountingClient(user='u', password='p', test=True) as c:
+        ...     future = c.submit(AccountingRecord('acc', 1024))
+        >>> future.result() is None
+        True
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, domain=DEFAULT_DOMAIN,
+                 user=None, password=None, workers=4,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                 max_pending=MAX_PENDING, request_timeout=None, test=False,
+                 logger=LOG):
+        try:
+            self.credentials = utils.findCredentials(user, password)
+        except ValueError as e:
+            raise AccountingError(str(e))
+        self.base_url = base_url
+        self.domain = domain
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.request_timeout = request_timeout
+        self.test = test
+        self.logger = logger
+        self._queue = Queue(max_pending)
+        self._outstanding = set()
+        self._lock = threading.Lock()
+        # taken to check _closed and queue a submission resp. to close, so
+        # that nothing is queued behind the sentinel ending the dispatcher
+        self._closing = threading.Lock()
+        self._closed = False
+        self._session = utils.pooledSession(workers)
+        self._pool = ThreadPool(workers)
+        self._dispatcher = threading.Thread(target=self._dispatch,
+                                            name='AccountingClient')
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def submit(self, record, block=True, timeout=None):
+        """Queues `record` for submission and returns a Future resolving
+        to the key of the accounting record created"""
+        with self._closing:
+            if self._closed:
+                raise AccountingError("client is closed")
+            future = Future()
+            with self._lock:
+                self._outstanding.add(future)
+            future.add_done_callback(self._forget)
+            try:
+                self._queue.put((record, future), block, timeout)
+            except Full:
+                self._forget(future)
+                raise AccountingError("too many records pending")
+        return future
+
+    if asyncio is not None:
+        def submitAsync(self, record, loop=None):
+            """Queues `record` without blocking the event loop and returns
+            an asyncio future resolving to the key of the record created"""
+            return asyncio.wrap_future(self.submit(record, block=False),
+                                       loop=loop)
+
+    def flush(self, timeout=None):
+        """Waits until all records submitted so far are done"""
+        with self._lock:
+            outstanding = list(self._outstanding)
+        wait(outstanding, timeout)
+
+    def close(self):
+        """Sends the records still queued and releases the connections"""
+        with self._closing:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._dispatcher.join()
+        self._pool.close()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _forget(self, future):
+        with self._lock:
+            self._outstanding.discard(future)
+
+    def _dispatch(self):
+        """Collects the queued submissions into batches and sends them"""
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            end = time.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0, end - time.time()))
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._send(batch)
+            except Exception as e:
+                # never leave a future unresolved
+                self.logger.exception(e)
+                for record, future in batch:
+                    if not future.done():
+                        future.set_exception(AccountingError(str(e)))
+
+    def _send(self, batch):
+        """Sends a batch of (record, future), coalescing records with the
+        same account and key"""
+        groups = {}
+        order = []
+        for record, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            coalesce = (record.account, record.key) if record.key \
+                else id(future)
+            if coalesce not in groups:
+                groups[coalesce] = [None, []]
+                order.append(coalesce)
+            groups[coalesce][0] = record
+            groups[coalesce][1].append(future)
+        calls = []
+        for coalesce in order:
+            record = groups[coalesce][0]
+            url = utils.URL_PATTERN % (self.base_url, self.domain,
+                                       record.account)
+            calls.append((url, record.toQueryString()))
+        self.logger.debug("Sending %s records for %s submissions",
+                          len(calls), len(batch))
+
+        if self.test:
+            for url, data in calls:
+                self.logger.info("Test: would send %s%s", url, data)
+            responses = [None] * len(calls)
+        else:
+            responses = self._pool.map(self._post, calls)
+
+        for coalesce, (url, data), response in zip(order, calls, responses):
+            for future in groups[coalesce][1]:
+                if response is None:
+                    future.set_result(None)
+                elif isinstance(response, Exception):
+                    future.set_exception(AccountingError(
+                        "Upload of %s failed: %s" % (data, response)))
+                elif not response.ok:
+                    future.set_exception(AccountingError(
+                        "Upload of %s failed: status %s"
+                        % (data, response.status_code)))
+                else:
+                    future.set_result(response.text)
+
+    def _post(self, call):
+        try:
+            return utils.call(self.credentials, call[0], call[1],
+                              self._session, self.request_timeout)
+        except requests.exceptions.RequestException as e:
+            return e
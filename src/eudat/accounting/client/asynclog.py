@@ -0,0 +1,101 @@
+# non-blocking logging for the clients of eudat.accounting.client
+# log records are handed to a queue and written by a background thread
+
+
+LOG_FILE = '.accounting.log'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+import atexit
+import logging
+import logging.handlers
+import os
+import threading
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # Python 2 writes synchronously
+    QueueHandler = QueueListener = None
+else:
+    class ThreadQueueHandler(QueueHandler):
+        """Queues the records as they are. The queue does not leave the
+        process, so the message is only formatted by the writing thread"""
+
+        def prepare(self, record):
+            return record
+
+try:
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+# the handler attached to the loggers per log file and the listeners
+# writing the files
+_handlers = {}
+_listeners = []
+_lock = threading.Lock()
+
+def addLogFile(logger, path, rotating=True, level=logging.INFO,
+               datefmt=DATE_FORMAT):
+    """Makes `logger` write to the file `path`. The file is written by a
+    background thread so that logging does not wait for the disk.
+    Each file gets one handler only, which is not added again to the
+    logger or if a logger it propagates to has it already. Returns the
+    handler."""
+    key = os.path.abspath(path)
+    with _lock:
+        handler = _handlers.get(key)
+        if handler is None:
+            if rotating:
+                target = logging.handlers.RotatingFileHandler(
+                    path, maxBytes=10000000, backupCount=9)
+            else:
+                target = logging.FileHandler(path)
+            target.setLevel(level)
+            target.setFormatter(logging.Formatter(LOG_FORMAT, datefmt))
+            if QueueHandler is None:
+                handler = target
+            else:
+                queue = Queue()
+                listener = QueueListener(queue, target,
+                                         respect_handler_level=True)
+                listener.start()
+                _listeners.append(listener)
+                handler = ThreadQueueHandler(queue)
+                # drop what the file does not want before queueing it
+                handler.setLevel(level)
+            _handlers[key] = handler
+        if not _hasHandler(logger, handler):
+            logger.addHandler(handler)
+    return handler
+
+def configureLogging(path=LOG_FILE, level=logging.INFO):
+    """Replaces logging.basicConfig in the console scripts: the root
+    logger writes to `path` through the queue"""
+    root = logging.getLogger()
+    root.setLevel(level)
+    addLogFile(root, path, rotating=False, level=level, datefmt=None)
+
+def flushLogging():
+    """Waits until the records queued so far have been written"""
+    for listener in list(_listeners):
+        listener.queue.join()
+
+def stopLogging():
+    """Writes the records still queued and stops the background threads"""
+    with _lock:
+        while _listeners:
+            _listeners.pop().stop()
+
+atexit.register(stopLogging)
+
+def _hasHandler(logger, handler):
+    while logger is not None:
+        if handler in logger.handlers:
+            return True
+        if not logger.propagate:
+            break
+        logger = logger.parent
+    return False
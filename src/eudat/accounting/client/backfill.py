@@ -0,0 +1,156 @@
+# historical backfill for the iRODScollector of eudat.accounting.client
+# turns the creation times of the objects into a series of past records
+
+
+INTERVALS = {'daily': 1, 'weekly': 7}
+STATE_SUFFIX = '.backfill'
+BATCH_SIZE = 100
+DAY = 86400
+MEASURE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+KEY_TIME_FORMAT = '%Y%m%d%H%M'
+
+import json
+import os
+import time
+from bisect import bisect_left
+
+from eudat.accounting.client import LOG, utils
+
+
+def parseInterval(interval):
+    """Returns the days of 'daily', 'weekly' or a number of days
+
+        >>> parseInterval('weekly'), parseInterval('0.5')
+        (7, 0.5)
+    """
+    if interval in INTERVALS:
+        return INTERVALS[interval]
+    days = float(interval)
+    if days <= 0:
+        raise ValueError("Interval must be positive, not %r" % interval)
+    return days
+
+def boundaries(start, end, days):
+    """Returns the times from `start` to `end` `days` apart
+
+        >>> boundaries(0, 3 * DAY, 1) == [0, DAY, 2 * DAY, 3 * DAY]
+        True
+    """
+    step = int(days * DAY)
+    return list(range(int(start), int(end) + 1, step))
+
+def cumulativeUsage(rows, trie, times):
+    """Adds up the (collection, creation time, space, objects) `rows` per
+    account of `trie` into the number of objects and used space created
+    up to each of the ascending `times`.
+
+    Returns a dictionary mapping each account to a list of
+    (objects, space) per time; rows without an account are dropped.
+
+        >>> from eudat.accounting.client.accounts import AccountTrie
+        >>> usage = cumulativeUsage([('/z/a', 5, 10, 1), ('/z/a/b', 15, 20, 2),
+        ...                          ('/z/c', 0, 99, 9), ('/z/a', 25, 1, 1)],
+        ...                         AccountTrie([('/z/a', 'A')]), [0, 10, 20])
+        >>> usage
+        {'A': [(0, 0), (1, 10), (3, 30)]}
+    """
+    deltas = {}
+    for collection, created, space, objects in rows:
+        account = trie.account(collection)
+        if account is None:
+            continue
+        index = bisect_left(times, created)
+        if index == len(times):
+            # created after the last time
+            continue
+        delta = deltas.setdefault(account, [[0, 0] for t in times])
+        delta[index][0] += objects
+        delta[index][1] += space
+    usage = {}
+    for account, delta in deltas.items():
+        objects = space = 0
+        series = []
+        for count, size in delta:
+            objects += count
+            space += size
+            series.append((objects, space))
+        usage[account] = series
+    return usage
+
+def measureTime(t):
+    return time.strftime(MEASURE_TIME_FORMAT, time.localtime(t))
+
+def recordKey(prefix, t):
+    """Key of the record of time `t`; a resumed or repeated backfill
+    overwrites the records sent before instead of duplicating them"""
+    return '%s-%s' % (prefix, time.strftime(KEY_TIME_FORMAT,
+                                            time.localtime(t)))
+
+
+class BackfillUpload(object):
+    """Sends the (url, query string) `calls` of a backfill in batches and
+    keeps the calls and those done in the state file `path`, so that an
+    interrupted upload can be resumed without scanning the catalog
+    again"""
+
+    def __init__(self, path, logger=LOG):
+        self.path = path
+        self.logger = logger
+        self.calls = []
+        self.done = set()
+
+    def load(self, parameters):
+        """Restores an unfinished upload started with the same
+        `parameters`. Returns False if there is none."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('parameters') != parameters:
+            self.logger.info("Ignoring the backfill state in %s of other "\
+                             "parameters", self.path)
+            return False
+        self.parameters = parameters
+        self.calls = [tuple(call) for call in state['calls']]
+        self.done = set(state['done'])
+        return True
+
+    def start(self, parameters, calls):
+        self.parameters = parameters
+        self.calls = list(calls)
+        self.done = set()
+        self.save()
+
+    def pending(self):
+        return [(url, data) for url, data in self.calls
+                if data not in self.done]
+
+    def upload(self, credentials, batch_size=BATCH_SIZE, workers=4):
+        """Sends the pending calls; returns the number of calls failed"""
+        pending = self.pending()
+        self.logger.info("Uploading %s of %s backfill records",
+                         len(pending), len(self.calls))
+        failed = 0
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            responses = utils.callAll(credentials, batch, workers)
+            for (url, data), response in zip(batch, responses):
+                if isinstance(response, Exception) or not response.ok:
+                    failed += 1
+                    self.logger.error("Upload of %s failed: %s", data,
+                                      getattr(response, 'status_code',
+                                              response))
+                else:
+                    self.done.add(data)
+            self.save()
+        if not failed:
+            os.remove(self.path)
+        return failed
+
+    def save(self):
+        """Atomically replaces the state file"""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'parameters': self.parameters, 'calls': self.calls,
+                       'done': sorted(self.done)}, f)
+        os.rename(tmp, self.path)
@@ -0,0 +1,230 @@
+# aggregation of bulk iCAT dumps for the iRODScollector of
+# eudat.accounting.client
+# a dump holds one line per replica with the fields of DUMP_COLUMNS
+
+
+DUMP_COLUMNS = ("COLL_NAME", "DATA_ID", "DATA_SIZE", "%s", "DATA_OWNER_NAME")
+SEPARATOR = b'|'
+# bytes of the dump parsed at a time; bounds the memory used
+CHUNK_SIZE = 16 * 1024 * 1024
+
+import mmap
+import os
+
+try:
+    import numpy
+except ImportError:
+    # aggregated line by line
+    numpy = None
+
+from eudat.accounting.client import LOG
+
+
+def readChunks(path, chunk_size=CHUNK_SIZE):
+    """Yields the content of the file `path` in pieces of about
+    `chunk_size` bytes ending at line ends. The file is memory mapped, so
+    only the pieces being parsed need to be in memory."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = min(start + chunk_size, size)
+                if end < size:
+                    newline = mapped.rfind(b'\n', start, end)
+                    if newline < 0:
+                        # a line longer than a chunk
+                        newline = mapped.find(b'\n', end)
+                    end = size if newline < 0 else newline + 1
+                yield mapped[start:end]
+                start = end
+        finally:
+            mapped.close()
+
+
+class DumpAggregator(object):
+    """Adds up the replicas of a dump per account and, if grouped by
+    them, per resource and data owner.
+
+    The account of a collection is the one of its longest matching prefix
+    in `trie` (an AccountTrie). With NumPy each chunk of the dump is
+    parsed with one split and aggregated with a vectorized group-by over
+    integer codes of account, resource and owner; otherwise line by line.
+
+    :param trie: AccountTrie mapping collections to accounts
+    :param group_by: any of 'resource' and 'owner'
+    :param chunk_size: bytes of the dump parsed at a time
+    :param vectorized: use NumPy; default: if it is installed
+    """
+
+    def __init__(self, trie, group_by=(), chunk_size=CHUNK_SIZE,
+                 vectorized=None, logger=LOG):
+        self.trie = trie
+        self.by_resource = 'resource' in group_by
+        self.by_owner = 'owner' in group_by
+        self.chunk_size = chunk_size
+        if vectorized is None:
+            vectorized = numpy is not None
+        elif vectorized and numpy is None:
+            raise ImportError("NumPy is needed for the vectorized "
+                              "aggregation of dumps")
+        self.vectorized = vectorized
+        self.logger = logger
+        # account of each collection seen so far
+        self._accounts = {}
+        # codes of the collections, resources and owners seen so far,
+        # the accounts, resources and owners they stand for and the codes
+        # of those
+        self._accountCodes = {}
+        self._accountNames = []
+        self._accountIndex = {}
+        self._resourceCodes = {}
+        self._resources = []
+        self._resourceIndex = {}
+        self._ownerCodes = {}
+        self._owners = []
+        self._ownerIndex = {}
+
+    def aggregate(self, path):
+        """Returns a dictionary mapping (account, resource, owner) to
+        [number of replicas, used space]. Resource and owner are '' if not
+        grouped by; the account is None for collections without one."""
+        totals = {}
+        rows = 0
+        for chunk in readChunks(path, self.chunk_size):
+            if self.vectorized:
+                rows += self._aggregateArrays(chunk, totals)
+            else:
+                rows += self._aggregateLines(chunk.split(b'\n'), totals)
+        self.logger.info("Aggregated %s rows of %s into %s groups",
+                         rows, path, len(totals))
+        return totals
+
+    def _account(self, collection):
+        if collection not in self._accounts:
+            self._accounts[collection] = self.trie.account(
+                collection.decode('utf-8'))
+        return self._accounts[collection]
+
+    def _aggregateLines(self, lines, totals):
+        rows = 0
+        for line in lines:
+            fields = line.split(SEPARATOR)
+            if len(fields) != len(DUMP_COLUMNS) or not fields[2].isdigit():
+                # e.g. CAT_NO_ROWS_FOUND
+                continue
+            key = (self._account(fields[0]),
+                   fields[3].decode('utf-8') if self.by_resource else '',
+                   fields[4].decode('utf-8') if self.by_owner else '')
+            total = totals.setdefault(key, [0, 0])
+            total[0] += 1
+            total[1] += int(fields[2])
+            rows += 1
+        return rows
+
+    def _aggregateArrays(self, chunk, totals):
+        """Like _aggregateLines, skipping the same lines: those without
+        all fields, checked per line, or without a numeric DATA_SIZE"""
+        width = len(DUMP_COLUMNS)
+        if _fieldsPerLine(chunk).min() == width:
+            fields = chunk.rstrip(b'\n').replace(b'\n',
+                                                 SEPARATOR).split(SEPARATOR)
+        else:
+            # lines with other content, keep only the well formed ones
+            fields = []
+            for line in chunk.split(b'\n'):
+                parts = line.split(SEPARATOR)
+                if len(parts) == width:
+                    fields.extend(parts)
+        if not fields:
+            return 0
+        sizes = numpy.array(fields[2::width])
+        numeric = numpy.char.isdigit(sizes)
+        if numeric.all():
+            column = lambda index: fields[index::width]
+        else:
+            # e.g. an empty DATA_SIZE
+            rows = numpy.flatnonzero(numeric).tolist()
+            column = lambda index: [fields[row * width + index]
+                                    for row in rows]
+            sizes = sizes[numeric]
+            if not len(sizes):
+                return 0
+        sizes = sizes.astype(numpy.int64)
+
+        # integer codes of account, resource and owner per row; strings
+        # are only hashed, never sorted
+        key = numpy.array(self._codes(self._accountCodes, column(0),
+                                      self._accountCode), dtype=numpy.int64)
+        radix = []
+        for grouped, index, codes, names, known in (
+                (self.by_resource, 3, self._resourceCodes, self._resources,
+                 self._resourceIndex),
+                (self.by_owner, 4, self._ownerCodes, self._owners,
+                 self._ownerIndex)):
+            if grouped:
+                values = self._codes(codes, column(index),
+                                     lambda value: _newCode(names, known,
+                                                            value))
+                key = key * len(names) + numpy.array(values,
+                                                     dtype=numpy.int64)
+            radix.append(len(names) if grouped else 1)
+
+        keys, inverse = numpy.unique(key, return_inverse=True)
+        inverse = inverse.ravel()
+        counts = numpy.bincount(inverse)
+        order = numpy.argsort(inverse, kind='mergesort')
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        sums = numpy.add.reduceat(sizes[order], starts)
+
+        for key, count, space in zip(keys.tolist(), counts.tolist(),
+                                     sums.tolist()):
+            account, rest = divmod(key, radix[0] * radix[1])
+            resource, owner = divmod(rest, radix[1])
+            total = totals.setdefault(
+                (self._accountNames[account],
+                 self._resources[resource] if self.by_resource else '',
+                 self._owners[owner] if self.by_owner else ''), [0, 0])
+            total[0] += count
+            total[1] += space
+        return len(sizes)
+
+    def _codes(self, codes, values, new):
+        """Returns the codes of `values`, adding the ones not seen yet"""
+        try:
+            return [codes[value] for value in values]
+        except KeyError:
+            for value in set(values).difference(codes):
+                codes[value] = new(value)
+            return [codes[value] for value in values]
+
+    def _accountCode(self, collection):
+        return _newCode(self._accountNames, self._accountIndex,
+                        self._account(collection))
+
+
+def _fieldsPerLine(chunk):
+    """Returns an array of the number of fields of each line of `chunk`,
+    counting the separators of all lines at once"""
+    data = numpy.frombuffer(chunk, dtype=numpy.uint8)
+    separators = numpy.flatnonzero(data == ord(SEPARATOR))
+    ends = numpy.flatnonzero(data == ord(b'\n'))
+    if not chunk.endswith(b'\n'):
+        ends = numpy.append(ends, len(data))
+    before = numpy.searchsorted(separators, ends)
+    return numpy.diff(numpy.concatenate(([0], before))) + 1
+
+
+def _newCode(names, index, value):
+    """Returns the position of `value` in `names` as kept in the dictionary
+    `index`, appending it to both if needed"""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    code = index.get(value)
+    if code is None:
+        code = index[value] = len(names)
+        names.append(value)
+    return code
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+===============================
+eudat.accounting.history
+===============================
+
+Local history of the values reported by the collectors and the
+``accountingHistory`` command querying it.
+"""
+
+HISTORY_FILE = '.accounting-history.db'
+# raw measurements are kept for RAW_DAYS, then one per day for DAILY_DAYS,
+# then one per week; KEEP_DAYS = 0 keeps them forever
+RAW_DAYS = 31
+DAILY_DAYS = 365
+KEEP_DAYS = 0
+DAY = 86400
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M',
+                '%Y-%m-%d')
+OUTPUT_FORMATS = ('text', 'csv', 'json')
+
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+
+from eudat.accounting.client import __version__, LOG, asynclog
+
+SCHEMA = """
+create table if not exists measurements (
+    account text not null,
+    type text not null,
+    time integer not null,
+    value numeric,
+    number integer,
+    unit text,
+    quality text,
+    primary key (account, type, time)
+) without rowid;
+"""
+
+
+def addHistoryArguments(ap):
+    """
+    Add commandline arguments controlling the local history
+    """
+    ap.add_argument('--history', default='',
+                    help='local file the records of each run are added to '\
+                    '(see accountingHistory). '\
+                    'Default: "" - no history kept')
+
+def storeHistory(args, records):
+    """Adds the `records` of a run to the history file given with
+    `--history` and applies the default retention policy"""
+    path = getattr(args, 'history', '')
+    if not path or not records:
+        return
+    store = HistoryStore(path)
+    try:
+        count = store.append(records)
+        store.prune()
+    finally:
+        store.close()
+    LOG.info("Added %s records to the history in %s", count, path)
+
+def parseTime(value, default=None):
+    """Returns the seconds since the epoch of a number or local date resp.
+    time as given with -m/--measure_time, or `default` if empty
+
+        >>> parseTime('1500000000')
+        1500000000
+        >>> parseTime('', 42)
+        42
+        >>> parseTime('yesterday')
+        Traceback (most recent call last):
+        ...
+        ValueError: Unsupported time: 'yesterday'
+    """
+    value = str(value).strip()
+    if not value:
+        return default
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    for format in TIME_FORMATS:
+        try:
+            return int(time.mktime(time.strptime(value, format)))
+        except ValueError:
+            continue
+    raise ValueError("Unsupported time: %r" % value)
+
+def linearFit(points):
+    """Returns (slope, intercept) of the least squares line through the
+    (x, y) `points`; the slope is 0 for fewer than two distinct x
+
+        >>> linearFit([(0, 1), (1, 3), (2, 5)])
+        (2.0, 1.0)
+        >>> linearFit([(5, 7)])
+        (0.0, 7.0)
+    """
+    n = len(points)
+    mean_x = float(sum(x for x, y in points)) / n
+    mean_y = float(sum(y for x, y in points)) / n
+    sxx = sum((x - mean_x) ** 2 for x, y in points)
+    if not sxx:
+        return 0.0, mean_y
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    slope = sxy / sxx
+    return slope, mean_y - slope * mean_x
+
+def trend(series, horizon=30, limit=None):
+    """Summarizes the (time, value, number) `series` of one account: first
+    and last value, the change between them, the growth per day of a
+    linear fit, the value forecast `horizon` days after the last
+    measurement and, if `limit` is given, when the fit reaches it
+
+        >>> t = trend([(0, 100, 1), (DAY, 150, 2), (2 * DAY, 200, 3)], 10)
+        >>> t['change'], t['rate'], t['forecast']
+        (100, 50.0, 700.0)
+    """
+    points = [(t, float(v)) for t, v, n in series]
+    slope, intercept = linearFit(points)
+    last = series[-1][0]
+    result = {
+        'first_time': series[0][0],
+        'first': series[0][1],
+        'last_time': last,
+        'last': series[-1][1],
+        'change': series[-1][1] - series[0][1],
+        'rate': slope * DAY,
+        'forecast': intercept + slope * (last + horizon * DAY),
+        'measurements': len(series),
+    }
+    if limit is not None:
+        result['limit_reached'] = None
+        if slope > 0:
+            result['limit_reached'] = max(last, int((limit - intercept)
+                                                    / slope))
+    return result
+
+
+class HistoryStore(object):
+    """The measurements of the collectors in a local SQLite file, one row
+    per account, type and time, clustered by account and time"""
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in
+                   self.db.execute("pragma table_info(measurements)")]
+        if 'quality' not in columns:
+            # a history written before partial results were marked
+            with self.db:
+                self.db.execute("alter table measurements "
+                                "add column quality text")
+
+    def append(self, records, now=None):
+        """Stores the AccountingRecords `records`, measured at their
+        measure_time or `now`, with their quality if they are partial or
+        estimated. A measurement of the same account and type at the same
+        time replaces the former one. Returns their number."""
+        if now is None:
+            now = int(time.time())
+        rows = [(record.account, record.type,
+                 parseTime(record.measure_time, now), record.value,
+                 record.number if record.number != '' else None,
+                 record.unit, record.quality or None) for record in records]
+        with self.db:
+            self.db.executemany(
+                "insert or replace into measurements "
+                "(account, type, time, value, number, unit, quality) "
+                "values (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def accounts(self):
+        """Returns the (account, type) pairs with measurements"""
+        return self.db.execute("select distinct account, type "
+                               "from measurements order by 1, 2").fetchall()
+
+    def measurements(self, account, type='storage', start=None, end=None):
+        """Returns the (time, value, number, quality) of `account` and
+        `type` between `start` and `end` in the order of time. The
+        quality is None for full measurements."""
+        sql = "select time, value, number, quality from measurements " \
+              "where account = ? and type = ?"
+        parameters = [account, type]
+        if start is not None:
+            sql += " and time >= ?"
+            parameters.append(start)
+        if end is not None:
+            sql += " and time <= ?"
+            parameters.append(end)
+        return self.db.execute(sql + " order by time", parameters).fetchall()
+
+    def series(self, account, type='storage', start=None, end=None,
+               complete=False):
+        """Returns the (time, value, number) of `account` and `type` between
+        `start` and `end` in the order of time, only those of full
+        measurements if `complete`"""
+        return [row[:3] for row in
+                self.measurements(account, type, start, end)
+                if not (complete and row[3])]
+
+    def prune(self, raw_days=RAW_DAYS, daily_days=DAILY_DAYS,
+              keep_days=KEEP_DAYS, now=None):
+        """Applies the retention policy: measurements older than `raw_days`
+        are thinned out to the last one per day, older than `daily_days`
+        to the last one per week and older than `keep_days` (if not 0)
+        removed. Full measurements are kept rather than later partial or
+        estimated ones. Returns the number of measurements removed."""
+        if now is None:
+            now = int(time.time())
+        removed = 0
+        with self.db:
+            for days, bucket in ((raw_days, DAY), (daily_days, 7 * DAY)):
+                removed += self.db.execute(
+                    "delete from measurements where time < ? and exists "
+                    "(select 1 from measurements better "
+                    "where better.account = measurements.account "
+                    "and better.type = measurements.type "
+                    "and better.time / ? = measurements.time / ? "
+                    "and ((better.quality is null) > "
+                    "(measurements.quality is null) "
+                    "or (better.quality is null) = "
+                    "(measurements.quality is null) "
+                    "and better.time > measurements.time))",
+                    (now - days * DAY, bucket, bucket)).rowcount
+            if keep_days:
+                removed += self.db.execute(
+                    "delete from measurements where time < ?",
+                    (now - keep_days * DAY,)).rowcount
+        return removed
+
+    def close(self):
+        self.db.close()
+
+
+def main(argv=sys.argv):
+    """
+    Main function called from console command
+    """
+    asynclog.configureLogging()
+    exit_code = 1
+    try:
+        app = Application(argv)
+        app.run()
+        exit_code = 0
+    except KeyboardInterrupt:
+        exit_code = 0
+    except Exception as exc:
+        LOG.exception(exc)
+        print("Error: %s" % exc)
+    sys.exit(exit_code)
+
+
+class Application(object):
+    """
+    Query and maintain the local history of the collectors
+
+    :param argv: The command line as a list as ``sys.argv``
+    """
+
+    def __init__(self, argv):
+        ap = argparse.ArgumentParser()
+        ap.add_argument('--version', action='version', version=__version__)
+        ap.add_argument('command', choices=('show', 'trend', 'prune'),
+                        help='"show" the measurements, summarize their '\
+                        '"trend" per account or "prune" them according to '\
+                        'the retention policy')
+        ap.add_argument('account', nargs='*',
+                        help='accounts to be shown. '\
+                        'Default: all')
+        ap.add_argument('--history', default=HISTORY_FILE,
+                        help='the history file. '\
+                        'Default: "%s"' % HISTORY_FILE)
+        ap.add_argument('-T', '--type', default='',
+                        help='type of the resource accounted. '\
+                        'Default: all')
+        ap.add_argument('--since', default='',
+                        help='first time shown as seconds since the epoch or '\
+                        'YYYY-MM-DD[ HH:MM[:SS]]. '\
+                        'Default: "" - from the start')
+        ap.add_argument('--until', default='',
+                        help='last time shown. '\
+                        'Default: "" - up to the end')
+        ap.add_argument('-f', '--format', default='text',
+                        choices=OUTPUT_FORMATS,
+                        help='output format. '\
+                        'Default: text')
+        ap.add_argument('--horizon', type=float, default=30,
+                        help='days after the last measurement the trend is '\
+                        'forecast for. '\
+                        'Default: 30')
+        ap.add_argument('--limit', type=float, default=None,
+                        help='value (e.g. a quota) for which the trend tells '\
+                        'when it is reached. '\
+                        'Default: not set')
+        ap.add_argument('--raw-days', type=float, default=RAW_DAYS,
+                        help='prune: days all measurements are kept. '\
+                        'Default: %s' % RAW_DAYS)
+        ap.add_argument('--daily-days', type=float, default=DAILY_DAYS,
+                        help='prune: days one measurement per day is kept, '\
+                        'one per week after that. '\
+                        'Default: %s' % DAILY_DAYS)
+        ap.add_argument('--keep-days', type=float, default=KEEP_DAYS,
+                        help='prune: days after which measurements are '\
+                        'removed. '\
+                        'Default: %s - never' % KEEP_DAYS)
+
+        self.args = ap.parse_args(args=argv[1:])
+        """Arguments of your app"""
+
+    def run(self, out=None):
+        LOG.info("accountingHistory called with: %s", self.args)
+        out = out or sys.stdout
+        store = HistoryStore(self.args.history)
+        try:
+            if self.args.command == 'prune':
+                removed = store.prune(self.args.raw_days,
+                                      self.args.daily_days,
+                                      self.args.keep_days)
+                out.write("Removed %s measurements\n" % removed)
+                return removed
+            rows = self._rows(store)
+        finally:
+            store.close()
+        self._write(rows, out)
+        return rows
+
+    def _rows(self, store):
+        """Returns the rows to be shown as list of dictionaries"""
+        start = parseTime(self.args.since)
+        end = parseTime(self.args.until)
+        rows = []
+        for account, type in store.accounts():
+            if self.args.account and account not in self.args.account or \
+               self.args.type and type != self.args.type:
+                continue
+            if self.args.command == 'trend':
+                # partial and estimated values would distort the fit
+                series = store.series(account, type, start, end,
+                                      complete=True)
+                if not series:
+                    continue
+                row = {'account': account, 'type': type}
+                row.update(trend(series, self.args.horizon, self.args.limit))
+                rows.append(row)
+            else:
+                rows.extend({'account': account, 'type': type, 'time': t,
+                             'value': value, 'number': number,
+                             'quality': quality}
+                            for t, value, number, quality in
+                            store.measurements(account, type, start, end))
+        return rows
+
+    def _write(self, rows, out):
+        if self.args.format == 'json':
+            json.dump(rows, out, indent=1, sort_keys=True)
+            out.write('\n')
+            return
+        if not rows:
+            return
+        names = sorted(rows[0], key=_columnOrder)
+        if self.args.format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(names)
+            for row in rows:
+                writer.writerow([row[name] for name in names])
+            return
+        for row in rows:
+            out.write(' '.join('%s=%s' % (name, _formatValue(name, row[name]))
+                               for name in names) + '\n')
+
+
+def _columnOrder(name):
+    order = ('account', 'type', 'time', 'value', 'number', 'quality',
+             'first_time', 'first', 'last_time', 'last', 'change', 'rate',
+             'forecast', 'limit_reached', 'measurements')
+    return order.index(name) if name in order else len(order)
+
+def _formatValue(name, value):
+    if value is None:
+        return '-'
+    if name.endswith('time') or name == 'limit_reached':
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(value))
+    if isinstance(value, float):
+        return '%.1f' % value
+    return value
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,15 @@ eudat.accounting.iRODScollector
 ===============================
 """
 
+import os
 import json
+import time
 import argparse
 import logging
-import logging.handlers
 import sys
 import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
 
 try:
     from ConfigParser import SafeConfigParser
@@ -18,8 +21,20 @@ except ImportError:
     # Python 3
     from configparser import SafeConfigParser
 
-from eudat.accounting.client import __version__, LOG, utils
+from eudat.accounting.client import __version__, LOG, utils, profiling, \
+    singleflight, asynclog, icat, history
+from eudat.accounting.client.accounts import AccountTrie, parseAccounts
+from eudat.accounting.client.dump import DumpAggregator, DUMP_COLUMNS, \
+    CHUNK_SIZE
+from eudat.accounting.client import backfill
 from eudat.accounting.client.__main__ import Application as ApplicationBase
+from eudat.accounting.client.record import AccountingRecord
+
+# iCAT stores timestamps as zero padded seconds since the epoch
+ICAT_TIME_FORMAT = '%011d'
+
+# separator used in the iquest output format of grouped queries
+GROUP_SEPARATOR = '|'
 
 ################################################################################
 # Configuration Class #
@@ -52,19 +67,56 @@ class Configuration(object):
         self.service_uuid   =  self.fileparser.get('Report','service_uuid')
         self.collections    =  self.fileparser.get('Collections','clist')
 
-        #create a file handler
-        handler = logging.handlers.RotatingFileHandler(self.logfile, \
-                                                   maxBytes=10000000, \
-                                                   backupCount=9)
-        handler.setLevel(logging.INFO)
+        # optional incremental accounting
+        self.state_file     =  utils.getOption(self.fileparser,
+                                               'Incremental', 'state_file')
+        self.full_interval  =  float(utils.getOption(self.fileparser,
+                                                     'Incremental',
+                                                     'full_interval', 7))
+
+        # optional grouping by storage resource and/or data owner
+        self.group_by       =  utils.getOption(self.fileparser,
+                                               'Groups', 'group_by', '').split()
+        self.type_template  =  utils.getOption(self.fileparser,
+                                               'Groups', 'type_template',
+                                               '{type}')
+        self.resource_attr  =  utils.getOption(self.fileparser,
+                                               'Groups', 'resource_attribute',
+                                               'RESC_NAME')
+
+        # optional splitting of large collections into parallel shards
+        self.sharded        =  utils.getOption(self.fileparser,
+                                               'Sharding', 'collections',
+                                               '').split()
+        self.shard_workers  =  int(utils.getOption(self.fileparser,
+                                                   'Sharding', 'workers', 4))
+        self.shard_retries  =  int(utils.getOption(self.fileparser,
+                                                   'Sharding', 'retries', 2))
 
-        # create a logging format
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s\
-                                            - %(message)s',"%Y-%m-%d %H:%M:%S")
-        handler.setFormatter(formatter)
+        # optional direct access to the iCAT database instead of iquest
+        self.icat_driver    =  utils.getOption(self.fileparser,
+                                               'iCAT', 'driver')
+        self.icat_dsn       =  utils.getOption(self.fileparser,
+                                               'iCAT', 'dsn', '')
+        self.icat_connections = int(utils.getOption(self.fileparser,
+                                                    'iCAT', 'connections', 2))
 
-        # add the handlers to the logger
-        self.logger.addHandler(handler)
+        # optional attribution of the collections to several accounts
+        self.accounts       =  parseAccounts(utils.getOption(
+                                   self.fileparser, 'Accounts', 'map', ''))
+        self.unmatched_account = utils.getOption(self.fileparser,
+                                                 'Accounts', 'unmatched')
+
+        # optional aggregation of a bulk dump of the catalog
+        self.dump_file      =  utils.getOption(self.fileparser,
+                                               'Dump', 'file')
+        self.dump_export    =  utils.getOption(self.fileparser, 'Dump',
+                                               'export', 'no') == 'yes'
+        self.dump_chunk_size = int(utils.getOption(self.fileparser, 'Dump',
+                                                   'chunk_size', CHUNK_SIZE))
+
+        # write the log file from a background thread
+        asynclog.addLogFile(self.logger, self.logfile)
 
 ################################################################################
 # EUDAT accounting Class #
@@ -82,98 +134,797 @@ class EUDATAccounting(object):
         """
         self.conf = conf
         self.logger = logger
+        self.deadline = utils.Deadline()
+        # fraction of the collections covered by the result
+        self.completeness = 1.0
+        self.icat = None
+        if conf.icat_driver:
+            self.icat = icat.ICATDatabase(conf.icat_driver, conf.icat_dsn,
+                                          conf.icat_connections, logger)
 
-    def _query_iCATDb(self):
+    def _query_iCATDb(self, full=False):
         """
         Query iCATdb for number of stored objects and used space in bytes
+
+        If a state file is configured only the objects created since the
+        last run are queried and added to the stored per-collection totals.
+        A full scan is done if `full` is set, if there is no state yet or
+        if the last full scan is older than the configured interval.
         """
         collections = self.conf.collections.split()
         total_objects = 0
         total_space   = 0
+        condition = ''
+        now = int(time.time())
+        state = None
+        if self.conf.state_file:
+            state = self._load_state()
+            # objects created during this run are left for the next one
+            condition = " and DATA_CREATE_TIME <= '%s'" \
+                        % (ICAT_TIME_FORMAT % now)
+            if state is None or full or \
+               now - state['last_full'] >= self.conf.full_interval * 86400:
+                self.logger.info("Doing a full scan of all collections")
+                state = {'last_full': now, 'collections': {}}
+            else:
+                self.logger.info("Doing an incremental scan of objects "\
+                                 "created since %s", state['mark'])
         print("Collections to be accounted:")
         for collection in collections:
             print(collection)
             try:
-                # query size of the collection in bytes
-                out=self._raw_query(collection,"DATA_SIZE","sum")
-
-                # check that output is correct and starting with DATA_SIZE
-                if out[:9]=="DATA_SIZE":
-                    out     = int(filter(str.isdigit, out))
-                    total_space+=int(out)
-                    self.logger.info("Storage space for collection: "\
-                                     +collection+": "+str(out))
-                else:
-                    self.logger.warn("Wrong output for storage space "\
-                                     "in collection: "+collection)
-
-                # query number of objects of the collection
-                out=self._raw_query(collection,"DATA_ID","count")
-
-                # check that output is correct and starting with DATA_ID
-                if out[:7]=="DATA_ID":
-                    out= int(filter(str.isdigit, out))
-                    total_objects+=int(out)
-                    self.logger.info("number of objects for collection "\
-                                     +collection+": "+str(out))
+                known = state and state['collections'].get(collection)
+                if known:
+                    objects, space = self._query_delta(collection,
+                                                       state['mark'],
+                                                       known, condition)
+                elif collection in self.conf.sharded and self.icat is None:
+                    objects, space = self._query_sharded(collection,
+                                                         condition)
                 else:
-                    self.logger.warn("Wrong output for object number "\
-                                     "in collection: "+collection)
+                    objects, space = self._query_collection(collection,
+                                                            condition)
+                total_space+=space
+                total_objects+=objects
+                if state is not None:
+                    state['collections'][collection] = [objects, space]
+
+            except utils.DeadlineExceeded:
+                self.completeness = float(collections.index(collection)) \
+                                    / len(collections)
+                break
 
             except Exception as e:
                 sys.stdout.write("Exception %s encountered!" % str(e))
-                self.logger.warn("Exception %s encountered!" % str(e))
+                self.logger.warn("Exception %s encountered!", e)
                 sys.exit(1)
 
+        if state is not None and self.completeness == 1.0:
+            state['mark'] = now
+            self._save_state(state)
+
         used_objects= total_objects
         used_space  = total_space
 
         return used_objects, used_space
 
-    def _raw_query(self,collection,data_type,db_func):
+    def _query_collection(self, collection, condition=''):
+        """
+        Query number of objects and used space in bytes of one collection
+        """
+        if self.icat is not None:
+            # one statement for both; no sharding needed
+            objects, space = self._icat_query(self.icat.collectionTotals,
+                                              collection, condition)
+            self.logger.info("Storage space for collection: %s: %s",
+                             collection, space)
+            self.logger.info("number of objects for collection %s: %s",
+                             collection, objects)
+            return objects, space
+
+        # query size of the collection in bytes
+        out=self._raw_query(collection,"DATA_SIZE","sum",condition)
+
+        # check that output is correct and starting with DATA_SIZE
+        space = self._parse_output(out,"DATA_SIZE")
+        if space is not None:
+            self.logger.info("Storage space for collection: %s: %s",
+                             collection, space)
+        else:
+            space = 0
+            self.logger.warn("Wrong output for storage space "\
+                             "in collection: %s", collection)
+
+        # query number of objects of the collection
+        out=self._raw_query(collection,"DATA_ID","count",condition)
+
+        # check that output is correct and starting with DATA_ID
+        objects = self._parse_output(out,"DATA_ID")
+        if objects is not None:
+            self.logger.info("number of objects for collection %s: %s",
+                             collection, objects)
+        else:
+            objects = 0
+            self.logger.warn("Wrong output for object number "\
+                             "in collection: %s", collection)
+
+        return objects, space
+
+    def _query_delta(self, collection, mark, known, condition=''):
+        """
+        Add the objects created since `mark` to the `known` totals of a
+        collection. Falls back to a full scan of the collection if older
+        objects have been modified since as their former size is unknown.
+        """
+        since = ICAT_TIME_FORMAT % mark
+        modified_condition = " and DATA_CREATE_TIME <= '%s'"\
+                             " and DATA_MODIFY_TIME > '%s'" % (since, since)
+        if self.icat is not None:
+            modified = self._icat_query(self.icat.collectionTotals,
+                                        collection, modified_condition)[0]
+        else:
+            out=self._raw_query(collection,"DATA_ID","count",
+                                modified_condition)
+            modified = self._parse_output(out,"DATA_ID")
+        if modified is None or modified > 0:
+            self.logger.info("Objects modified in collection %s "\
+                             "since last run, doing a full scan", collection)
+            return self._query_collection(collection, condition)
+
+        objects, space = self._query_collection(
+            collection, " and DATA_CREATE_TIME > '%s'%s" % (since, condition))
+        return known[0] + objects, known[1] + space
+
+    def _icat_query(self, method, *args):
+        """
+        Run a query of the iCAT database backend, cancelled after the
+        request timeout or once the deadline is reached
+        """
+        self.deadline.check()
+        try:
+            return method(*args, timeout=self.deadline.timeout())
+        except icat.QueryTimeout:
+            self.deadline.check()
+            raise
+
+    def _parse_output(self, out, data_type):
+        """
+        Extract the value from the output of iquest if it is as expected.
+        Returns None otherwise.
+        """
+        if out[:len(data_type)]!=data_type:
+            return None
+        return int(''.join(filter(str.isdigit, out)) or 0)
+
+    def _load_state(self):
+        """
+        Load the state of the last incremental run if there is any
+        """
+        if not os.path.exists(self.conf.state_file):
+            return None
+        with open(self.conf.state_file) as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        """
+        Atomically replace the state file
+        """
+        tmp = self.conf.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp, self.conf.state_file)
+
+    def _raw_query(self,collection,data_type,db_func,condition='',
+                   where=None):
         """
         construct query string and pipe it to iquest
         """
-        query = "select %s(%s) where COLL_NAME = '%s' || like '%s%%' | grep %s" \
-                % (db_func, data_type, collection, collection, data_type)
+        if where is None:
+            where = "COLL_NAME = '%s' || like '%s%%'" \
+                    % (collection, collection)
+        query = "select %s(%s) where %s%s | grep %s" \
+                % (db_func, data_type, where, condition, data_type)
         process = subprocess.Popen(["iquest",query], 
-                                   stdout=subprocess.PIPE)
+                                   stdout=subprocess.PIPE,
+                                   universal_newlines=True)
+        timer = self._start_timer(process)
         out,err = process.communicate()
+        self._check_timer(timer)
         return out
 
-    def _toAccountingRecord(self, stats):
+    def _start_timer(self, process):
+        """
+        Kill `process` once the request timeout or the deadline is reached
+        """
+        timeout = self.deadline.timeout()
+        if timeout is None:
+            return None
+        def kill():
+            timer.fired = True
+            process.kill()
+        timer = threading.Timer(timeout, kill)
+        timer.fired = False
+        timer.start()
+        return timer
+
+    def _check_timer(self, timer):
+        """
+        Raise if the process watched by `timer` has been killed
+        """
+        if timer is None:
+            return
+        timer.cancel()
+        if timer.fired:
+            self.deadline.check()
+            raise RuntimeError("iquest timed out")
+
+    def _query_groups(self):
+        """
+        Query iCATdb for number of objects and used space in bytes grouped
+        by collection, storage resource and data owner.
+
+        Returns a dictionary mapping (collection, resource, owner) to
+        (number of objects, used space).
+        """
+        groups = {}
+        collections = self.conf.collections.split()
+        for collection in collections:
+            try:
+                for resource, owner, space, objects in \
+                        self._grouped_query(collection):
+                    groups[(collection, resource, owner)] = (objects, space)
+                    self.logger.info("Collection %s, resource %s, owner "\
+                                     "%s: %s objects, %s bytes", collection,
+                                     resource, owner, objects, space)
+            except utils.DeadlineExceeded:
+                self.completeness = float(collections.index(collection)) \
+                                    / len(collections)
+                # drop the groups of the unfinished collection
+                for key in [key for key in groups if key[0] == collection]:
+                    del groups[key]
+                break
+            except Exception as e:
+                sys.stdout.write("Exception %s encountered!" % str(e))
+                self.logger.warn("Exception %s encountered!", e)
+                sys.exit(1)
+        return groups
+
+    def _query_accounts(self):
+        """
+        Query iCATdb for number of objects and used space in bytes per
+        collection in one grouped query per configured collection and add
+        them up per account of the longest matching prefix.
+
+        Only accounts whose prefixes lie within the configured collections
+        are scanned; the others are not reported. If the deadline is
+        reached, the accounts whose collections are done are reported and
+        the others, as well as the unmatched account, are not.
+
+        Returns a dictionary mapping each account scanned to [number of
+        objects, used space], including the accounts without any objects.
+        """
+        collections = self._query_roots()
+        # the root each account prefix lies within, nested roots being
+        # queried with the root they lie within
+        within = AccountTrie(
+            (collection, self._covering_root(collections, collection))
+            for collection in self.conf.collections.split())
+        needed = {}
+        prefixes = []
+        for prefix, account in self.conf.accounts:
+            collection = within.account(prefix)
+            if collection is None:
+                # at best a part of it would be counted
+                self.logger.warning("Account %s: %s is not within the "\
+                                    "collections, not reported", account,
+                                    prefix)
+                continue
+            needed.setdefault(account, set()).add(collection)
+            prefixes.append((prefix, account))
+        trie = AccountTrie(prefixes)
+        totals = dict((account, [0, 0]) for account in needed)
+        unmatched = [0, 0]
+        done = set()
+        for collection in collections:
+            try:
+                attributed, missed = trie.attribute(
+                    self._collection_rows(collection))
+            except utils.DeadlineExceeded:
+                self.logger.warning("Deadline reached after %s of %s "\
+                                    "collections", len(done),
+                                    len(collections))
+                break
+            except Exception as e:
+                sys.stdout.write("Exception %s encountered!" % str(e))
+                self.logger.warn("Exception %s encountered!", e)
+                sys.exit(1)
+            for account, stats in attributed.items():
+                total = totals[account]
+                total[0] += stats[0]
+                total[1] += stats[1]
+            unmatched[0] += missed[0]
+            unmatched[1] += missed[1]
+            done.add(collection)
+        for account in sorted(needed):
+            if not needed[account] <= done:
+                # a partial total would be reported as the account's usage
+                self.logger.warning("Account %s not scanned completely, "\
+                                    "not reported", account)
+                del totals[account]
+        for account, stats in sorted(totals.items()):
+            self.logger.info("Account %s: %s objects, %s bytes",
+                             account, stats[0], stats[1])
+        if unmatched[0]:
+            self.logger.info("%s objects, %s bytes not matching any "\
+                             "account prefix", unmatched[0], unmatched[1])
+            if len(done) < len(collections):
+                self.logger.warning("Collections not scanned completely, "\
+                                    "the objects not matching any account "\
+                                    "prefix are not reported")
+            elif self.conf.unmatched_account:
+                total = totals.setdefault(self.conf.unmatched_account,
+                                          [0, 0])
+                total[0] += unmatched[0]
+                total[1] += unmatched[1]
+        if not totals and len(done) < len(collections):
+            msg = "Deadline reached before any account was scanned"
+            self.logger.warning(msg)
+            sys.exit(msg)
+        return totals
+
+    def _collection_rows(self, collection):
+        """
+        Yield (collection name, number of objects, used space) for
+        `collection` and each collection below it
+        """
+        self.deadline.check()
+        if self.icat is not None:
+            for row in self._icat_query(self.icat.collectionBreakdown,
+                                        collection):
+                yield row
+            return
+        columns = ("COLL_NAME", "count(DATA_ID)", "sum(DATA_SIZE)")
+        query = "select %s where COLL_NAME = '%s' || like '%s%%'" \
+                % (", ".join(columns), collection, collection)
+        for name, objects, space in self._iquest_rows(columns, query):
+            yield name, int(objects or 0), int(space or 0)
+
+    def _query_dump(self):
+        """
+        Aggregate the dump of the catalog, exporting it first if
+        configured, per account and the resources and owners grouped by.
+
+        Returns a dictionary mapping (account, resource, owner) to
+        (number of objects, used space).
+        """
+        if self.conf.dump_export:
+            try:
+                self._export_dump(self.conf.dump_file)
+            except utils.DeadlineExceeded:
+                # no account is aggregated before the export is done
+                msg = "Deadline reached during the dump export, nothing "\
+                      "reported"
+                self.logger.warning(msg)
+                sys.exit(msg)
+        accounts = self.conf.accounts or \
+            [(collection, self.conf.account)
+             for collection in self.conf.collections.split()]
+        aggregator = DumpAggregator(AccountTrie(accounts),
+                                    self.conf.group_by,
+                                    self.conf.dump_chunk_size,
+                                    logger=self.logger)
+        groups = {}
+        for (account, resource, owner), stats in \
+                aggregator.aggregate(self.conf.dump_file).items():
+            if account is None:
+                if not self.conf.unmatched_account:
+                    self.logger.info("%s objects, %s bytes not matching "\
+                                     "any account prefix", *stats)
+                    continue
+                account = self.conf.unmatched_account
+            total = groups.setdefault((account, resource, owner), [0, 0])
+            total[0] += stats[0]
+            total[1] += stats[1]
+        return groups
+
+    def _export_dump(self, path):
+        """
+        Write one line per replica of the configured collections with the
+        fields of DUMP_COLUMNS to `path`, straight from iquest
+        """
+        columns = [column.replace("%s", self.conf.resource_attr)
+                   for column in DUMP_COLUMNS]
+        output_format = GROUP_SEPARATOR.join(["%s"] * len(columns))
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                for collection in self._query_roots():
+                    self.deadline.check()
+                    query = "select %s where COLL_NAME = '%s' || "\
+                            "like '%s%%'" % (", ".join(columns), collection,
+                                             collection)
+                    process = subprocess.Popen(["iquest", "--no-page",
+                                                output_format, query],
+                                               stdout=f)
+                    timer = self._start_timer(process)
+                    process.wait()
+                    self._check_timer(timer)
+                    if process.returncode not in (0, 1):
+                        raise RuntimeError("iquest failed for query %s "\
+                                           "with exit code %s"
+                                           % (query, process.returncode))
+        except Exception:
+            # never leave an incomplete dump behind
+            os.remove(tmp)
+            raise
+        os.rename(tmp, path)
+        self.logger.info("Catalog dump written to %s", path)
+
+    def _query_roots(self):
+        """
+        Return the configured collections without those already matched
+        by the query of another one, which would be counted twice: like
+        'x%' matches all collections whose names start with 'x'
+        """
+        roots = []
+        for collection in sorted(set(self.conf.collections.split())):
+            covering = self._covering_root(roots, collection)
+            if covering is not None:
+                self.logger.warning("Collection %s is queried with %s "\
+                                    "already", collection, covering)
+            else:
+                roots.append(collection)
+        return roots
+
+    @staticmethod
+    def _covering_root(roots, collection):
+        """
+        Return the first of `roots` whose query matches `collection`
+        """
+        for root in roots:
+            if collection.startswith(root):
+                return root
+        return None
+
+    def _dumpToAccountingRecords(self, groups, args):
+        """
+        Map the groups of a dump onto one accounting record per account
+        and type derived from the configured template
+        """
+        totals = {}
+        for (account, resource, owner), stats in sorted(groups.items()):
+            record_type = self.conf.type_template.format(
+                type=args.type, collection='', resource=resource,
+                owner=owner)
+            total = totals.setdefault((account, record_type), [0, 0])
+            total[0] += stats[0]
+            total[1] += stats[1]
+        records = []
+        for (account, record_type), stats in sorted(totals.items()):
+            record = self._toAccountingRecord(stats, args)
+            record.account = account
+            record.type = record_type
+            records.append(record)
+        return records
+
+    def _creation_rows(self, collection):
+        """
+        Yield (collection name, creation time, used space, number of
+        objects) for `collection` and each collection below it
+        """
+        self.deadline.check()
+        if self.icat is not None:
+            try:
+                for row in self.icat.creationTotals(
+                        collection, timeout=self.deadline.timeout()):
+                    yield row
+            except icat.QueryTimeout:
+                self.deadline.check()
+                raise
+            return
+        columns = ("COLL_NAME", "DATA_CREATE_TIME", "sum(DATA_SIZE)",
+                   "count(DATA_ID)")
+        query = "select %s where COLL_NAME = '%s' || like '%s%%'" \
+                % (", ".join(columns), collection, collection)
+        for name, created, space, objects in self._iquest_rows(columns,
+                                                               query):
+            yield name, int(created), int(space or 0), int(objects or 0)
+
+    def collectBackfill(self, args, start, end):
+        """
+        Compute the usage per account at each interval from `start` to
+        `end` from the creation times of the objects in one grouped query
+        per collection. Returns the records with their measure_time.
+        The rows are added up as they are read, never all kept.
+        """
+        self.deadline = utils.Deadline.fromArgs(args)
+        times = backfill.boundaries(start, end,
+                                    backfill.parseInterval(args.interval))
+        accounts = self.conf.accounts or \
+            [(collection, self.conf.account)
+             for collection in self.conf.collections.split()]
+        rows = (row for collection in self._query_roots()
+                for row in self._creation_rows(collection))
+        try:
+            usage = backfill.cumulativeUsage(rows, AccountTrie(accounts),
+                                             times)
+        except utils.DeadlineExceeded:
+            # a backfill is uploaded completely or not at all
+            msg = "Deadline reached, backfill not uploaded"
+            self.logger.warning(msg)
+            sys.exit(msg)
+        finally:
+            if self.icat is not None:
+                self.icat.close()
+        acctRecords = []
+        for account, series in sorted(usage.items()):
+            for t, stats in zip(times, series):
+                record = self._toAccountingRecord(stats, args)
+                record.account = account
+                record.measure_time = backfill.measureTime(t)
+                record.key = backfill.recordKey(args.key or 'backfill', t)
+                acctRecords.append(record)
+        self.logger.info("Backfill of %s accounts at %s times",
+                         len(usage), len(times))
+        return acctRecords
+
+    def reportBackfill(self, args):
+        """
+        Upload the usage since --backfill in batches. An interrupted
+        upload is resumed from the state file without scanning again.
+        Returns all records of the backfill, also those sent before.
+        """
+        if self.conf.dump_file or self.conf.group_by or \
+           self.conf.type_template != '{type}':
+            # the backfill is neither grouped nor read from a dump
+            msg = "--backfill cannot be combined with [Dump] or [Groups]"
+            self.logger.error(msg)
+            sys.exit(msg)
+        parameters = {'start': args.backfill, 'interval': args.interval,
+                      'key': args.key, 'type': args.type,
+                      'collections': self.conf.collections.split(),
+                      'accounts': [list(pair) for pair in self.conf.accounts]}
+        upload = backfill.BackfillUpload(
+            args.backfill_state or args.configpath + backfill.STATE_SUFFIX,
+            self.logger)
+        if not args.test and upload.load(parameters):
+            self.logger.info("Resuming the backfill upload in %s",
+                             upload.path)
+            acctRecords = [AccountingRecord.fromQueryString(data)
+                           for url, data in upload.calls]
+        else:
+            start = history.parseTime(args.backfill)
+            acctRecords = self.collectBackfill(args, start,
+                                               int(time.time()))
+            calls = [(utils.getUrl(self.conf, record.account),
+                      record.toQueryString()) for record in acctRecords]
+            if args.test:
+                for url, data in calls:
+                    print("Test: Would send the following data to %s: %s" \
+                          % (url, data))
+                return acctRecords
+            upload.start(parameters, calls)
+
+        credentials = utils.getCredentials(self.conf)
+        failed = upload.upload(credentials, args.batch_size)
+        if failed:
+            msg = "%s backfill records failed, run again to resume" % failed
+            self.logger.error(msg)
+            sys.exit(msg)
+        self.logger.info("Backfill of %s records done", len(upload.calls))
+        return acctRecords
+
+    def _grouped_query(self, collection):
+        """
+        Run one grouped aggregation for `collection` and yield
+        (resource, owner, space, objects) while iquest is still writing
+        """
+        if self.icat is not None:
+            for row in self._icat_query(self.icat.groupedTotals, collection,
+                                        self.conf.resource_attr):
+                yield row
+            return
+        columns = (self.conf.resource_attr, "DATA_OWNER_NAME",
+                   "sum(DATA_SIZE)", "count(DATA_ID)")
+        query = "select %s where COLL_NAME = '%s' || like '%s%%'" \
+                % (", ".join(columns), collection, collection)
+        for resource, owner, space, objects in self._iquest_rows(columns,
+                                                                 query):
+            yield resource, owner, int(space or 0), int(objects or 0)
+
+    def _iquest_rows(self, columns, query):
+        """
+        Run `query` selecting `columns` and yield the rows of the output
+        as tuples of strings while iquest is still writing
+        """
+        output_format = GROUP_SEPARATOR.join(["%s"] * len(columns))
+        process = subprocess.Popen(["iquest", "--no-page", output_format,
+                                    query],
+                                   stdout=subprocess.PIPE,
+                                   universal_newlines=True)
+        timer = self._start_timer(process)
+        for line in process.stdout:
+            fields = line.strip().split(GROUP_SEPARATOR)
+            if len(fields) != len(columns):
+                # e.g. CAT_NO_ROWS_FOUND
+                self.logger.info("Ignoring iquest output: %s", line.strip())
+                continue
+            yield tuple(fields)
+        process.stdout.close()
+        process.wait()
+        self._check_timer(timer)
+        if process.returncode not in (0, 1):
+            # iquest returns 1 if no rows were found
+            raise RuntimeError("iquest failed for query %s with exit "\
+                               "code %s" % (query, process.returncode))
+
+    def _query_sharded(self, collection, condition=''):
+        """
+        Query number of objects and used space in bytes of a large
+        collection by splitting it into one shard per immediate
+        sub-collection plus one for the objects in the collection itself.
+        The shards are queried in parallel; failed shards are retried up
+        to the configured number of times before giving up.
+        """
+        shards = [("COLL_NAME = '%s'" % collection)]
+        query = "select COLL_NAME where COLL_PARENT_NAME = '%s'" % collection
+        for (child,) in self._iquest_rows(("COLL_NAME",), query):
+            shards.append("COLL_NAME = '%s' || like '%s/%%'" % (child, child))
+        self.logger.info("Collection %s split into %s shards",
+                         collection, len(shards))
+
+        total_objects = 0
+        total_space = 0
+        pool = ThreadPool(min(self.conf.shard_workers, len(shards)))
+        try:
+            attempt = 0
+            while shards:
+                failed = []
+                results = pool.map(
+                    lambda where: self._query_shard(where, condition), shards)
+                for where, result in zip(shards, results):
+                    if isinstance(result, Exception):
+                        self.logger.warn("Shard %s failed: %s",
+                                         where, result)
+                        failed.append(where)
+                    else:
+                        total_objects += result[0]
+                        total_space += result[1]
+                shards = failed
+                if shards:
+                    self.deadline.check()
+                    attempt += 1
+                    if attempt > self.conf.shard_retries:
+                        raise RuntimeError("%s shards of collection %s "\
+                                           "failed" % (len(shards),
+                                                       collection))
+                    self.logger.info("Retrying %s failed shards",
+                                     len(shards))
+        finally:
+            pool.close()
+
+        self.logger.info("Storage space for collection: %s: %s",
+                         collection, total_space)
+        self.logger.info("number of objects for collection %s: %s",
+                         collection, total_objects)
+        return total_objects, total_space
+
+    def _query_shard(self, where, condition=''):
+        """
+        Query (number of objects, used space) of one shard. Errors are
+        returned instead of raised so that the caller can retry the shard.
+        """
+        try:
+            out=self._raw_query(None,"DATA_SIZE","sum",condition,where)
+            space = self._parse_output(out,"DATA_SIZE")
+            out=self._raw_query(None,"DATA_ID","count",condition,where)
+            objects = self._parse_output(out,"DATA_ID")
+            if space is None or objects is None:
+                raise ValueError("Wrong output from iquest")
+            return objects, space
+        except Exception as e:
+            return e
+
+    def _groupsToAccountingRecords(self, groups, args):
+        """
+        Map the groups onto accounting records. The type of each record is
+        derived from the configured template; groups resulting in the same
+        type are added up.
+        """
+        totals = {}
+        order = []
+        for (collection, resource, owner), stats in sorted(groups.items()):
+            values = {'type': args.type}
+            for name, value in (('collection', collection),
+                                ('resource', resource), ('owner', owner)):
+                values[name] = value if name in self.conf.group_by else ''
+            record_type = self.conf.type_template.format(**values)
+            if record_type not in totals:
+                totals[record_type] = [0, 0]
+                order.append(record_type)
+            totals[record_type][0] += stats[0]
+            totals[record_type][1] += stats[1]
+        records = []
+        for record_type in order:
+            record = self._toAccountingRecord(totals[record_type], args)
+            record.type = record_type
+            records.append(record)
+        return records
+
+    def _toAccountingRecord(self, stats, args):
         """
         Cast to format of an eudat accounting record
         """
-        return {
-            'account': self.conf.account,
-            'number': stats[0],
-            'value': stats[1],
-        }
+        return AccountingRecord.fromArgs(args,
+                                         account=self.conf.account,
+                                         number=stats[0],
+                                         value=stats[1])
+
+    def collectRecords(self, args):
+        """
+        Collect the accounting records without reporting them
+        """
+        self.deadline = utils.Deadline.fromArgs(args)
+        self.completeness = 1.0
+        try:
+            if self.conf.dump_file:
+                acctRecords = self._dumpToAccountingRecords(
+                    self._query_dump(), args)
+            elif self.conf.accounts:
+                acctRecords = []
+                for account, stats in sorted(self._query_accounts().items()):
+                    record = self._toAccountingRecord(stats, args)
+                    record.account = account
+                    acctRecords.append(record)
+            elif self.conf.group_by:
+                acctRecords = self._groupsToAccountingRecords(
+                    self._query_groups(), args)
+            else:
+                data = self._query_iCATDb(full=args.full)
+                acctRecords = []
+                acctRecords.append(self._toAccountingRecord(data, args))
+        finally:
+            if self.icat is not None:
+                self.icat.close()
+        if self.completeness < 1.0:
+            for record in acctRecords:
+                # the completeness is a share of the collections, not of
+                # the data, so it is not extrapolated from
+                if utils.applyPartialPolicy(args, record, self.completeness,
+                                            self.logger,
+                                            extrapolate=False) is None:
+                    msg = "Deadline reached, partial result not reported"
+                    self.logger.warning(msg)
+                    sys.exit(msg)
+        if args.key and len(set(record.type for record in acctRecords)) > 1:
+            for record in acctRecords:
+                # keep the records from overwriting each other
+                record.key = args.key + '-' + record.type
+        return acctRecords
 
     def reportStatistics(self, args):
         """
         Report statistical data on resource consumption to remote server
         """
-        data = self._query_iCATDb()
-
-        acctRecords = []
-        acctRecords.append(self._toAccountingRecord(data))
-        # adding the data to the args so other command line args 
-        # resp their defaults are available as well
-        args.account = acctRecords[0]['account']
-        args.value = acctRecords[0]['value']
-        args.number = acctRecords[0]['number']
-        pretty_data = json.dumps(acctRecords, indent=4)
-        self.logger.info('Data: ' + pretty_data)
+        acctRecords = self.collectRecords(args)
+        self.logger.info('Data: %s', acctRecords)
 
         credentials = utils.getCredentials(self.conf)
         self.logger.info("Credentials found")
-        self.logger.debug("Credentials: " + str(credentials))
-        url = utils.getUrl(self.conf)
-        self.logger.info("URL to call: " + url)
-        data = utils.getData(args)
-        self.logger.info("Data as query string: " + data)
+        self.logger.debug("Credentials: %s", credentials)
+
+        for record in acctRecords:
+            url = utils.getUrl(self.conf, record.account)
+            self.logger.info("URL to call: %s", url)
+            self._sendRecord(credentials, url, args, record)
+        return acctRecords
+
+    def _sendRecord(self, credentials, url, args, record):
+        """
+        Send one accounting record to the remote server
+        """
+        data = record.toQueryString()
+        self.logger.info("Data as query string: %s", data)
 
         if args.test:
             print("Test: Would send the following data: " \
@@ -182,8 +933,8 @@ class EUDATAccounting(object):
 
         response = utils.call(credentials, url, data)
 
-        self.logger.info('Data sent. Status code: ' \
-                         + str(response.status_code))
+        self.logger.info('Data sent. Status code: %s',
+                         response.status_code)
         if args.verbose:
             print("\nData sent. Status code: " \
                 + str(response.status_code))
@@ -195,15 +946,15 @@ def main(argv=sys.argv):
     """
     Main function called from console command
     """
-    logging.basicConfig(filename='.accounting.log', 
-                        level=logging.INFO,
-                        format='%(asctime)s - %(name)s \
-                        - %(levelname)s - %(message)s')
+    asynclog.configureLogging()
     exit_code = 1
     try:
         app = Application(argv)
-        app.run()
+        singleflight.runSingleFlight(app.args, profiling.runProfiled,
+                                     app.args, app.run)
         exit_code = 0
+    except singleflight.RunInProgress:
+        exit_code = singleflight.SKIPPED_EXIT_CODE
     except KeyboardInterrupt:
         exit_code = 0
     except Exception as exc:
@@ -225,10 +976,48 @@ class Application(ApplicationBase):
         ap.add_argument('-c', '--configpath', default='./irodscollector.cfg',
                         help='path to configuration file. '\
                         'Default: "./irodscollector.cfg" (in the current working directory)')
+
+        ap.add_argument('-F', '--full', action='store_true',
+                        help='do a full scan of all collections even if '\
+                        'incremental accounting is configured. '\
+                        'Default: off')
+
+        ap.add_argument('--backfill', default='',
+                        help='instead of the current usage, upload the usage '\
+                        'at each interval since this date (YYYY-MM-DD) as '\
+                        'computed from the creation times of the objects, '\
+                        'with their measure_time. '\
+                        'Default: "" - not set')
+
+        ap.add_argument('--interval', default='daily',
+                        help='time between backfilled records: daily, weekly '\
+                        'or a number of days. '\
+                        'Default: daily')
+
+        ap.add_argument('--batch-size', type=int, default=backfill.BATCH_SIZE,
+                        help='number of backfilled records uploaded before '\
+                        'the progress is saved. '\
+                        'Default: %s' % backfill.BATCH_SIZE)
+
+        ap.add_argument('--backfill-state', default='',
+                        help='file keeping the progress of a backfill upload '\
+                        'so that it can be resumed. '\
+                        'Default: the configuration file path + "%s"'
+                        % backfill.STATE_SUFFIX)
     
         utils.addCommonArguments(ap)
+        utils.addDeadlineArguments(ap)
+        singleflight.addSingleFlightArguments(ap)
+        history.addHistoryArguments(ap)
 
         self.args = ap.parse_args(args=argv[1:])
+        if self.args.backfill and self.args.partial != 'skip':
+            ap.error("--partial is not supported with --backfill: a "\
+                     "backfill is uploaded completely or not at all")
+        if self.args.partial == 'extrapolate':
+            ap.error("--partial extrapolate is not supported: only the "\
+                     "share of the collections done is known, not the "\
+                     "share of the data")
         # sneak in some default values that the utility functions expect
         self.args.unit = 'byte'
         self.args.service = '(default)'  # XXX TODO: should this come from the config?
@@ -237,7 +1026,7 @@ class Application(ApplicationBase):
 
 
     def run(self):
-        LOG.info("iRODScollector called with: " + str(self.args))
+        LOG.info("iRODScollector called with: %s", self.args)
         print("iRODScollector called with: %s" % str(self.args))
 
         fileparser = SafeConfigParser()
@@ -252,6 +1041,10 @@ class Application(ApplicationBase):
 
         eurep = EUDATAccounting(configuration, logger)
         logger.info("Accounting starting ...")
-        eurep.reportStatistics(self.args)
+        if self.args.backfill:
+            acctRecords = eurep.reportBackfill(self.args)
+        else:
+            acctRecords = eurep.reportStatistics(self.args)
         logger.info("Accounting finished")
+        return acctRecords
 
@@ -0,0 +1,283 @@
+# direct iCAT database access for the iRODScollector of eudat.accounting.client
+# runs the accounting aggregations as SQL instead of through iquest
+
+
+# GenQuery attributes used in conditions and groupings and the columns of
+# the iCAT tables they map to: d = R_DATA_MAIN, c = R_COLL_MAIN and
+# r = R_RESC_MAIN (DATA_RESC_NAME of iRODS 4.2 and later)
+COLUMNS = {
+    'DATA_ID': 'd.data_id',
+    'DATA_SIZE': 'd.data_size',
+    'DATA_OWNER_NAME': 'd.data_owner_name',
+    'DATA_CREATE_TIME': 'd.create_ts',
+    'DATA_MODIFY_TIME': 'd.modify_ts',
+    'RESC_NAME': 'd.resc_name',
+    'DATA_RESC_NAME': 'r.resc_name',
+    'COLL_NAME': 'c.coll_name',
+}
+
+FROM = "r_data_main d join r_coll_main c on c.coll_id = d.coll_id"
+RESC_JOIN = " join r_resc_main r on r.resc_id = d.resc_id"
+
+# the conditions the collector appends to its GenQuery queries
+CONDITION_PATTERN = r"\s*and\s+(\w+)\s*(<=|>=|<|>|=)\s*'([^']*)'"
+
+# SQLite virtual machine instructions between checks of the timeout
+SQLITE_PROGRESS_STEPS = 1000
+
+# rows fetched at a time by the queries whose results are streamed
+FETCH_SIZE = 10000
+
+import re
+import threading
+import time
+from importlib import import_module
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    # Python 3
+    from queue import Queue, Empty
+
+from eudat.accounting.client import LOG
+
+class QueryTimeout(RuntimeError):
+    """Raised when a statement is cancelled after its timeout"""
+
+def parseConditions(condition):
+    """Translates the GenQuery `condition` appended by the collector, a
+    sequence of "and ATTRIBUTE op 'value'", into a list of (column, op,
+    value). Raises ValueError for anything else.
+
+        >>> parseConditions(" and DATA_CREATE_TIME > '01500000000'")
+        [('d.create_ts', '>', '01500000000')]
+        >>> parseConditions(" or DATA_SIZE > '0'")
+        Traceback (most recent call last):
+        ...
+        ValueError: Unsupported condition: " or DATA_SIZE > '0'"
+    """
+    conditions = []
+    position = 0
+    pattern = re.compile(CONDITION_PATTERN)
+    while position < len(condition.rstrip()):
+        match = pattern.match(condition, position)
+        if match is None or match.group(1) not in COLUMNS:
+            raise ValueError("Unsupported condition: %r" % condition)
+        conditions.append((COLUMNS[match.group(1)], match.group(2),
+                           match.group(3)))
+        position = match.end()
+    return conditions
+
+
+class ConnectionPool(object):
+    """A small pool of DB-API connections created on demand
+
+    :param driver: the DB-API module, e.g. psycopg2
+    :param dsn: the argument passed to its connect()
+    :param size: the maximum number of idle connections kept
+    """
+
+    def __init__(self, driver, dsn, size=2):
+        self.driver = driver
+        self.dsn = dsn
+        self._idle = Queue(size)
+
+    def get(self):
+        """Returns an idle connection or a new one"""
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            LOG.info("Connecting to the iCAT database")
+            if self.driver.__name__ == 'sqlite3':
+                # the connections are handed on between threads
+                return self.driver.connect(self.dsn, check_same_thread=False)
+            return self.driver.connect(self.dsn)
+
+    def put(self, connection):
+        """Returns a connection to the pool or closes it if it is full"""
+        try:
+            self._idle.put_nowait(connection)
+        except Exception:
+            connection.close()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class ICATDatabase(object):
+    """Read-only access to the iCAT database running the aggregations of
+    the iRODScollector as parameterized SQL statements. Counts and sums
+    are taken over all replicas like GenQuery does.
+
+    :param driver: name of the DB-API module, e.g. psycopg2
+    :param dsn: connection string resp. database file
+    :param connections: size of the connection pool
+
+    Each query takes an optional `timeout` in seconds after which the
+    statement is cancelled and QueryTimeout raised. It is enforced with
+    statement_timeout by PostgreSQL and with a progress handler by SQLite.
+    """
+
+    def __init__(self, driver, dsn, connections=2, logger=LOG):
+        self.logger = logger
+        self.driver = driver
+        module = import_module(driver)
+        if module.paramstyle == 'qmark':
+            self.placeholder = '?'
+        elif module.paramstyle in ('format', 'pyformat'):
+            self.placeholder = '%s'
+        else:
+            raise ValueError("Unsupported paramstyle %s of %s"
+                             % (module.paramstyle, driver))
+        self.pool = ConnectionPool(module, dsn, connections)
+        # the statements only depend on the shape of the query, so their
+        # text is built once and reused with different parameters
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def collectionTotals(self, collection, condition='', timeout=None):
+        """Returns (number of objects, used space) of `collection` and
+        everything below it, restricted by the GenQuery `condition`"""
+        conditions = parseConditions(condition)
+        sql = self._statement(
+            ('totals',) + tuple(c[:2] for c in conditions),
+            "count(d.data_id), sum(d.data_size)", conditions)
+        rows = self._execute(sql, self._parameters(collection, conditions),
+                             timeout)
+        objects, space = rows[0]
+        return int(objects or 0), int(space or 0)
+
+    def groupedTotals(self, collection, resource_attr, timeout=None):
+        """Returns (resource, owner, used space, number of objects) for
+        each resource and data owner of `collection` and everything below"""
+        resource = COLUMNS[resource_attr]
+        columns = "%s, d.data_owner_name, sum(d.data_size), count(d.data_id)" \
+                  % resource
+        sql = self._statement(('groups', resource), columns, [],
+                              "%s, d.data_owner_name" % resource)
+        rows = self._execute(sql, self._parameters(collection, []), timeout)
+        return [(str(resc), str(owner), int(space or 0), int(objects or 0))
+                for resc, owner, space, objects in rows]
+
+    def collectionBreakdown(self, collection, timeout=None):
+        """Returns (collection name, number of objects, used space) for
+        `collection` and each collection below it holding objects"""
+        sql = self._statement(('breakdown',), "c.coll_name, count(d.data_id), "
+                              "sum(d.data_size)", [], "c.coll_name")
+        rows = self._execute(sql, self._parameters(collection, []), timeout)
+        return [(str(name), int(objects or 0), int(space or 0))
+                for name, objects, space in rows]
+
+    def creationTotals(self, collection, timeout=None):
+        """Yields (collection name, creation time, used space, number of
+        objects) for each collection and creation time below `collection`.
+        There may be a row per object, so they are fetched as consumed"""
+        sql = self._statement(('creations',), "c.coll_name, d.create_ts, "
+                              "sum(d.data_size), count(d.data_id)", [],
+                              "c.coll_name, d.create_ts")
+        for name, created, space, objects in self._iterate(
+                sql, self._parameters(collection, []), timeout):
+            yield (str(name), int(created), int(space or 0),
+                   int(objects or 0))
+
+    def close(self):
+        self.pool.close()
+
+    def _statement(self, shape, columns, conditions, group_by=None):
+        with self._lock:
+            if shape not in self._statements:
+                p = self.placeholder
+                sql = "select " + columns + " from " + FROM
+                if 'r.resc_name' in columns or \
+                   any(c[0].startswith('r.') for c in conditions):
+                    sql += RESC_JOIN
+                sql += " where (c.coll_name = %s or c.coll_name like %s)" \
+                       % (p, p)
+                for column, op, value in conditions:
+                    sql += " and %s %s %s" % (column, op, p)
+                if group_by:
+                    sql += " group by " + group_by
+                self._statements[shape] = sql
+            return self._statements[shape]
+
+    def _parameters(self, collection, conditions):
+        # same pattern as "COLL_NAME = 'x' || like 'x%'" of the iquest queries
+        return [collection, collection + '%'] + \
+               [value for column, op, value in conditions]
+
+    def _execute(self, sql, parameters, timeout=None):
+        self.logger.debug("SQL: %s %s", sql, parameters)
+        connection = self.pool.get()
+        start = time.time()
+        try:
+            self._setTimeout(connection, timeout)
+            cursor = connection.cursor()
+            cursor.execute(sql, parameters)
+            rows = cursor.fetchall()
+            cursor.close()
+            # end the read-only transaction, and with it statement_timeout
+            connection.rollback()
+            self._setTimeout(connection, None)
+        except Exception:
+            connection.close()
+            if timeout is not None and time.time() - start >= timeout:
+                raise QueryTimeout("iCAT query cancelled after %.1f "
+                                   "seconds" % timeout)
+            raise
+        self.pool.put(connection)
+        return rows
+
+    def _iterate(self, sql, parameters, timeout=None):
+        """Yields the rows of `sql` fetching FETCH_SIZE rows at a time.
+        PostgreSQL keeps the result in a server side cursor meanwhile"""
+        self.logger.debug("SQL: %s %s", sql, parameters)
+        connection = self.pool.get()
+        start = time.time()
+        done = False
+        try:
+            self._setTimeout(connection, timeout)
+            if self.driver == 'sqlite3':
+                cursor = connection.cursor()
+            else:
+                # a named cursor of psycopg2 is a server side one
+                cursor = connection.cursor('eudat_accounting')
+            cursor.execute(sql, parameters)
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            cursor.close()
+            connection.rollback()
+            self._setTimeout(connection, None)
+            done = True
+        except Exception:
+            if timeout is not None and time.time() - start >= timeout:
+                raise QueryTimeout("iCAT query cancelled after %.1f "
+                                   "seconds" % timeout)
+            raise
+        finally:
+            # also if the rows are not consumed to the end
+            if done:
+                self.pool.put(connection)
+            else:
+                connection.close()
+
+    def _setTimeout(self, connection, timeout):
+        """Makes the statements of the transaction on `connection` fail
+        after `timeout` seconds; None for no timeout"""
+        if self.driver == 'sqlite3':
+            if timeout is None:
+                connection.set_progress_handler(None, 0)
+            else:
+                end = time.time() + timeout
+                connection.set_progress_handler(lambda: time.time() > end,
+                                                SQLITE_PROGRESS_STEPS)
+        elif timeout is not None:
+            # PostgreSQL, for this transaction only
+            cursor = connection.cursor()
+            cursor.execute("set local statement_timeout = %d"
+                           % max(1, int(timeout * 1000)))
+            cursor.close()
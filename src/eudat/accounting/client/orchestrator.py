@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+=============================
+eudat.accounting.orchestrator
+=============================
+
+Run several collectors concurrently and upload all their records at once
+"""
+
+import argparse
+import copy
+import logging
+import sys
+import threading
+import time
+from importlib import import_module
+
+try:
+    from ConfigParser import SafeConfigParser
+except ImportError:
+    # Python 3
+    from configparser import SafeConfigParser
+
+from eudat.accounting.client import __version__, LOG, utils, profiling, \
+    singleflight, asynclog, history
+from eudat.accounting.client.__main__ import Application as ApplicationBase
+
+# collector types supported with the module implementing them and the
+# default values their command line applications sneak into the args
+COLLECTORS = {
+    'irods': ('eudat.accounting.client.iRODScollector',
+              {'object_type': 'registered object', 'full': False}),
+    'b2share': ('eudat.accounting.b2share.b2share_collector',
+                {'object_type': 'registered object'}),
+    'posix': ('eudat.accounting.client.POSIXcollector',
+              {'object_type': 'file'}),
+}
+
+SECTION_PREFIX = 'collector:'
+
+################################################################################
+# Configuration Class #
+################################################################################
+
+
+class Configuration(object):
+    """
+    Get configuration parameters from configuration file
+    """
+
+    def __init__(self, file, logger, fileparser):
+
+        self.file = file
+        self.logger = logger
+        self.fileparser = fileparser
+
+    def parseConf(self):
+
+        """Parse configuration file"""
+
+        print('Configuration file: %s \n'%self.file)
+
+        self.logfile        =  self.fileparser.get('Logging','log_file')
+        self.user           =  self.fileparser.get('Report','user')
+        self.password       =  self.fileparser.get('Report','password')
+        self.workers        =  int(utils.getOption(self.fileparser,
+                                                   'Report', 'workers', 4))
+        self.collectors     =  []
+        for name in self.fileparser.get('Orchestrator','collectors').split():
+            section = SECTION_PREFIX + name
+            kind = self.fileparser.get(section, 'type')
+            if kind not in COLLECTORS:
+                raise ValueError("Unknown type %r of collector %s" \
+                                 % (kind, name))
+            self.collectors.append((name, kind,
+                                    self.fileparser.get(section, 'config')))
+
+        # write the log file from a background thread
+        asynclog.addLogFile(self.logger, self.logfile)
+
+################################################################################
+# Collector run Class #
+################################################################################
+
+
+class CollectorRun(object):
+    """
+    One collector instance run by the orchestrator
+    """
+
+    def __init__(self, name, kind, configpath, args):
+        self.name = name
+        self.kind = kind
+        self.configpath = configpath
+        module, defaults = COLLECTORS[kind]
+        self.module = module
+        self.args = copy.copy(args)
+        for k, value in defaults.items():
+            setattr(self.args, k, value)
+        if args.key:
+            # keep the records of the collectors from overwriting each other
+            self.args.key = args.key + '-' + name
+        self.conf = None
+        self.records = []
+        self.error = None
+        self.seconds = 0
+
+    def run(self):
+        """
+        Collect the records of this collector. Errors, including the exits
+        of the collectors, are kept instead of raised.
+        """
+        start = time.time()
+        logger = logging.getLogger('StorageAccounting.' + self.name)
+        # the same lock a standalone run of the collector would take
+        lock = singleflight.LockFile(self.configpath + \
+                                     singleflight.LOCK_SUFFIX,
+                                     self.args.lock_max_age)
+        if not lock.acquire():
+            self.error = "another run using " + self.configpath + \
+                         " is in progress"
+            logger.warning(self.error)
+            self.seconds = time.time() - start
+            return
+        try:
+            module = import_module(self.module)
+            fileparser = SafeConfigParser()
+            if not fileparser.read(self.configpath):
+                raise IOError("Cannot read " + self.configpath)
+            conf = module.Configuration(self.configpath, logger, fileparser)
+            conf.parseConf()
+            eurep = module.EUDATAccounting(conf, logger)
+            logger.info("Accounting starting ...")
+            self.records = eurep.collectRecords(self.args)
+            self.conf = conf
+            logger.info("Accounting finished")
+        except SystemExit as e:
+            self.error = str(e.code)
+        except Exception as e:
+            logger.exception(e)
+            self.error = str(e)
+        finally:
+            lock.release()
+        self.seconds = time.time() - start
+
+
+def main(argv=sys.argv):
+    """
+    Main function called from console command
+    """
+    asynclog.configureLogging()
+    exit_code = 1
+    try:
+        app = Application(argv)
+        singleflight.runSingleFlight(app.args, profiling.runProfiled,
+                                     app.args, app.run)
+        exit_code = 0
+    except singleflight.RunInProgress:
+        exit_code = singleflight.SKIPPED_EXIT_CODE
+    except KeyboardInterrupt:
+        exit_code = 0
+    except Exception as exc:
+        LOG.exception(exc)
+    sys.exit(exit_code)
+
+
+class Application(ApplicationBase):
+    """
+    The main Application class of the collector orchestrator
+
+    :param argv: The command line as a list as ``sys.argv``
+    """
+
+    def __init__(self, argv):
+        ap = argparse.ArgumentParser()
+        ap.add_argument('--version', action='version', version=__version__)
+
+        ap.add_argument('-c', '--configpath', default='./collectors.cfg',
+                        help='path to configuration file. '\
+                        'Default: "./collectors.cfg" (in the current working directory)')
+
+        utils.addCommonArguments(ap)
+        utils.addDeadlineArguments(ap)
+        singleflight.addSingleFlightArguments(ap)
+        history.addHistoryArguments(ap)
+
+        self.args = ap.parse_args(args=argv[1:])
+        # sneak in some default values that the utility functions expect
+        self.args.unit = 'byte'
+        self.args.service = '(default)'  # XXX TODO: should this come from the config?
+        """Arguments of your app"""
+
+    def run(self):
+        """
+        Run all configured collectors and upload their records.
+        Returns the records uploaded; exits if a collector or an upload
+        failed.
+        """
+        LOG.info("runCollectors called with: %s", self.args)
+        print("runCollectors called with: %s" % str(self.args))
+
+        fileparser = SafeConfigParser()
+        fileparser.read(self.args.configpath)
+
+        logger = logging.getLogger('StorageAccounting')
+        logger.setLevel(logging.INFO)
+
+        configuration = Configuration(self.args.configpath,
+                                      logger, fileparser)
+        configuration.parseConf()
+
+        runs = [CollectorRun(name, kind, configpath, self.args)
+                for name, kind, configpath in configuration.collectors]
+        threads = [threading.Thread(target=run.run, name=run.name)
+                   for run in runs]
+        logger.info("Running %s collectors ...", len(runs))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        calls = []
+        origins = []
+        for run in runs:
+            if run.error is not None:
+                continue
+            for record in run.records:
+                # records may be attributed to accounts of their own
+                url = utils.getUrl(run.conf, record.account)
+                calls.append((url, record.toQueryString()))
+                origins.append(run)
+
+        failed = dict((run.name, 0) for run in runs)
+        if self.args.test:
+            for url, data in calls:
+                print("Test: Would send the following data to %s: %s" \
+                      % (url, data))
+        elif calls:
+            credentials = utils.getCredentials(configuration)
+            responses = utils.callAll(credentials, calls,
+                                      configuration.workers)
+            for run, (url, data), response in zip(origins, calls, responses):
+                if isinstance(response, Exception) or not response.ok:
+                    failed[run.name] += 1
+                    logger.error("Upload of %s failed: %s", data,
+                                 getattr(response, 'status_code', response))
+                else:
+                    logger.info("Data sent. Key of generated accounting "\
+                                "record: %s", response.text)
+                    if self.args.verbose:
+                        print("Key of generated accounting record: " \
+                              + response.text)
+
+        ok = True
+        summary = ["Summary:"]
+        for run in runs:
+            if run.error is not None:
+                ok = False
+                status = "FAILED: " + run.error
+            elif failed[run.name]:
+                ok = False
+                status = "%d of %d uploads failed" % (failed[run.name],
+                                                      len(run.records))
+            else:
+                status = "ok"
+            summary.append("  %-20s %-8s %3d records %8.1fs  %s" \
+                           % (run.name, run.kind, len(run.records),
+                              run.seconds, status))
+        for line in summary:
+            print(line)
+            logger.info(line)
+        if not ok:
+            sys.exit("Some collectors or uploads failed")
+        return [record for run in runs for record in run.records]
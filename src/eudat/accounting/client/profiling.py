@@ -0,0 +1,135 @@
+# profiling support for all command line clients of eudat.accounting.client
+# selected with the common '--profile' option
+
+
+PROFILE_SUFFIXES = {'cprofile': '.prof', 'sample': '.folded'}
+PROFILE_MODES = sorted(PROFILE_SUFFIXES)
+OUTPUT_PATTERN = ".accounting-%Y%m%d-%H%M%S"
+SAMPLE_INTERVAL = 0.01
+TOP = 20
+
+import collections
+import os
+import sys
+import threading
+import time
+
+from eudat.accounting.client import LOG
+
+def runProfiled(args, func):
+    """Calls `func` under the profiler selected with `--profile`.
+    Prints the top hot spots once `func` returns or raises and saves
+    the full profile to the file given with `--profile-output`"""
+    mode = getattr(args, 'profile', None)
+    if not mode:
+        return func()
+    output = args.profile_output or \
+        time.strftime(OUTPUT_PATTERN) + PROFILE_SUFFIXES[mode]
+    if mode == 'cprofile':
+        return _runCProfile(func, output)
+    return _runSampled(func, output)
+
+def _runCProfile(func, output):
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    threads = ThreadProfiles()
+    threads.install()
+    try:
+        return profile.runcall(func)
+    finally:
+        threads.uninstall()
+        stats = pstats.Stats(profile, stream=sys.stdout)
+        for thread_profile in threads.profiles:
+            stats.add(thread_profile)
+        stats.dump_stats(output)
+        LOG.info("cProfile output written to: %s", output)
+        print("\ncProfile output written to: %s (%d threads)"
+              % (output, len(threads.profiles) + 1))
+        stats.sort_stats('cumulative').print_stats(TOP)
+
+class ThreadProfiles(object):
+    """Profiles each thread started while installed, e.g. the workers of
+    the thread pools, with a cProfile of its own. cProfile only sees the
+    thread it has been enabled in before Python 3.12, which profiles all
+    threads at once instead."""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def install(self):
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._start)
+
+    def uninstall(self):
+        threading.setprofile(None)
+
+    def _start(self, frame, event, arg):
+        # the first event of a new thread replaces this by its profile
+        import cProfile
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+def _runSampled(func, output):
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        return func()
+    finally:
+        sampler.stop()
+        sampler.dump(output)
+        LOG.info("Sampled stacks written to: %s", output)
+        print("\nSampled stacks written to: %s" % output)
+        sampler.printTop(TOP)
+
+class StackSampler(threading.Thread):
+    """Samples the wall clock stacks of all other threads in regular
+    intervals. Unlike cProfile this also shows where a crawl is waiting
+    for the network and adds little overhead to long runs."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self, name='StackSampler')
+        self.daemon = True
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name,
+                                                 os.path.basename(code.co_filename),
+                                                 frame.f_lineno))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def dump(self, output):
+        """Writes the stacks in the folded format used by flame graph tools"""
+        with open(output, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (';'.join(stack), count))
+
+    def printTop(self, top):
+        """Prints the functions most often seen on top of a stack"""
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack[-1]] += count
+        total = sum(leaves.values()) or 1
+        print("%d samples taken every %s seconds, top %d:"
+              % (self.samples, self.interval, top))
+        for leaf, count in leaves.most_common(top):
+            print("%6.1f%%  %s" % (100.0 * count / total, leaf))
@@ -0,0 +1,107 @@
+# accounting record type of eudat.accounting.client
+# shared by all clients for building the data sent to the server
+
+
+CORE_FIELDS = ('type', 'value', 'unit')
+META_FIELDS = ('service', 'number', 'object_type', 'measure_time', 'comment')
+
+
+class AccountingRecord(object):
+    """One accounting record as sent to the accounting server.
+
+    Uses slots to stay small when many records are collected in one run.
+    Meta fields other than the common ones can be given in `meta`. The
+    `quality` of a value that is no full measurement, 'partial',
+    'extrapolated' or 'estimated', is kept locally and not sent.
+
+        >>> record = AccountingRecord('acc', 1024, number=3)
+        >>> record.toQueryString()
+        'account=acc&core.type:record=storage&core.value:record=1024&core.unit:record=byte&meta.number:record=3&meta.object_type:record=registered objects'
+        >>> record.number = ''
+        >>> record.toQueryString()
+        'account=acc&core.type:record=storage&core.value:record=1024&core.unit:record=byte'
+        >>> record.meta['estimate_upper'] = 2048
+        >>> record.toQueryString()
+        'account=acc&core.type:record=storage&core.value:record=1024&core.unit:record=byte&meta.estimate_upper:record=2048'
+    """
+
+    __slots__ = ('account', 'key') + CORE_FIELDS + META_FIELDS + \
+        ('meta', 'quality')
+
+    def __init__(self, account, value, number='', type='storage',
+                 unit='byte', key='', service='',
+                 object_type='registered objects', measure_time='',
+                 comment='', meta=None, quality=''):
+        self.account = account
+        self.key = key
+        self.type = type
+        self.value = value
+        self.unit = unit
+        self.service = service
+        self.number = number
+        self.object_type = object_type
+        self.measure_time = measure_time
+        self.comment = comment
+        self.meta = dict(meta or {})
+        self.quality = quality
+
+    @classmethod
+    def fromArgs(cls, args, **values):
+        """Creates a record from the command line `args`; keyword arguments
+        take precedence over the args"""
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            if name in values:
+                setattr(record, name, values[name])
+            else:
+                setattr(record, name, getattr(args, name, ''))
+        record.meta = dict(values.get('meta') or {})
+        return record
+
+    @classmethod
+    def fromQueryString(cls, data):
+        """Creates a record from a query string made by toQueryString
+
+            >>> record = AccountingRecord('acc', 1024, number=3, key='k')
+            >>> AccountingRecord.fromQueryString(record.toQueryString())
+            AccountingRecord(account='acc', key='k', type='storage', value=1024, unit='byte', number=3, object_type='registered objects')
+        """
+        record = cls('', '', object_type='')
+        for part in data.split('&'):
+            name, value = part.split('=', 1)
+            name = name.split('.', 1)[-1].replace(':record', '')
+            if name in ('value', 'number') and value.isdigit():
+                value = int(value)
+            if name in cls.__slots__:
+                setattr(record, name, value)
+            else:
+                record.meta[name] = value
+        return record
+
+    def toQueryString(self):
+        """Returns the record as query string for the addRecord call.
+        The object type is only sent along with a number of objects"""
+        parts = ['account=%s' % self.account]
+        if self.key:
+            parts.append('key=%s' % self.key)
+        parts.append('core.type:record=%s' % self.type)
+        parts.append('core.value:record=%s' % self.value)
+        parts.append('core.unit:record=%s' % self.unit)
+        if self.service:
+            parts.append('meta.service:record=%s' % self.service)
+        if self.number:
+            parts.append('meta.number:record=%s' % self.number)
+            if self.object_type:
+                parts.append('meta.object_type:record=%s' % self.object_type)
+        if self.measure_time:
+            parts.append('meta.measure_time:record=%s' % self.measure_time)
+        if self.comment:
+            parts.append('meta.comment:record=%s' % self.comment)
+        for name in sorted(self.meta):
+            parts.append('meta.%s:record=%s' % (name, self.meta[name]))
+        return '&'.join(parts)
+
+    def __repr__(self):
+        return 'AccountingRecord(%s)' % ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__
+            if getattr(self, name) not in ('', {}))
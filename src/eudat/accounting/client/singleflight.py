@@ -0,0 +1,214 @@
+# single-flight support for the collectors of eudat.accounting.client
+# makes sure that only one run per configuration file is in progress
+
+
+LOCK_SUFFIX = ".lock"
+RESULT_SUFFIX = ".result"
+GUARD_SUFFIX = ".guard"
+LOCK_MAX_AGE = 24
+POLL_INTERVAL = 5
+# exit status of a run not started because another one is in progress,
+# EX_TEMPFAIL of sysexits.h
+SKIPPED_EXIT_CODE = 75
+
+import errno
+import fcntl
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+from eudat.accounting.client import LOG, history
+
+class RunInProgress(Exception):
+    """Raised if a run is not started because another one holds the lock"""
+
+def addSingleFlightArguments(ap):
+    """
+    Add commandline arguments controlling overlapping runs
+    """
+    ap.add_argument('--lock-file', default='',
+                    help='lock file preventing overlapping runs. '\
+                    'Default: the configuration file path + "%s"' % LOCK_SUFFIX)
+
+    ap.add_argument('--lock-max-age', type=float, default=LOCK_MAX_AGE,
+                    help='hours after which a lock is considered stale even '\
+                    'if its process still exists. '\
+                    'Default: %s' % LOCK_MAX_AGE)
+
+    ap.add_argument('--coalesce', action='store_true',
+                    help='if another run is in progress wait for it and '\
+                    'reuse its result instead of exiting. '\
+                    'Default: off')
+
+    ap.add_argument('--lock-poll-interval', type=float, default=POLL_INTERVAL,
+                    help='seconds between the checks whether the run waited '\
+                    'for with --coalesce has finished. '\
+                    'Default: %s' % POLL_INTERVAL)
+
+def runSingleFlight(args, func, *funcargs):
+    """Calls `func(*funcargs)` unless another run using the same lock file
+    is in progress. `func` is expected to return the records reported;
+    they are kept next to the lock so that a coalescing run can reuse
+    them and added to the history if `--history` is given. Dry runs and
+    backfills leave no result. Returns the result of `func` or the query
+    strings of the records of the run coalesced with.
+    Raises RunInProgress if another run is in progress and `--coalesce`
+    is not given."""
+    path = args.lock_file or args.configpath + LOCK_SUFFIX
+    lock = LockFile(path, args.lock_max_age,
+                    getattr(args, 'lock_poll_interval', POLL_INTERVAL))
+    while not lock.acquire():
+        holder = lock.holder() or {}
+        msg = "Another run (pid %s on %s, started %s) holds %s" \
+              % (holder.get('pid'), holder.get('host'),
+                 time.ctime(holder.get('started', 0)), path)
+        if not args.coalesce:
+            LOG.warning("%s; not starting a second one", msg)
+            print(msg + "; not starting a second one")
+            raise RunInProgress(msg)
+        LOG.info("%s; waiting for it to finish", msg)
+        print(msg + "; waiting for it to finish")
+        lock.wait()
+        result = lock.result()
+        if result and result.get('started') == holder.get('started'):
+            LOG.info("Reusing the result of pid %s finished %s: %s",
+                     result['pid'], time.ctime(result['finished']),
+                     result['records'])
+            print("Reusing the result of the other run:")
+            for record in result['records']:
+                print(record)
+            return result['records']
+        LOG.info("The other run left no result; running now")
+    try:
+        records = func(*funcargs)
+        if not args.test:
+            if not getattr(args, 'backfill', ''):
+                # past usage, no result for a coalescing run to reuse
+                lock.storeResult(records)
+            history.storeHistory(args, records)
+        return records
+    finally:
+        lock.release()
+
+class LockFile(object):
+    """A lock file holding the pid, host and start time of its owner"""
+
+    def __init__(self, path, max_age=LOCK_MAX_AGE,
+                 poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.max_age = max_age
+        self.poll_interval = poll_interval
+        self.started = None
+
+    def acquire(self):
+        """Returns True if the lock could be taken. Stale locks left by
+        processes that are gone or that are too old are removed"""
+        started = time.time()
+        content = json.dumps({'pid': os.getpid(),
+                              'host': socket.gethostname(),
+                              'started': started})
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            if self._breakStale():
+                return self.acquire()
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.started = started
+        return True
+
+    def release(self):
+        """Removes the lock unless it has been broken and taken by another
+        run meanwhile"""
+        with self._guard():
+            holder = self.holder()
+            if holder and holder.get('pid') == os.getpid() and \
+               holder.get('started') == self.started:
+                self._remove(self.path)
+
+    def holder(self):
+        """Returns the content of the lock file or None if there is none"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def wait(self):
+        """Waits until the lock is released or becomes stale"""
+        while os.path.exists(self.path) and not self._isStale():
+            time.sleep(self.poll_interval)
+
+    def storeResult(self, records):
+        """Keeps the records reported by the owner of the lock"""
+        result = {'pid': os.getpid(),
+                  'started': self.started,
+                  'finished': time.time(),
+                  'records': [record.toQueryString()
+                              for record in records or []]}
+        tmp = self.path + RESULT_SUFFIX + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(result, f)
+        os.rename(tmp, self.path + RESULT_SUFFIX)
+
+    def result(self):
+        """Returns the result stored by the last owner of the lock"""
+        try:
+            with open(self.path + RESULT_SUFFIX) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _breakStale(self):
+        """Removes the lock if it is stale. Returns True if it was removed
+        or is gone already.
+
+        Checking and removing are done holding the guard, a flock on a
+        file next to the lock which is never removed, so that no other
+        run can break or release the lock, and thus no new owner take it,
+        in between."""
+        with self._guard():
+            if not os.path.exists(self.path):
+                return True
+            if not self._isStale():
+                return False
+            LOG.warning("Removing stale lock %s", self.path)
+            self._remove(self.path)
+            return True
+
+    @contextmanager
+    def _guard(self):
+        fd = os.open(self.path + GUARD_SUFFIX, os.O_CREAT | os.O_WRONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # closing releases the flock
+            os.close(fd)
+
+    def _isStale(self):
+        holder = self.holder()
+        if holder is None:
+            # being written or just removed
+            return False
+        if time.time() - holder.get('started', 0) > self.max_age * 3600:
+            return True
+        if holder.get('host') != socket.gethostname():
+            return False
+        try:
+            os.kill(holder['pid'], 0)
+        except OSError as e:
+            return e.errno == errno.ESRCH
+        return False
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -5,12 +5,17 @@
 USERKEY = "ACCOUNTING_USER"
 PWKEY = "ACCOUNTING_PW"
 URL_PATTERN = "%s/%s/%s/addRecord?"
+PARTIAL_POLICIES = ('skip', 'flag', 'extrapolate')
 
 import os
 import sys
+import time
 import requests
+from multiprocessing.pool import ThreadPool
 
 from eudat.accounting.client import LOG
+from eudat.accounting.client.profiling import PROFILE_MODES
+from eudat.accounting.client.record import AccountingRecord
 
 def addCommonArguments(ap):
     """
@@ -42,63 +47,201 @@ def addCommonArguments(ap):
     ap.add_argument('-v', '--verbose', action='store_true',
                     help='return the key of the accounting record created. '\
                     'Default: off')
-   
+
+    ap.add_argument('--profile', default='', choices=PROFILE_MODES,
+                    help='profile the run with cProfile or by sampling the '\
+                    'stacks of all threads and print the top hot spots. '\
+                    'Both include the worker threads. '\
+                    'Default: "" - not set')
+
+    ap.add_argument('--profile-output', default='',
+                    help='file the profile is written to. '\
+                    'Default: ".accounting-<timestamp>.prof" resp. ".folded"')
+
+def addDeadlineArguments(ap):
+    """
+    Add the commandline arguments bounding the duration of a collector run
+    """
+    ap.add_argument('--deadline', type=float, default=0,
+                    help='overall time budget of the run in seconds. '\
+                    'When it runs out collecting stops and the partial '\
+                    'policy is applied. '\
+                    'Default: 0 - no deadline')
+
+    ap.add_argument('--request-timeout', type=float, default=0,
+                    help='timeout in seconds for each single request to '\
+                    'B2SHARE resp. query of the iCAT. '\
+                    'Default: 0 - no timeout')
+
+    ap.add_argument('--partial', default='skip', choices=PARTIAL_POLICIES,
+                    help='what to do with a partial result, e.g. if the '\
+                    'deadline is reached or files could not be read: '\
+                    '"skip" the upload, upload it "flag"ged as '\
+                    'partial in the comment or "extrapolate" it to 100%%. '\
+                    'Default: skip')
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the time budget of a run is used up"""
+
+class Deadline(object):
+    """Time budget of a run
+
+    :param seconds: overall budget, 0 for none
+    :param request_timeout: limit for each single request, 0 for none
+    """
+
+    def __init__(self, seconds=0, request_timeout=0):
+        self.end = time.time() + seconds if seconds else None
+        self.request_timeout = request_timeout or None
+
+    @classmethod
+    def fromArgs(cls, args):
+        return cls(getattr(args, 'deadline', 0),
+                   getattr(args, 'request_timeout', 0))
+
+    def remaining(self):
+        """Seconds left or None if there is no deadline"""
+        if self.end is None:
+            return None
+        return max(0, self.end - time.time())
+
+    def expired(self):
+        return self.end is not None and time.time() >= self.end
+
+    def check(self):
+        """Raises DeadlineExceeded if the deadline has been reached"""
+        if self.expired():
+            raise DeadlineExceeded("deadline reached")
+
+    def timeout(self):
+        """Timeout for the next request: the per-request timeout but
+        no longer than the time remaining. None means no timeout"""
+        remaining = self.remaining()
+        if remaining is None:
+            return self.request_timeout
+        if self.request_timeout is None:
+            return remaining
+        return min(remaining, self.request_timeout)
+
+def applyPartialPolicy(args, record, fraction, logger=LOG, extrapolate=True,
+                       reason='deadline reached'):
+    """Applies the policy selected with `--partial` to an AccountingRecord
+    collected for the given `fraction` (0..1), e.g. before the deadline was
+    reached. Returns the record to be reported or None if nothing is to be
+    reported. Number, value, comment and quality of the record are
+    amended accordingly.
+
+    `extrapolate` is False if the fraction is no share of the data, e.g.
+    only of the collections done, and `fraction` is None if it is not known
+    at all; the result is skipped instead of being extrapolated then.
+    `reason` why the result is partial is noted in the comment."""
+    if fraction is None:
+        share = "an unknown share"
+        extrapolate = False
+    else:
+        share = "%.1f%%" % (100.0 * fraction)
+    logger.warning("Partial result (%s) of %s", reason, share)
+    policy = getattr(args, 'partial', 'skip')
+    if policy == 'extrapolate' and not extrapolate:
+        logger.warning("The result cannot be extrapolated from %s", share)
+        policy = 'skip'
+    if policy == 'extrapolate' and fraction > 0:
+        record.number = int(round(record.number / fraction))
+        record.value = int(round(record.value / fraction))
+        note = "extrapolated from %s (%s)" % (share, reason)
+        record.quality = 'extrapolated'
+    elif policy == 'flag':
+        record.quality = 'partial'
+        if fraction is None:
+            note = "partial (%s)" % reason
+        else:
+            note = "partial: %s complete (%s)" % (share, reason)
+    else:
+        logger.warning("Skipping the upload of the partial result")
+        return None
+    record.comment = (record.comment + '; ' if record.comment else '') + note
+    logger.info("Reporting result %s", note)
+    return record
+
+def getOption(fileparser, section, option, default=None):
+    """Returns the value of an optional configuration option or
+    `default` if either the section or the option is missing"""
+    if fileparser.has_option(section, option):
+        return fileparser.get(section, option)
+    return default
+
+def findCredentials(user=None, password=None):
+    """Returns (username, password). Looks into environment variables
+    ACCOUNTING_USER and ACCOUNTING_PW respectively if not given.
+    Raises ValueError if not found"""
+    user = user or os.getenv(USERKEY)
+    pw = password or os.getenv(PWKEY)
+    if not user:
+        raise ValueError("No user id provided")
+    if not pw:
+        raise ValueError("No password provided")
+    return (user, pw)
 
 def getCredentials(args):
     """Extracts and returns (username, password) from args.
     Looks into environment varaibles ACCOUNTING_USER and
     ACCOUNTING_PW respectively if not found in args.
     Terminates if not found"""
-
-    user = args.user
-    if not user:
-        user = os.getenv(USERKEY)
-    pw = args.password
-    if not pw:
-        pw = os.getenv(PWKEY)
-
-    if not user:
-        msg = "No user id provided"
-        LOG.error(msg)
-        sys.exit(msg)
-    if not pw:
-        msg = "No password provided"
+    try:
+        credentials = findCredentials(args.user, args.password)
+    except ValueError as e:
+        msg = str(e)
         LOG.error(msg)
         sys.exit(msg)
     LOG.info("Credentials found")
-    return (user, pw)
+    return credentials
 
-def getUrl(args):
-    """Constructs the URL to call based on the parameters provided"""
-    url = URL_PATTERN % (args.base_url, args.domain, args.account)
-    LOG.info("URL: " + url)
+def getUrl(args, account=None):
+    """Constructs the URL to call based on the parameters provided.
+    `account` replaces the account of `args` if given"""
+    url = URL_PATTERN % (args.base_url, args.domain,
+                         account or args.account)
+    LOG.info("URL: %s", url)
     return url
     
 def getData(args):
     """builds a query string including the data"""
-    core_pattern = "core.%s:record=%s"
-    meta_pattern = "meta.%s:record=%s"
-    vars = []
-    vars.append('account=%s' % args.account)
-    if args.key:
-        vars.append('key=%s' % args.key)
-    for k in ['type', 'value', 'unit']:
-        vars.append(core_pattern % (k, getattr(args, k)))
-    hasNumber = False
-    for k in ['service', 'number', 'object_type', 'measure_time', 'comment']:
-        value = getattr(args, k)
-        if k=='number' and value:
-            hasNumber = True
-        if value:
-            if k=='object_type' and not hasNumber:
-                continue
-            vars.append(meta_pattern % (k, value))
-    qstring = '&'.join(vars)
-    LOG.info("query string: " + qstring)
+    qstring = AccountingRecord.fromArgs(args).toQueryString()
+    LOG.info("query string: %s", qstring)
     return qstring
 
-def call(cred, url, data):
+def call(cred, url, data, session=requests, timeout=None):
     call_url = url+data
-    r = requests.post(call_url, auth=cred)
+    r = session.post(call_url, auth=cred, timeout=timeout)
     # TODO: add error handling
     return r
+
+def pooledSession(workers=4):
+    """Returns a requests session keeping up to `workers` connections
+    per host open"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def callAll(cred, calls, workers=4):
+    """posts all (url, data) pairs in `calls` over a pool of `workers`
+    connections. Returns a list of responses resp. the exceptions raised
+    in the same order"""
+    session = pooledSession(workers)
+
+    def post(item):
+        try:
+            return call(cred, item[0], item[1], session)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    pool = ThreadPool(max(1, min(workers, len(calls))))
+    try:
+        return pool.map(post, calls)
+    finally:
+        pool.close()
+        session.close()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""A minimal B2SHARE REST API in a thread for tests and benchmarks
+
+Serves a community of published records `first` to `records`, each with
+one file bucket of a known size. Search pages carry the 'next' link in
+the Link header like B2SHARE does. Replies are delayed by `delay`
+seconds and the search pages in `fail_pages` or beyond `result_window`
+hits are answered with an error. Searches for records by their id are
+supported and, if `aggregation` is set, searches carry the sum of
+`aggregated` sizes of their hits under that name.
+"""
+
+import json
+import re
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+COMMUNITY = 'c0ffee'
+TOKEN = 'secret-token'
+
+
+def recordSize(index):
+    return 1000 + index
+
+
+class B2SHAREHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        time.sleep(server.delay)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        base = 'http://%s:%s' % server.server_address
+        if url.path == '/api/user/':
+            return self._send({'id': 1})
+        if url.path == '/api/records/':
+            page = int(query.get('page', ['1'])[0])
+            size = int(query['size'][0])
+            if page in server.fail_pages:
+                return self._send({}, status=500)
+            if page * size > server.result_window:
+                # like Elasticsearch's index.max_result_window
+                return self._send({}, status=400)
+            found = list(range(server.first, server.records))
+            ids = re.search(r'id:\((.*)\)', query['q'][0])
+            if ids:
+                found = [int(i[1:]) for i in ids.group(1).split(' OR ')]
+            hits = [{'id': 'r%d' % i,
+                     'metadata': {'publication_state': 'published'},
+                     'links': {'publication': '%s/api/records/r%d'
+                               % (base, i)}}
+                    for i in found[(page - 1) * size:page * size]]
+            link = None
+            if page * size < len(found):
+                link = '<%s/api/records/?size=%d&q=community%%3A%s&page=%d>;' \
+                    ' rel="next"' % (base, size, COMMUNITY, page + 1)
+            reply = {'hits': {'hits': hits, 'total': len(found)},
+                     'links': {}}
+            if server.aggregation:
+                reply['aggregations'] = {server.aggregation: {
+                    'value': sum(server.aggregated(i) for i in found)}}
+            return self._send(reply, link)
+        if url.path.startswith('/api/records/r'):
+            index = url.path.split('/r')[-1]
+            return self._send({'links': {'files': '%s/api/files/b%s'
+                                         % (base, index)}})
+        if url.path.startswith('/api/files/b'):
+            index = int(url.path.split('/b')[-1])
+            return self._send({'size': recordSize(index)})
+        self._send({}, status=404)
+
+    def _send(self, reply, link=None, status=200):
+        body = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if link:
+            self.send_header('Link', link)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class B2SHAREServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, records, delay=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), B2SHAREHandler)
+        self.records = records
+        # records before this one have been deleted
+        self.first = 0
+        self.delay = delay
+        self.fail_pages = set()
+        self.result_window = 10000
+        self.aggregation = None
+        self.aggregated = recordSize
+        self.requests = []
+        self.url = 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        # clients giving up at their deadline break the connection
+        pass
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Conf(object):
+    """The B2SHARE configuration of the collector with all options off"""
+
+    def __init__(self, url, **options):
+        self.b2share_url = url
+        self.b2share_community = COMMUNITY
+        self.api_token = TOKEN
+        self.checkpoint_file = None
+        self.checkpoint_max_age = 24
+        self.page_workers = 0
+        self.aggregation = None
+        self.aggregation_sample = 0
+        self.aggregation_tolerance = 0.01
+        self.estimate_error = 0
+        self.estimate_confidence = 0.95
+        self.estimate_min_sample = 30
+        self.estimate_max_sample = 1000
+        self.cassette = None
+        self.cassette_mode = 'replay'
+        self.replay_latency = 1.0
+        self.__dict__.update(options)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the B2SHARE crawling strategies on a recorded crawl
+
+Usage: python tests/bench_b2share.py [cassette] [latency] [workers...]
+
+Replays the cassette (recorded with cassette_mode=record against a real
+B2SHARE instance; url and community are taken from it) with the
+recorded latencies multiplied by `latency`, following the 'next' links
+and fetching the pages with each number of workers given. Without a
+cassette a crawl of 1000 records of a local mock server answering
+after 5ms is recorded first.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from eudat.accounting.b2share.b2share_accounting import B2SHAREAccounting
+from eudat.accounting.b2share.cassette import Cassette
+
+from b2share_server import B2SHAREServer, Conf
+
+try:
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    # Python 3
+    from urllib.parse import urlsplit, parse_qs
+
+
+def crawl(conf):
+    accounting = B2SHAREAccounting(conf, logging.getLogger('bench'))
+    start = time.time()
+    result = accounting.report(argparse.Namespace(deadline=None,
+                                                  request_timeout=None))
+    assert accounting.complete, 'crawl failed, see the log'
+    return result, time.time() - start
+
+
+def recordMock(path, records=1000, delay=0.005):
+    server = B2SHAREServer(records, delay).start()
+    try:
+        crawl(Conf(server.url, cassette=path, cassette_mode='record'))
+    finally:
+        server.stop()
+
+
+def searchOf(path):
+    """Returns the url and community of the search in the cassette"""
+    for interaction in Cassette(path).interactions:
+        parts = urlsplit(interaction['url'])
+        if parts.path.endswith('/api/records/'):
+            community = parse_qs(parts.query)['q'][0].split(':', 1)[1]
+            return '%s://%s' % (parts.scheme, parts.netloc), community
+    raise ValueError('no search recorded in %s' % path)
+
+
+def main(argv=sys.argv):
+    root = tempfile.mkdtemp()
+    try:
+        if len(argv) > 1 and argv[1] != '-':
+            path = argv[1]
+        else:
+            path = os.path.join(root, 'mock.json.gz')
+            print("recording a crawl of the mock server")
+            recordMock(path)
+        latency = float(argv[2]) if len(argv) > 2 else 1.0
+        workers = [int(n) for n in argv[3:]] or [4, 16]
+        url, community = searchOf(path)
+        print("replaying %s with %sx the recorded latency"
+              % (path, latency))
+        reference = None
+        for count in [0] + workers:
+            conf = Conf(url, b2share_community=community, cassette=path,
+                        replay_latency=latency, page_workers=count)
+            result, seconds = crawl(conf)
+            label = '%d page workers' % count if count else 'next links'
+            print("%-16s %d records, %d bytes in %.2fs"
+                  % (label + ':', result[0], result[1], seconds))
+            assert reference is None or result == reference
+            reference = result
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the aggregation of bulk iCAT dumps
+
+Usage: python tests/bench_dump.py [rows] [collections] [accounts]
+
+Writes a dump of random replicas below ZONE, attributes them to accounts
+of nested collection prefixes and aggregates it line by line and, if
+NumPy is installed, vectorized. The memory used does not grow with the
+size of the dump but with the chunk size.
+"""
+
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from eudat.accounting.client import dump
+from eudat.accounting.client.accounts import AccountTrie
+from eudat.accounting.client.dump import DumpAggregator
+
+from icat_catalog import ZONE, OWNERS, RESOURCES
+
+
+def writeDump(path, rows, collections, seed=0):
+    rng = random.Random(seed)
+    names = ['%s/project%d/sub%d' % (ZONE, i % 100, i)
+             for i in range(collections)]
+    with open(path, 'w') as f:
+        for start in range(0, rows, 100000):
+            f.write(''.join(
+                '%s|%d|%d|%s|%s\n' % (rng.choice(names), i,
+                                      rng.randrange(1 << 30),
+                                      rng.choice(RESOURCES),
+                                      rng.choice(OWNERS))
+                for i in range(start, min(start + 100000, rows))))
+
+
+def timed(aggregator, path):
+    start = time.time()
+    totals = aggregator.aggregate(path)
+    return totals, time.time() - start
+
+
+def main(argv=sys.argv):
+    rows = int(argv[1]) if len(argv) > 1 else 2000000
+    collections = int(argv[2]) if len(argv) > 2 else 10000
+    accounts = int(argv[3]) if len(argv) > 3 else 300
+    # nested prefixes: projects and some of their sub-collections
+    prefixes = [('%s/project%d' % (ZONE, i), 'P%d' % i) for i in range(100)]
+    prefixes += [('%s/project%d/sub%d' % (ZONE, i % 100, i), 'S%d' % i)
+                 for i in range(accounts - len(prefixes))]
+    trie = AccountTrie(prefixes)
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'dump.txt')
+        print("writing %d rows in %d collections" % (rows, collections))
+        writeDump(path, rows, collections)
+        print("dump of %.0f MB, %d accounts"
+              % (os.path.getsize(path) / 1e6, len(prefixes)))
+        reference, seconds = timed(DumpAggregator(trie, vectorized=False),
+                                   path)
+        print("line by line: %.2fs, %.0f rows/s"
+              % (seconds, rows / seconds))
+        if dump.numpy is not None:
+            totals, seconds = timed(DumpAggregator(trie, vectorized=True),
+                                    path)
+            print("vectorized:   %.2fs, %.0f rows/s"
+                  % (seconds, rows / seconds))
+            assert totals == reference
+        print("peak memory: %.0f MB" % (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the direct iCAT backend on a synthetic SQLite catalog
+
+Usage: python tests/bench_icat.py [number of objects] [collections]
+
+Queries the totals of every user collection, once with the pooled
+connection and the reused statements of ICATDatabase and once with a new
+connection per query as a separate client process per query would do.
+With a PostgreSQL iCAT over the network the difference is larger.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from eudat.accounting.client.icat import ICATDatabase
+
+from icat_catalog import createCatalog, ZONE
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def pooled(path, collections):
+    db = ICATDatabase('sqlite3', path)
+    try:
+        return [db.collectionTotals(collection) for collection in collections]
+    finally:
+        db.close()
+
+
+def unpooled(path, collections):
+    results = []
+    for collection in collections:
+        db = ICATDatabase('sqlite3', path)
+        results.append(db.collectionTotals(collection))
+        db.close()
+    return results
+
+
+def main(argv=sys.argv):
+    objects = int(argv[1]) if len(argv) > 1 else 200000
+    count = int(argv[2]) if len(argv) > 2 else 200
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'icat.db')
+        print("generating %d objects in %d collections" % (objects, count))
+        createCatalog(path, collections=count, objects=objects)
+        collections = ['%s/user%d' % (ZONE, i) for i in range(12)] * 10
+        reference, seconds = timed(unpooled, path, collections)
+        print("new connection per query: %d queries in %.2fs"
+              % (len(collections), seconds))
+        result, seconds = timed(pooled, path, collections)
+        print("pooled connection:        %d queries in %.2fs"
+              % (len(collections), seconds))
+        assert result == reference
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the logging overhead per processed record
+
+Usage: python tests/bench_logging.py [number of records]
+
+Logs one info and one debug message per record, as the collectors do per
+collection or page, to a log file written synchronously by a
+RotatingFileHandler and to one written through the queue of asynclog.
+The debug messages are not written; they show the cost of building the
+message eagerly by concatenation compared to the lazy %-formatting.
+
+The time the collector spends per record is shown together with the
+time until the records are on disk. On a local disk with a warm cache
+the gain is moderate; it grows with the latency of the file system.
+"""
+
+import logging
+import logging.handlers
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from eudat.accounting.client import asynclog
+
+
+def run(logger, records, lazy):
+    for i in range(records):
+        collection = '/zone/home/user%d' % i
+        if lazy:
+            logger.info("Storage space for collection: %s: %s",
+                        collection, i * 1024)
+            logger.debug("Ignoring iquest output: %s", collection)
+        else:
+            logger.info("Storage space for collection: " + collection +
+                        ": " + str(i * 1024))
+            logger.debug("Ignoring iquest output: " + collection)
+
+
+def syncLogger(root, name):
+    logger = logging.getLogger('bench.' + name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(root, name + '.log'), maxBytes=10000000, backupCount=9)
+    handler.setFormatter(logging.Formatter(asynclog.LOG_FORMAT))
+    logger.addHandler(handler)
+    return logger
+
+
+def queuedLogger(root, name):
+    logger = logging.getLogger('bench.' + name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    asynclog.addLogFile(logger, os.path.join(root, name + '.log'))
+    return logger
+
+
+def main(argv=sys.argv):
+    records = int(argv[1]) if len(argv) > 1 else 100000
+    root = tempfile.mkdtemp()
+    try:
+        for name, factory, lazy in (('synchronous, eager', syncLogger, False),
+                                    ('synchronous, lazy', syncLogger, True),
+                                    ('queued, eager', queuedLogger, False),
+                                    ('queued, lazy', queuedLogger, True)):
+            logger = factory(root, name.replace(', ', '-'))
+            start = time.time()
+            run(logger, records, lazy)
+            caller = time.time() - start
+            asynclog.flushLogging()
+            total = time.time() - start
+            print("%-18s: %6.2f us per record in the collector, "
+                  "%6.2f us until written" % (name, 1e6 * caller / records,
+                                              1e6 * total / records))
+    finally:
+        asynclog.stopLogging()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
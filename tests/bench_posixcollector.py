@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the POSIXcollector tree walker on a generated tree
+
+Usage: python tests/bench_posixcollector.py [number of files] [workers ...]
+
+Compares the parallel walker with a plain os.walk/os.lstat loop. Note that
+on a local file system with a warm cache the walk is bound by the GIL;
+the walker pays off on network and parallel file systems.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from eudat.accounting.client.POSIXcollector import TreeWalker
+
+FILES_PER_DIR = 100
+DIRS_PER_DIR = 10
+
+
+def generate(root, files):
+    """Create a tree of `files` small files, FILES_PER_DIR per directory"""
+    dirs = [root]
+    created = 0
+    while created < files:
+        parent = dirs.pop(0)
+        for i in range(min(FILES_PER_DIR, files - created)):
+            with open(os.path.join(parent, 'f%d' % i), 'wb') as f:
+                f.write(b'x' * (i % 7))
+            created += 1
+        for i in range(DIRS_PER_DIR):
+            path = os.path.join(parent, 'd%d' % i)
+            os.mkdir(path)
+            dirs.append(path)
+
+
+def walk_reference(root):
+    files = size = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            files += 1
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return files, size
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main(argv=sys.argv):
+    files = int(argv[1]) if len(argv) > 1 else 100000
+    workers = [int(w) for w in argv[2:]] or [1, 4, 16]
+    root = tempfile.mkdtemp()
+    try:
+        print("generating %d files in %s" % (files, root))
+        generate(root, files)
+        result, seconds = timed(walk_reference, root)
+        print("os.walk:          %s in %.2fs" % (result, seconds))
+        for count in workers:
+            result, seconds = timed(TreeWalker(workers=count).walk, [root])
+            print("TreeWalker(%3d): %s in %.2fs (%d files/s)"
+                  % (count, result, seconds, result[0] / max(seconds, 1e-9)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""A stand-in for iquest answering the queries of the iRODScollector from
+the synthetic catalog of icat_catalog
+
+installIquest() writes an ``iquest`` executable running this module into
+a directory to be put in front of PATH. The catalog is taken from the
+environment variable FAKE_IQUEST_CATALOG. Queries containing
+FAKE_IQUEST_FAIL fail as often as there are lines in the file
+FAKE_IQUEST_FAILURES, which are removed one by one.
+"""
+
+import os
+import re
+import sqlite3
+import stat
+import sys
+
+import eudat.accounting
+from eudat.accounting.client.icat import COLUMNS, FROM, RESC_JOIN, \
+    parseConditions
+
+QUERY_PATTERN = r"select (.*?) where (.*?)(?: \| grep \w+)?$"
+COLLECTION_PATTERN = r"(COLL_NAME|COLL_PARENT_NAME) = '([^']*)'" \
+                     r"(?: \|\| like '([^']*)')?"
+AGGREGATE_PATTERN = r"(\w+)\((\w+)\)$"
+
+COLL_COLUMNS = {'COLL_NAME': 'c.coll_name',
+                'COLL_PARENT_NAME': 'c.parent_coll_name'}
+
+
+def installIquest(directory):
+    """Writes the iquest executable into `directory`"""
+    path = os.path.join(directory, 'iquest')
+    # the tests and the eudat package it is imported from
+    paths = [os.path.dirname(os.path.abspath(__file__)),
+             os.path.dirname(os.path.dirname(os.path.dirname(
+                 os.path.abspath(eudat.accounting.__file__))))]
+    with open(path, 'w') as f:
+        f.write("#!%s\nimport sys\nsys.path[:0] = %r\n"
+                "from fake_iquest import main\nmain()\n"
+                % (sys.executable, paths))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def translate(query):
+    """Returns the SQL statement, its parameters and the GenQuery names of
+    the columns selected by `query`"""
+    match = re.match(QUERY_PATTERN, query)
+    names = [name.strip() for name in match.group(1).split(',')]
+    where = match.group(2)
+    collection = re.match(COLLECTION_PATTERN, where)
+    conditions = parseConditions(where[collection.end():])
+
+    columns = []
+    groups = []
+    for name in names:
+        aggregate = re.match(AGGREGATE_PATTERN, name)
+        if aggregate:
+            columns.append("%s(%s)" % (aggregate.group(1),
+                                       COLUMNS[aggregate.group(2)]))
+        else:
+            column = COLL_COLUMNS.get(name) or COLUMNS[name]
+            columns.append(column)
+            groups.append(column)
+    if all(name in COLL_COLUMNS for name in names):
+        # no data objects needed
+        sql = "select %s from r_coll_main c" % ", ".join(columns)
+    else:
+        sql = "select %s from %s%s" % (", ".join(columns), FROM, RESC_JOIN)
+    sql += " where (%s = ?" % COLL_COLUMNS[collection.group(1)]
+    parameters = [collection.group(2)]
+    if collection.group(3):
+        sql += " or c.coll_name like ?"
+        parameters.append(collection.group(3))
+    sql += ")"
+    for column, op, value in conditions:
+        sql += " and %s %s ?" % (column, op)
+        parameters.append(value)
+    if groups and len(groups) < len(columns):
+        sql += " group by " + ", ".join(groups)
+    elif groups:
+        sql = sql.replace("select ", "select distinct ", 1)
+    return sql, parameters, names
+
+
+def _fail(query):
+    marker = os.environ.get('FAKE_IQUEST_FAIL')
+    failures = os.environ.get('FAKE_IQUEST_FAILURES')
+    if not marker or marker not in query or not failures or \
+       not os.path.exists(failures):
+        return False
+    with open(failures) as f:
+        lines = f.readlines()
+    if not lines:
+        return False
+    with open(failures, 'w') as f:
+        f.writelines(lines[1:])
+    return True
+
+
+def main(argv=sys.argv):
+    args = argv[1:]
+    if args and args[0] == '--no-page':
+        args = args[1:]
+    output_format = args[0] if len(args) > 1 else None
+    query = args[-1]
+    if _fail(query):
+        sys.stderr.write("ERROR: fake failure of %s\n" % query)
+        sys.exit(3)
+    sql, parameters, names = translate(query)
+    db = sqlite3.connect(os.environ['FAKE_IQUEST_CATALOG'])
+    rows = db.execute(sql, parameters).fetchall()
+    db.close()
+    rows = [['' if value is None else str(value) for value in row]
+            for row in rows]
+    if not rows:
+        sys.stdout.write("CAT_NO_ROWS_FOUND: Nothing was found matching "
+                         "your query\n")
+        sys.exit(1)
+    for row in rows:
+        if output_format:
+            sys.stdout.write(output_format % tuple(row) + "\n")
+        else:
+            for name, value in zip(names, row):
+                # aggregates are shown with the name of their attribute
+                aggregate = re.match(AGGREGATE_PATTERN, name)
+                if aggregate:
+                    name = aggregate.group(2)
+                sys.stdout.write("%s = %s\n" % (name, value))
+            sys.stdout.write("-" * 60 + "\n")
+
+
+if __name__ == '__main__':
+    main()
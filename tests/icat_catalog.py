@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""A synthetic iCAT catalog in SQLite for tests and benchmarks
+
+Only the columns of R_COLL_MAIN, R_DATA_MAIN and R_RESC_MAIN used by the
+iRODScollector are created. Objects get random sizes, owners, resources,
+creation and modification times; some of them have a second replica.
+"""
+
+import random
+import sqlite3
+
+ZONE = '/tstZone/home'
+OWNERS = ('alice', 'bob', 'carol')
+RESOURCES = ('demoResc', 'archResc')
+START = 1500000000
+END = 1600000000
+
+SCHEMA = """
+create table r_coll_main (coll_id integer primary key,
+                          parent_coll_name text, coll_name text);
+create table r_resc_main (resc_id integer primary key, resc_name text);
+create table r_data_main (data_id integer, coll_id integer,
+                          data_name text, data_repl_num integer,
+                          data_size integer, resc_name text,
+                          resc_id integer, data_owner_name text,
+                          create_ts text, modify_ts text);
+create index idx_coll_main on r_coll_main (coll_name);
+create index idx_data_main on r_data_main (coll_id);
+"""
+
+
+def createCatalog(path, collections=20, objects=1000, seed=0):
+    """Creates the catalog in the SQLite database `path` with `objects`
+    objects spread over `collections` collections below ZONE/user<n>.
+    Returns the replicas created as list of dictionaries."""
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    for resc_id, name in enumerate(RESOURCES):
+        db.execute("insert into r_resc_main values (?, ?)", (resc_id, name))
+    names = []
+    for coll_id in range(collections):
+        parent = '%s/user%d' % (ZONE, coll_id % 12)
+        name = parent if coll_id < 12 else '%s/coll%d' % (parent, coll_id)
+        names.append(name)
+        db.execute("insert into r_coll_main values (?, ?, ?)",
+                   (coll_id, name.rsplit('/', 1)[0], name))
+    replicas = []
+    for data_id in range(objects):
+        coll_id = rng.randrange(collections)
+        size = rng.randrange(1 << 20)
+        owner = rng.choice(OWNERS)
+        created = rng.randrange(START, END)
+        modified = rng.choice((created, rng.randrange(created, END)))
+        for repl_num in range(rng.choice((1, 1, 1, 2))):
+            resc_id = (data_id + repl_num) % len(RESOURCES)
+            replica = {'collection': names[coll_id], 'size': size,
+                       'owner': owner, 'resource': RESOURCES[resc_id],
+                       'created': '%011d' % created,
+                       'modified': '%011d' % modified}
+            db.execute("insert into r_data_main values "
+                       "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (data_id, coll_id, 'obj%d' % data_id, repl_num,
+                        size, replica['resource'], resc_id, owner,
+                        replica['created'], replica['modified']))
+            replicas.append(replica)
+    db.commit()
+    db.close()
+    return replicas
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the programmatic AccountingClient"""
+
+import sys
+import threading
+import time
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from eudat.accounting.client.api import AccountingClient, AccountingError
+from eudat.accounting.client.record import AccountingRecord
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    """Answers addRecord calls with a running key, fails for account 'bad'
+    """
+    def do_POST(self):
+        self.server.paths.append(self.path)
+        if '/bad/' in self.path:
+            self.send_response(403)
+            body = b'forbidden'
+        else:
+            self.send_response(200)
+            body = ('key%s' % len(self.server.paths)).encode('ascii')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class AccountingClientTest(unittest.TestCase):
+    """Batching, coalescing and error reporting
+    """
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%s' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _client(self, **kw):
+        return AccountingClient(base_url=self.base_url, user='u',
+                                password='p', **kw)
+
+    def test_coalesce(self):
+        """records with the same key in one window are sent once
+        """
+        with self._client(batch_window=0.5) as client:
+            first = client.submit(AccountingRecord('acc', 1, key='k'))
+            last = client.submit(AccountingRecord('acc', 2, key='k'))
+            other = client.submit(AccountingRecord('acc', 3))
+            client.flush()
+        self.assertEqual(len(self.server.paths), 2)
+        self.assertEqual(first.result(), last.result())
+        self.assertNotEqual(first.result(), other.result())
+        keyed = [p for p in self.server.paths if 'key=k' in p]
+        self.assertEqual(len(keyed), 1)
+        self.assertTrue('core.value:record=2' in keyed[0])
+
+    def test_errors(self):
+        """failed uploads are set on the futures, nothing exits
+        """
+        with self._client() as client:
+            future = client.submit(AccountingRecord('bad', 1))
+            self.assertRaises(AccountingError, future.result, 10)
+        self.assertRaises(AccountingError, client.submit,
+                          AccountingRecord('acc', 1))
+
+    def test_back_pressure(self):
+        """a full queue refuses non-blocking submissions
+        """
+        client = self._client(max_pending=1, batch_window=0.5, max_batch=1)
+        try:
+            futures = []
+            self.assertRaises(AccountingError, self._fill, client, futures)
+            client.flush()
+            self.assertTrue(all(f.result() for f in futures))
+        finally:
+            client.close()
+
+    def test_close_while_submitting(self):
+        """a submission accepted while closing is still sent
+        """
+        client = self._client(test=True)
+        put = client._queue.put
+
+        def slowPut(item, *args):
+            # widens the window between checking and queueing
+            if item is not None:
+                time.sleep(0.2)
+            put(item, *args)
+
+        client._queue.put = slowPut
+        futures = []
+        thread = threading.Thread(target=lambda: futures.append(
+            client.submit(AccountingRecord('acc', 1))))
+        thread.start()
+        time.sleep(0.05)
+        client.close()
+        thread.join()
+        self.assertEqual(futures[0].result(10), None)
+
+    def _fill(self, client, futures):
+        for i in range(10):
+            futures.append(client.submit(AccountingRecord('acc', i),
+                                         block=False))
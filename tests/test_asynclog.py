@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the queued log files"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.client import asynclog
+
+
+class LogFileTest(unittest.TestCase):
+    """Handlers are shared per file and not added twice
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'test.log')
+        self.logger = logging.getLogger('test_asynclog')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.child = logging.getLogger('test_asynclog.child')
+
+    def tearDown(self):
+        for logger in (self.logger, self.child):
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+        shutil.rmtree(self.root)
+
+    def _lines(self):
+        asynclog.flushLogging()
+        with open(self.path) as f:
+            return f.readlines()
+
+    def test_no_duplicates(self):
+        """repeated runs and child loggers write each record once
+        """
+        handler = asynclog.addLogFile(self.logger, self.path)
+        self.assertTrue(asynclog.addLogFile(self.logger, self.path) is handler)
+        asynclog.addLogFile(self.child, self.path)
+        self.assertEqual(self.logger.handlers, [handler])
+        self.assertEqual(self.child.handlers, [])
+        self.child.info("objects: %s", 42)
+        self.child.debug("not written: %s", 0)
+        lines = self._lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith(
+            " - test_asynclog.child - INFO - objects: 42\n"))
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of crawling B2SHARE communities"""
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+try:
+    from BaseHTTPServer import HTTPServer
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer
+
+from eudat.accounting.b2share.b2share_accounting import B2SHAREAccounting
+from eudat.accounting.b2share.b2share_collector import EUDATAccounting
+
+from b2share_server import B2SHAREServer, Conf, TOKEN, recordSize
+from test_api import RecordingHandler
+
+
+class CheckpointTest(unittest.TestCase):
+    """A failed crawl is resumed from its checkpoint
+    """
+    records = 95
+    page_workers = 0
+    # search pages fetched again after page 4 failed
+    resumed_pages = 10 - 3
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.root, 'checkpoint.json')
+        self.server = B2SHAREServer(self.records).start()
+        self.args = argparse.Namespace(deadline=None, request_timeout=None)
+        self.logger = logging.getLogger('test_b2share')
+        self.expected = (self.records,
+                         sum(recordSize(i) for i in range(self.records)))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.root)
+
+    def _accounting(self, **options):
+        options.setdefault('page_workers', self.page_workers)
+        conf = Conf(self.server.url, checkpoint_file=self.checkpoint,
+                    **options)
+        accounting = B2SHAREAccounting(conf, self.logger)
+        accounting.page_size = '10'
+        return accounting
+
+    def _pages(self):
+        """the search pages requested so far"""
+        return [path for path in self.server.requests
+                if path.startswith('/api/records/?')]
+
+    def test_resume(self):
+        """only the pages not done before are fetched again
+        """
+        self.server.fail_pages = set([4])
+        accounting = self._accounting()
+        accounting.report(self.args)
+        self.assertFalse(accounting.complete)
+        with open(self.checkpoint) as f:
+            self.assertFalse(TOKEN in f.read())
+
+        self.server.fail_pages = set()
+        del self.server.requests[:]
+        accounting = self._accounting()
+        self.assertEqual(accounting.report(self.args), self.expected)
+        self.assertTrue(accounting.complete)
+        self.assertEqual(len(self._pages()), self.resumed_pages)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_outdated(self):
+        """checkpoints older than checkpoint_max_age are ignored
+        """
+        self.server.fail_pages = set([4])
+        self._accounting().report(self.args)
+        old = time.time() - 2 * 3600
+        os.utime(self.checkpoint, (old, old))
+        self.server.fail_pages = set()
+        del self.server.requests[:]
+        accounting = self._accounting(checkpoint_max_age=1)
+        self.assertEqual(accounting.report(self.args), self.expected)
+        self.assertEqual(len(self._pages()), 10)
+
+    def test_records_added(self):
+        """a checkpoint of fewer records is not resumed from
+        """
+        self.server.fail_pages = set([4])
+        self._accounting().report(self.args)
+        self.server.records += 1
+        self.server.fail_pages = set()
+        del self.server.requests[:]
+        accounting = self._accounting()
+        self.assertEqual(accounting.report(self.args),
+                         (self.records + 1, self.expected[1] +
+                          recordSize(self.records)))
+        self.assertTrue(accounting.complete)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_records_removed(self):
+        """records removed before the pages done move the others up
+        """
+        self.server.fail_pages = set([4])
+        self._accounting().report(self.args)
+        self.server.first = 1
+        self.server.fail_pages = set()
+        accounting = self._accounting()
+        self.assertEqual(accounting.report(self.args),
+                         (self.records - 1, self.expected[1] -
+                          recordSize(0)))
+        self.assertTrue(accounting.complete)
+
+    def test_no_partial_upload(self):
+        """the collector refuses to report the totals of a failed crawl
+        """
+        self.server.fail_pages = set([4])
+        conf = Conf(self.server.url, page_workers=self.page_workers,
+                    account='acc')
+        eurep = EUDATAccounting(conf, self.logger)
+        eurep.b2share_accounting.page_size = '10'
+        args = argparse.Namespace(deadline=None, request_timeout=None,
+                                  partial='skip')
+        self.assertRaises(SystemExit, eurep.collectRecords, args)
+
+
+class ParallelTest(CheckpointTest):
+    """Pages fetched concurrently once hits.total is known
+    """
+    page_workers = 4
+    # the total checked again and page 4, the others are done while it
+    # fails
+    resumed_pages = 2
+
+    def test_parallel(self):
+        """each page is fetched once with the same totals
+        """
+        for workers in (1, 3, 16):
+            del self.server.requests[:]
+            accounting = self._accounting(page_workers=workers)
+            self.assertEqual(accounting.report(self.args), self.expected)
+            self.assertTrue(accounting.complete)
+            self.assertEqual(sorted(self._pages()),
+                             sorted(set(self._pages())))
+            self.assertEqual(len(self._pages()), 10)
+
+
+class AggregationTest(unittest.TestCase):
+    """The aggregation of the search is validated on a random sample
+    """
+    def setUp(self):
+        random.seed(0)
+        self.server = B2SHAREServer(500).start()
+        self.server.aggregation = 'size'
+        self.args = argparse.Namespace(deadline=None, request_timeout=None)
+        self.expected = (500, sum(recordSize(i) for i in range(500)))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _report(self):
+        conf = Conf(self.server.url, aggregation='size',
+                    aggregation_sample=5)
+        accounting = B2SHAREAccounting(conf,
+                                       logging.getLogger('test_b2share'))
+        return accounting.report(self.args)
+
+    def test_aggregation(self):
+        """a matching aggregation is used instead of crawling
+        """
+        self.assertEqual(self._report(), self.expected)
+        self.assertFalse(any('size=100' in path
+                             for path in self.server.requests))
+
+    def test_mismatch(self):
+        """an aggregation only right for the first records is not used
+        """
+        self.server.aggregated = lambda i: recordSize(i) if i < 100 else 0
+        self.assertEqual(self._report(), self.expected)
+        self.assertTrue(any('size=100' in path
+                            for path in self.server.requests))
+
+
+class EstimateTest(unittest.TestCase):
+    """Estimates from a sample cut short by the deadline are partial
+    """
+    def setUp(self):
+        self.server = B2SHAREServer(500, delay=0.01).start()
+        # batches of ESTIMATE_BATCH records until the deadline
+        conf = Conf(self.server.url, estimate_error=0.0001,
+                    estimate_min_sample=2, estimate_max_sample=500,
+                    account='acc')
+        self.eurep = EUDATAccounting(conf, logging.getLogger('test_b2share'))
+        self.eurep.b2share_accounting.page_size = '10'
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _args(self, deadline, partial='flag'):
+        return argparse.Namespace(deadline=deadline, request_timeout=None,
+                                  partial=partial, key='', type='storage',
+                                  unit='byte',
+                                  object_type='registered object',
+                                  measure_time='', comment='')
+
+    def test_deadline(self):
+        """the estimate is flagged with the share of the records sized
+        """
+        records = self.eurep.collectRecords(self._args(1))
+        accounting = self.eurep.b2share_accounting
+        self.assertFalse(accounting.complete)
+        self.assertTrue(accounting.deadline_reached)
+        self.assertEqual(accounting.completeness,
+                         accounting.estimate['sample'] / 500.0)
+        self.assertTrue(accounting.completeness < 1)
+        self.assertTrue(records[0].comment.startswith('partial: '))
+        self.assertEqual(records[0].quality, 'partial')
+        self.assertTrue('estimated from %s records'
+                        % accounting.estimate['sample']
+                        in records[0].comment)
+        for partial in ('skip', 'extrapolate'):
+            self.assertRaises(SystemExit, self.eurep.collectRecords,
+                              self._args(1, partial))
+
+
+class EstimateSampleTest(unittest.TestCase):
+    """Estimates of communities of a known size
+    """
+    def setUp(self):
+        random.seed(0)
+        self.logger = logging.getLogger('test_b2share')
+
+    def _server(self, records):
+        server = B2SHAREServer(records).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def _accounting(self, server, **options):
+        options.setdefault('estimate_error', 0.05)
+        return B2SHAREAccounting(Conf(server.url, **options), self.logger)
+
+    def test_interval(self):
+        """the exact total lies within the interval of the estimate
+        """
+        server = self._server(2000)
+        accounting = self._accounting(server)
+        hits, amount = accounting.report(argparse.Namespace(
+            deadline=None, request_timeout=None))
+        exact = sum(recordSize(i) for i in range(2000))
+        estimate = accounting.estimate
+        self.assertEqual(hits, 2000)
+        self.assertTrue(accounting.complete)
+        self.assertTrue(estimate['lower'] <= exact <= estimate['upper'])
+        self.assertTrue(estimate['lower'] <= amount <= estimate['upper'])
+        self.assertTrue(estimate['relative_error'] <= 0.05)
+        self.assertTrue(estimate['sample'] < 2000)
+
+    def test_result_window(self):
+        """communities beyond the result window are sampled within it
+        """
+        server = self._server(25000)
+        accounting = self._accounting(server, estimate_max_sample=40)
+        hits, amount = accounting.report(argparse.Namespace(
+            deadline=None, request_timeout=None))
+        self.assertTrue(accounting.complete)
+        self.assertEqual(hits, 25000)
+        self.assertEqual(accounting.estimate['sample'], 40)
+        self.assertTrue(amount > 0)
+
+    def test_meta_fields(self):
+        """the interval of the estimate is sent with the record
+        """
+        server = self._server(500)
+        accounting = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        accounting.paths = []
+        thread = threading.Thread(target=accounting.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(accounting.server_close)
+        self.addCleanup(accounting.shutdown)
+        conf = Conf(server.url, estimate_error=0.01, account='acc',
+                    base_url='http://127.0.0.1:%s' % accounting.server_port,
+                    domain='eudat', user='u', password='p')
+        eurep = EUDATAccounting(conf, self.logger)
+        args = argparse.Namespace(deadline=None, request_timeout=None,
+                                  partial='skip', key='', type='storage',
+                                  unit='byte',
+                                  object_type='registered object',
+                                  measure_time='', comment='', test=False,
+                                  verbose=False)
+        records = eurep.reportStatistics(args)
+        self.assertEqual(records[0].quality, 'estimated')
+        estimate = eurep.b2share_accounting.estimate
+        self.assertEqual(len(accounting.paths), 1)
+        self.assertFalse('quality' in accounting.paths[0])
+        for name in ('lower', 'upper', 'confidence', 'sample'):
+            self.assertTrue('meta.estimate_%s:record=%s'
+                            % (name, estimate[name]) in accounting.paths[0])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of recording and replaying B2SHARE crawls"""
+
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.b2share.b2share_accounting import B2SHAREAccounting
+
+from b2share_server import B2SHAREServer, Conf, TOKEN, recordSize
+
+
+class CassetteTest(unittest.TestCase):
+    """A recorded crawl is replayed offline with the same result
+    """
+    records = 250
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'crawl.json.gz')
+        self.server = B2SHAREServer(self.records).start()
+        self.url = self.server.url
+        self.args = argparse.Namespace(deadline=None, request_timeout=None)
+        self.logger = logging.getLogger('test_cassette')
+
+    def tearDown(self):
+        if self.server:
+            self.server.stop()
+        shutil.rmtree(self.root)
+
+    def _report(self, **options):
+        conf = Conf(self.url, cassette=self.path, **options)
+        accounting = B2SHAREAccounting(conf, self.logger)
+        return accounting, accounting.report(self.args)
+
+    def test_record_replay(self):
+        """recorded sequentially, replayed in parallel without the server
+        """
+        expected = (self.records,
+                    sum(recordSize(i) for i in range(self.records)))
+        accounting, result = self._report(cassette_mode='record')
+        self.assertEqual(result, expected)
+        recorded = len(self.server.requests)
+        self.assertEqual(len(accounting.cassette.interactions), recorded)
+        with gzip.open(self.path, 'rb') as f:
+            self.assertFalse(TOKEN.encode('ascii') in f.read())
+
+        # replayed from the same url with nothing listening there
+        self.server.stop()
+        self.server = None
+        accounting, result = self._report(replay_latency=0)
+        self.assertEqual(result, expected)
+        self.assertTrue(accounting.complete)
+        accounting, result = self._report(replay_latency=0, page_workers=3)
+        self.assertEqual(result, expected)
+
+    def test_other_token(self):
+        """the token used for replaying need not be the recorded one
+        """
+        self._report(cassette_mode='record')
+        accounting, result = self._report(replay_latency=0,
+                                          api_token='other-token')
+        self.assertTrue(accounting.complete)
+        accounting, result = self._report(replay_latency=0,
+                                          b2share_community='other')
+        self.assertFalse(accounting.complete)
@@ -32,7 +32,25 @@ def load_tests(loader, tests, ignore):
 
     # Run the doctests in the various modules
     import eudat.accounting.client
-    modules_with_doctests = (eudat.accounting.client,)
+    import eudat.accounting.client.record
+    import eudat.accounting.client.icat
+    import eudat.accounting.client.api
+    import eudat.accounting.client.accounts
+    import eudat.accounting.client.history
+    import eudat.accounting.client.backfill
+    import eudat.accounting.client.POSIXcollector
+    import eudat.accounting.b2share.b2share_accounting
+    import eudat.accounting.b2share.cassette
+    modules_with_doctests = (eudat.accounting.client,
+                             eudat.accounting.client.record,
+                             eudat.accounting.client.icat,
+                             eudat.accounting.client.api,
+                             eudat.accounting.client.accounts,
+                             eudat.accounting.client.history,
+                             eudat.accounting.client.backfill,
+                             eudat.accounting.client.POSIXcollector,
+                             eudat.accounting.b2share.b2share_accounting,
+                             eudat.accounting.b2share.cassette)
     for module in modules_with_doctests:
         tests.addTests(doctest.DocTestSuite(module))
     return tests
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the aggregation of bulk iCAT dumps"""
+
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.client import dump
+from eudat.accounting.client.accounts import AccountTrie
+from eudat.accounting.client.dump import DumpAggregator, readChunks
+
+from icat_catalog import createCatalog, ZONE
+
+ACCOUNTS = [(ZONE, 'zone'), (ZONE + '/user1', 'A'),
+            (ZONE + '/user1/coll13', 'C'), (ZONE + '/user2', 'B')]
+
+
+def writeDump(path, replicas):
+    """Writes the replicas like iquest does, with a line for a query
+    without rows in between"""
+    with open(path, 'w') as f:
+        for i, r in enumerate(replicas):
+            f.write('%s|%s|%s|%s|%s\n' % (r['collection'], i, r['size'],
+                                          r['resource'], r['owner']))
+            if i == len(replicas) // 2:
+                f.write('CAT_NO_ROWS_FOUND: Nothing was found matching '
+                        'your query\n')
+
+
+class DumpAggregatorTest(unittest.TestCase):
+    """Aggregations of a dump compared with its content
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'dump.txt')
+        self.replicas = createCatalog(os.path.join(self.root, 'icat.db'),
+                                      collections=30, objects=3000)
+        writeDump(self.path, self.replicas)
+        self.trie = AccountTrie(ACCOUNTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _expected(self, by_resource=False, by_owner=False):
+        totals = {}
+        for r in self.replicas:
+            key = (self.trie.account(r['collection']),
+                   r['resource'] if by_resource else '',
+                   r['owner'] if by_owner else '')
+            total = totals.setdefault(key, [0, 0])
+            total[0] += 1
+            total[1] += r['size']
+        return totals
+
+    def test_chunks(self):
+        """chunks end at line ends and cover the whole file
+        """
+        chunks = list(readChunks(self.path, 1000))
+        self.assertTrue(len(chunks) > 10)
+        self.assertTrue(all(chunk.endswith(b'\n') for chunk in chunks))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(b''.join(chunks), f.read())
+
+    def test_lines(self):
+        """line by line, also grouped by resource and owner
+        """
+        aggregator = DumpAggregator(self.trie, vectorized=False,
+                                    chunk_size=4096)
+        self.assertEqual(aggregator.aggregate(self.path), self._expected())
+        aggregator = DumpAggregator(self.trie, ('resource', 'owner'),
+                                    vectorized=False)
+        self.assertEqual(aggregator.aggregate(self.path),
+                         self._expected(True, True))
+
+    @unittest.skipIf(dump.numpy is None, "NumPy is not installed")
+    def test_vectorized(self):
+        """with NumPy over chunks of different sizes
+        """
+        for chunk_size in (4096, 100000, dump.CHUNK_SIZE):
+            aggregator = DumpAggregator(self.trie, vectorized=True,
+                                        chunk_size=chunk_size)
+            self.assertEqual(aggregator.aggregate(self.path),
+                             self._expected())
+        aggregator = DumpAggregator(self.trie, ('owner',), vectorized=True,
+                                    chunk_size=8192)
+        self.assertEqual(aggregator.aggregate(self.path),
+                         self._expected(by_owner=True))
+
+
+class MalformedDumpTest(unittest.TestCase):
+    """Lines without all fields or without a size are skipped alike
+    """
+    LINES = [b'/z/a|1|10|r|o', b'/z/a|2|20|r', b'/z/a|3|30|r|o|x',
+             b'/z/a|4||r|o', b'/z/a|5|4x|r|o', b'', b'/z/b|6|60|r|o',
+             b'/z/a|7|70|r|o']
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'dump.txt')
+        self.trie = AccountTrie([('/z/a', 'A'), ('/z/b', 'B')])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _aggregate(self, lines, **options):
+        with open(self.path, 'wb') as f:
+            f.write(b'\n'.join(lines))
+        return DumpAggregator(self.trie, **options).aggregate(self.path)
+
+    def test_lines(self):
+        """only the well formed lines are counted
+        """
+        self.assertEqual(self._aggregate(self.LINES, vectorized=False),
+                         {('A', '', ''): [2, 80], ('B', '', ''): [1, 60]})
+
+    @unittest.skipIf(dump.numpy is None, "NumPy is not installed")
+    def test_vectorized(self):
+        """the same totals, also if malformed lines cancel out per chunk
+        """
+        for chunk_size in (1, 20, 1000):
+            for lines in (self.LINES, self.LINES[1:3], self.LINES[3:4]):
+                self.assertEqual(
+                    self._aggregate(lines, vectorized=True,
+                                    chunk_size=chunk_size),
+                    self._aggregate(lines, vectorized=False))
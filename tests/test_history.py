@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the local history of the collectors"""
+
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+from eudat.accounting.client.history import HistoryStore, Application, DAY
+from eudat.accounting.client.record import AccountingRecord
+
+NOW = 1600000000
+
+
+class HistoryStoreTest(unittest.TestCase):
+    """Storing, thinning out and querying measurements
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'history.db')
+        self.store = HistoryStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def _fill(self, days, per_day=4):
+        """one measurement of acc every 6 hours growing by 1000 per day"""
+        for i in range(days * per_day):
+            t = NOW - days * DAY + i * DAY // per_day
+            self.store.append([AccountingRecord('acc', 1000 * i // per_day,
+                                                number=i)], now=t)
+
+    def test_append(self):
+        """measurements replace the one of the same account, type and time
+        """
+        self.store.append([AccountingRecord('a', 1, number=1),
+                           AccountingRecord('b', 2, type='cpu')], now=NOW)
+        self.store.append([AccountingRecord('a', 3)], now=NOW)
+        self.store.append([AccountingRecord('a', 4,
+                                            measure_time=str(NOW - DAY))])
+        self.assertEqual(self.store.accounts(), [('a', 'storage'),
+                                                 ('b', 'cpu')])
+        self.assertEqual(self.store.series('a'),
+                         [(NOW - DAY, 4, None), (NOW, 3, None)])
+        self.assertEqual(self.store.series('a', start=NOW), [(NOW, 3, None)])
+
+    def test_prune(self):
+        """old measurements are thinned out per day resp. week
+        """
+        self._fill(60)
+        removed = self.store.prune(raw_days=10, daily_days=30, now=NOW)
+        series = self.store.series('acc')
+        self.assertEqual(len(series) + removed, 240)
+        recent = [t for t, v, n in series if t >= NOW - 10 * DAY]
+        self.assertEqual(len(recent), 40)
+        daily = [t for t, v, n in series
+                 if NOW - 30 * DAY <= t < NOW - 10 * DAY]
+        self.assertEqual(len(daily), len(set(t // DAY for t in daily)))
+        weekly = [t for t, v, n in series if t < NOW - 30 * DAY]
+        self.assertEqual(len(weekly), len(set(t // (7 * DAY)
+                                              for t in weekly)))
+        # the last value of a day survives
+        self.assertEqual(series[-1], (NOW - DAY // 4, 59750, 239))
+        self.store.prune(keep_days=20, now=NOW)
+        self.assertTrue(self.store.series('acc')[0][0] >= NOW - 20 * DAY)
+
+    def test_quality(self):
+        """partial and estimated values are marked and left out of trends
+        """
+        self.store.append([AccountingRecord('acc', 100)], now=NOW - DAY)
+        self.store.append([AccountingRecord('acc', 200)], now=NOW)
+        self.store.append([AccountingRecord('acc', 10, quality='partial')],
+                          now=NOW + 60)
+        self.store.append([AccountingRecord('acc', 9000,
+                                            quality='estimated')],
+                          now=NOW + DAY)
+        self.assertEqual([row[3] for row in self.store.measurements('acc')],
+                         [None, None, 'partial', 'estimated'])
+        self.assertEqual(self.store.series('acc', complete=True),
+                         [(NOW - DAY, 100, None), (NOW, 200, None)])
+        # the full measurement of a day is kept rather than a later one
+        self.store.prune(raw_days=0, now=NOW + 2 * DAY)
+        self.assertEqual(self.store.series('acc', start=NOW, end=NOW + 60),
+                         [(NOW, 200, None)])
+        self.store.close()
+        out = StringIO()
+        rows = Application(['accountingHistory', 'trend', '--history',
+                            self.path]).run(out)
+        self.store = HistoryStore(self.path)
+        self.assertEqual((rows[0]['last'], rows[0]['measurements']),
+                         (200, 2))
+
+    def test_old_history(self):
+        """a history written without qualities is extended
+        """
+        self.store.close()
+        db = sqlite3.connect(self.path)
+        db.executescript("drop table measurements; "
+                         "create table measurements (account text, "
+                         "type text, time integer, value numeric, "
+                         "number integer, unit text, "
+                         "primary key (account, type, time));"
+                         "insert into measurements values "
+                         "('acc', 'storage', 1, 2, 3, 'byte');")
+        db.close()
+        self.store = HistoryStore(self.path)
+        self.store.append([AccountingRecord('acc', 5, quality='partial')],
+                          now=NOW)
+        self.assertEqual(self.store.measurements('acc'),
+                         [(1, 2, 3, None), (NOW, 5, None, 'partial')])
+
+    def test_trend(self):
+        """the trend command fits the growth per day
+        """
+        self._fill(10)
+        self.store.close()
+        out = StringIO()
+        app = Application(['accountingHistory', 'trend', '--history',
+                           self.path, '--format', 'json', '--horizon', '5',
+                           '--limit', '20000'])
+        rows = app.run(out)
+        self.store = HistoryStore(self.path)
+        self.assertEqual(json.loads(out.getvalue()), rows)
+        trend = rows[0]
+        self.assertEqual((trend['account'], trend['measurements']),
+                         ('acc', 40))
+        self.assertAlmostEqual(trend['rate'], 1000, 6)
+        self.assertAlmostEqual(trend['forecast'], trend['last'] + 5000, -1)
+        self.assertAlmostEqual(trend['limit_reached'],
+                               trend['last_time'] + 10.25 * DAY, -1)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the direct iCAT database backend of the iRODScollector"""
+
+import logging
+from argparse import Namespace
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.client import backfill, icat
+from eudat.accounting.client.utils import Deadline
+from eudat.accounting.client.backfill import DAY
+from eudat.accounting.client.icat import ICATDatabase, QueryTimeout
+from eudat.accounting.client.iRODScollector import EUDATAccounting
+
+from icat_catalog import createCatalog, ZONE, START
+
+
+class Conf(object):
+    """The options of the iRODScollector configuration used here"""
+    collections = ZONE + '/user1 ' + ZONE + '/user2'
+    state_file = None
+    full_interval = 7
+    sharded = []
+    icat_driver = 'sqlite3'
+    icat_connections = 2
+    accounts = []
+    unmatched_account = None
+    account = 'acc'
+
+
+class ICATDatabaseTest(unittest.TestCase):
+    """Aggregations of a synthetic catalog compared with its content
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        self.replicas = createCatalog(self.path, collections=30,
+                                      objects=2000)
+        self.db = ICATDatabase('sqlite3', self.path)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.root)
+
+    def _expected(self, collection, select=lambda replica: True):
+        # like "COLL_NAME = 'x' || like 'x%'": user1 includes user10
+        found = [r for r in self.replicas
+                 if r['collection'].startswith(collection) and select(r)]
+        return len(found), sum(r['size'] for r in found)
+
+    def test_collection_totals(self):
+        """replicas of the collection and all below it are counted
+        """
+        for collection in (ZONE, ZONE + '/user1', ZONE + '/user3'):
+            self.assertEqual(self.db.collectionTotals(collection),
+                             self._expected(collection))
+
+    def test_conditions(self):
+        """the conditions of the incremental queries restrict the totals
+        """
+        since = '01550000000'
+        condition = " and DATA_CREATE_TIME > '%s'" % since
+        self.assertEqual(
+            self.db.collectionTotals(ZONE + '/user1', condition),
+            self._expected(ZONE + '/user1',
+                           lambda r: r['created'] > since))
+        self.assertRaises(ValueError, self.db.collectionTotals, ZONE,
+                          " or DATA_SIZE > '0'")
+
+    def test_timeout(self):
+        """statements running longer than their timeout are cancelled
+        """
+        self.assertRaises(QueryTimeout, self.db.collectionTotals, ZONE,
+                          '', 1e-9)
+        self.assertEqual(self.db.collectionTotals(ZONE, '', 60),
+                         self._expected(ZONE))
+        self.assertEqual(self.db.collectionTotals(ZONE), self._expected(ZONE))
+        conf = Conf()
+        conf.icat_dsn = self.path
+        eurep = EUDATAccounting(conf, logging.getLogger('test'))
+        eurep.deadline = Deadline(request_timeout=1e-9)
+        self.assertRaises(SystemExit, eurep._query_iCATDb)
+
+    def test_creation_totals(self):
+        """the rows are fetched in batches as they are consumed
+        """
+        fetch_size = icat.FETCH_SIZE
+        icat.FETCH_SIZE = 7
+        try:
+            rows = self.db.creationTotals(ZONE)
+            next(rows)
+            # a connection given up on is not reused
+            rows.close()
+            rows = list(self.db.creationTotals(ZONE))
+        finally:
+            icat.FETCH_SIZE = fetch_size
+        self.assertEqual((sum(row[3] for row in rows),
+                          sum(row[2] for row in rows)), self._expected(ZONE))
+        self.assertRaises(QueryTimeout, list,
+                          self.db.creationTotals(ZONE, 1e-9))
+
+    def test_grouped_totals(self):
+        """one row per resource and owner, also with the resource table
+        """
+        for attr in ('RESC_NAME', 'DATA_RESC_NAME'):
+            rows = self.db.groupedTotals(ZONE + '/user2', attr)
+            for resource, owner, space, objects in rows:
+                self.assertEqual((objects, space), self._expected(
+                    ZONE + '/user2', lambda r: r['resource'] == resource
+                    and r['owner'] == owner))
+            self.assertEqual(sum(row[3] for row in rows),
+                             self._expected(ZONE + '/user2')[0])
+
+    def test_collector(self):
+        """the collector adds up the configured collections
+        """
+        conf = Conf()
+        conf.icat_dsn = self.path
+        eurep = EUDATAccounting(conf, logging.getLogger('test'))
+        user1 = self._expected(ZONE + '/user1')
+        user2 = self._expected(ZONE + '/user2')
+        self.assertEqual(eurep._query_iCATDb(),
+                         (user1[0] + user2[0], user1[1] + user2[1]))
+
+    def test_accounts(self):
+        """each collection counts for the innermost account prefix only
+        """
+        conf = Conf()
+        conf.icat_dsn = self.path
+        conf.collections = ZONE
+        conf.accounts = [(ZONE + '/user1', 'A'),
+                         (ZONE + '/user1/coll13', 'C'),
+                         (ZONE + '/user2', 'B'),
+                         (ZONE + '/nobody', 'N')]
+        eurep = EUDATAccounting(conf, logging.getLogger('test'))
+        below = lambda prefix: lambda r: r['collection'] == prefix or \
+            r['collection'].startswith(prefix + '/')
+        coll13 = below(ZONE + '/user1/coll13')
+        expected = {
+            'A': list(self._expected(ZONE + '/user1', lambda r:
+                      below(ZONE + '/user1')(r) and not coll13(r))),
+            'B': list(self._expected(ZONE + '/user2', below(ZONE + '/user2'))),
+            'C': list(self._expected(ZONE, coll13)),
+            # scanned, but empty
+            'N': [0, 0],
+        }
+        self.assertEqual(eurep._query_accounts(), expected)
+        conf.unmatched_account = 'B'
+        totals = eurep._query_accounts()
+        self.assertEqual(sum(t[0] for t in totals.values()),
+                         len(self.replicas))
+
+    def test_accounts_nested(self):
+        """collections within another one are scanned once
+        """
+        conf = Conf()
+        conf.icat_dsn = self.path
+        conf.collections = ZONE + '/user1 ' + ZONE + '/user1/coll13'
+        conf.accounts = [(ZONE + '/user1', 'A'),
+                         (ZONE + '/user1/coll13', 'C')]
+        eurep = EUDATAccounting(conf, logging.getLogger('test'))
+        below = lambda prefix: lambda r: r['collection'] == prefix or \
+            r['collection'].startswith(prefix + '/')
+        coll13 = below(ZONE + '/user1/coll13')
+        self.assertEqual(eurep._query_accounts(), {
+            'A': list(self._expected(ZONE + '/user1', lambda r:
+                      below(ZONE + '/user1')(r) and not coll13(r))),
+            'C': list(self._expected(ZONE, coll13)),
+        })
+
+    def test_accounts_scanned(self):
+        """only accounts within the collections are reported, and only
+        those done before the deadline
+        """
+        conf = Conf()
+        conf.icat_dsn = self.path
+        conf.accounts = [(ZONE, 'Z'), (ZONE + '/user1', 'A'),
+                         (ZONE + '/user2', 'B'), (ZONE + '/user3', 'N')]
+        conf.unmatched_account = 'U'
+        eurep = EUDATAccounting(conf, logging.getLogger('test'))
+        eurep.deadline = Deadline()
+        self.assertEqual(sorted(eurep._query_accounts()), ['A', 'B', 'U'])
+
+        rows = eurep._collection_rows
+
+        def cut(collection):
+            for row in rows(collection):
+                yield row
+            # the deadline passes after the first collection
+            eurep.deadline.end = 0
+
+        eurep._collection_rows = cut
+        self.assertEqual(list(eurep._query_accounts()), ['A'])
+        eurep.deadline.end = 0
+        self.assertRaises(SystemExit, eurep._query_accounts)
+
+    def test_backfill(self):
+        """past usage per account adds up the objects created before
+        """
+        conf = Conf()
+        conf.icat_dsn = self.path
+        # nested collections are scanned once
+        conf.collections += ' ' + ZONE + '/user1/coll13'
+        conf.accounts = [(ZONE + '/user1', 'A'), (ZONE + '/user2', 'B')]
+        args = Namespace(interval='100', key='', type='storage',
+                         unit='byte', object_type='', measure_time='',
+                         comment='')
+        eurep = EUDATAccounting(conf, logging.getLogger('test'))
+        start, end = START + 50 * DAY, START + 600 * DAY
+        records = eurep.collectBackfill(args, start, end)
+        self.assertEqual(len(records), 2 * 6)
+        below = lambda prefix: lambda r: r['collection'] == prefix or \
+            r['collection'].startswith(prefix + '/')
+        for record in records:
+            t = start + 100 * DAY * (records.index(record) % 6)
+            self.assertEqual(record.measure_time, backfill.measureTime(t))
+            self.assertEqual(record.key, backfill.recordKey('backfill', t))
+            prefix = ZONE + {'A': '/user1', 'B': '/user2'}[record.account]
+            self.assertEqual((record.number, record.value), self._expected(
+                prefix, lambda r: below(prefix)(r)
+                and int(r['created']) <= t))
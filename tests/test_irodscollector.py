@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the iRODScollector aggregations on a synthetic catalog"""
+
+import json
+import logging
+from argparse import Namespace
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+try:
+    from BaseHTTPServer import HTTPServer
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer
+
+from eudat.accounting.client.history import HistoryStore
+from eudat.accounting.client.iRODScollector import EUDATAccounting, \
+    Application
+from eudat.accounting.client.singleflight import runSingleFlight, \
+    LOCK_SUFFIX, RESULT_SUFFIX
+
+from fake_iquest import installIquest
+from icat_catalog import createCatalog, ZONE, START, END, RESOURCES
+from test_api import RecordingHandler
+
+
+class Conf(object):
+    """The options of the iRODScollector configuration used here"""
+    collections = ZONE + '/user1 ' + ZONE + '/user2'
+    account = 'acc'
+    state_file = None
+    full_interval = 7
+    sharded = []
+    icat_driver = 'sqlite3'
+    icat_connections = 2
+    accounts = []
+    unmatched_account = None
+    dump_file = None
+    shard_workers = 4
+    shard_retries = 2
+    group_by = []
+    type_template = '{type}'
+    resource_attr = 'RESC_NAME'
+
+
+def collectorArgs(**values):
+    """The command line arguments of the iRODScollector used here"""
+    args = Namespace(key='', type='storage', unit='byte',
+                     object_type='registered object', measure_time='',
+                     comment='', full=False, deadline=0, request_timeout=0,
+                     partial='skip')
+    for name, value in values.items():
+        setattr(args, name, value)
+    return args
+
+
+class IncrementalTest(unittest.TestCase):
+    """Incremental runs add the objects created since the last one
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        self.replicas = createCatalog(self.path, collections=30,
+                                      objects=2000)
+        self.conf = Conf()
+        self.conf.icat_dsn = self.path
+        self.conf.state_file = os.path.join(self.root, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _expected(self, collection):
+        found = [r for r in self.replicas
+                 if r['collection'].startswith(collection)]
+        return [len(found), sum(r['size'] for r in found)]
+
+    def _run(self, full=False):
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        try:
+            return eurep._query_iCATDb(full=full)
+        finally:
+            eurep.icat.close()
+
+    def _state(self, **changes):
+        with open(self.conf.state_file) as f:
+            state = json.load(f)
+        state.update(changes)
+        with open(self.conf.state_file, 'w') as f:
+            json.dump(state, f)
+        return state
+
+    def _sql(self, sql, *parameters):
+        db = sqlite3.connect(self.path)
+        db.execute(sql, parameters)
+        db.commit()
+        db.close()
+
+    def test_incremental(self):
+        """only new objects are queried unless old ones were modified
+        """
+        user1 = self._expected(ZONE + '/user1')
+        user2 = self._expected(ZONE + '/user2')
+        self.assertEqual(self._run(), (user1[0] + user2[0],
+                                       user1[1] + user2[1]))
+        state = self._state()
+        self.assertEqual(state['collections'],
+                         {ZONE + '/user1': user1, ZONE + '/user2': user2})
+
+        # totals known from the state are not queried again, so changing
+        # them shows which collections are scanned
+        self._state(mark=END, collections={ZONE + '/user1': user1,
+                                           ZONE + '/user2': [1, 1]})
+        self._sql("insert into r_data_main values "
+                  "(9000, 1, 'new', 0, 5000, 'demoResc', 0, 'alice', ?, ?)",
+                  '%011d' % (END + 10), '%011d' % (END + 10))
+        self.assertEqual(self._run(), (user1[0] + 1 + 1,
+                                       user1[1] + 5000 + 1))
+
+        # a modified object of user2 makes it scanned completely
+        self._state(mark=END + 20)
+        self._sql("update r_data_main set modify_ts = ? where coll_id = 2 "
+                  "and data_id = (select min(data_id) from r_data_main "
+                  "where coll_id = 2)", '%011d' % (END + 30))
+        self.assertEqual(self._run(), (user1[0] + 1 + user2[0],
+                                       user1[1] + 5000 + user2[1]))
+
+    def test_full_interval(self):
+        """a full scan is done when asked for or when it is due
+        """
+        self._run()
+        self._state(collections={ZONE + '/user1': [0, 0],
+                                 ZONE + '/user2': [0, 0]})
+        self.assertEqual(self._run(), (0, 0))
+        expected = self._run(full=True)
+        self.assertTrue(expected[0] > 0)
+        self._state(collections={ZONE + '/user1': [0, 0],
+                                 ZONE + '/user2': [0, 0]},
+                    last_full=self._state()['last_full'] - 8 * 86400)
+        self.assertEqual(self._run(), expected)
+
+
+class GroupedTest(unittest.TestCase):
+    """Records per resource and owner derived from the type template
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        self.replicas = createCatalog(self.path, collections=30,
+                                      objects=2000)
+        self.conf = Conf()
+        self.conf.icat_dsn = self.path
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _expected(self, select):
+        found = [r for r in self.replicas
+                 if r['collection'].startswith((ZONE + '/user1',
+                                                ZONE + '/user2'))
+                 and select(r)]
+        return len(found), sum(r['size'] for r in found)
+
+    def _collect(self, group_by, type_template, **args):
+        self.conf.group_by = group_by
+        self.conf.type_template = type_template
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        return eurep.collectRecords(collectorArgs(**args))
+
+    def test_resources(self):
+        """one record per resource, keys made unique by the type
+        """
+        records = self._collect(['resource'], '{type}:{resource}', key='k')
+        self.assertEqual(sorted(record.type for record in records),
+                         sorted('storage:' + r for r in RESOURCES))
+        for record in records:
+            resource = record.type.split(':')[1]
+            self.assertEqual((record.number, record.value), self._expected(
+                lambda r: r['resource'] == resource))
+            self.assertEqual(record.key, 'k-' + record.type)
+            self.assertEqual(record.account, 'acc')
+
+    def test_same_type(self):
+        """groups resulting in the same type are added up
+        """
+        records = self._collect(['owner', 'resource'], '{type}', key='k')
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0].number, records[0].value),
+                         self._expected(lambda r: True))
+        self.assertEqual((records[0].type, records[0].key), ('storage', 'k'))
+
+
+class ShardingTest(unittest.TestCase):
+    """Shards of a collection queried in parallel through iquest
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        self.replicas = createCatalog(self.path, collections=30,
+                                      objects=2000)
+        installIquest(self.root)
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = self.root + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_IQUEST_CATALOG'] = self.path
+        self.failures = os.path.join(self.root, 'failures')
+        os.environ['FAKE_IQUEST_FAILURES'] = self.failures
+        self.conf = Conf()
+        self.conf.icat_driver = None
+        self.conf.collections = ZONE + '/user1'
+        self.conf.sharded = [ZONE + '/user1']
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.root)
+
+    def _expected(self):
+        found = [r for r in self.replicas
+                 if r['collection'] == ZONE + '/user1' or
+                 r['collection'].startswith(ZONE + '/user1/')]
+        return len(found), sum(r['size'] for r in found)
+
+    def _fail(self, marker, times):
+        os.environ['FAKE_IQUEST_FAIL'] = marker
+        with open(self.failures, 'w') as f:
+            f.write('failure\n' * times)
+
+    def _run(self):
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        return eurep._query_iCATDb()
+
+    def test_shards(self):
+        """the shards add up to the collection and its sub-collections
+        """
+        self.assertEqual(self._run(), self._expected())
+
+    def test_retry(self):
+        """failed shards are retried
+        """
+        self._fail('/user1/coll13', 2)
+        self.assertEqual(self._run(), self._expected())
+        with open(self.failures) as f:
+            self.assertEqual(f.read(), '')
+
+    def test_failure(self):
+        """a shard still failing after the retries fails the run
+        """
+        self._fail('/user1/coll13', 3 * 2)
+        self.assertRaises(SystemExit, self._run)
+
+
+class PartialTest(unittest.TestCase):
+    """Results cut short by the deadline are flagged or skipped
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        createCatalog(self.path, collections=30, objects=200)
+        self.conf = Conf()
+        self.conf.icat_dsn = self.path
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _collect(self, partial):
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        return eurep.collectRecords(collectorArgs(deadline=1e-9,
+                                                  partial=partial))
+
+    def test_policies(self):
+        """never extrapolated from the share of the collections done
+        """
+        records = self._collect('flag')
+        self.assertEqual((records[0].number, records[0].value), (0, 0))
+        self.assertTrue(records[0].comment.startswith('partial: 0.0%'))
+        self.assertEqual(records[0].quality, 'partial')
+        self.assertRaises(SystemExit, self._collect, 'skip')
+        self.assertRaises(SystemExit, self._collect, 'extrapolate')
+        self.assertRaises(SystemExit, Application,
+                          ['iRODScollector', '--partial', 'extrapolate'])
+
+
+class DumpExportTest(unittest.TestCase):
+    """Dumps exported through iquest for the configured collections
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        self.replicas = createCatalog(self.path, collections=30,
+                                      objects=2000)
+        installIquest(self.root)
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = self.root + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_IQUEST_CATALOG'] = self.path
+        self.conf = Conf()
+        self.conf.icat_driver = None
+        self.conf.dump_file = os.path.join(self.root, 'dump.txt')
+        self.conf.dump_export = True
+        self.conf.dump_chunk_size = 4096
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.root)
+
+    def test_nested(self):
+        """collections within another one are exported once
+        """
+        self.conf.collections = ' '.join([ZONE + '/user1/coll13',
+                                          ZONE + '/user1', ZONE + '/user1'])
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        found = [r for r in self.replicas
+                 if r['collection'] == ZONE + '/user1' or
+                 r['collection'].startswith(ZONE + '/user1/')]
+        self.assertEqual(eurep._query_dump(),
+                         {('acc', '', ''): [len(found),
+                                            sum(r['size'] for r in found)]})
+
+
+    def test_deadline(self):
+        """an export cut short by the deadline leaves no dump behind
+        """
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        self.assertRaises(SystemExit, eurep.collectRecords,
+                          collectorArgs(deadline=1e-9, partial='flag'))
+        self.assertEqual(sorted(os.listdir(self.root)), ['icat.db', 'iquest'])
+
+
+class AcceptingHandler(RecordingHandler):
+    """Answers all addRecord calls"""
+
+    def do_POST(self):
+        self.path = self.path.replace('/bad/', '/good/')
+        RecordingHandler.do_POST(self)
+
+
+class BackfillTest(unittest.TestCase):
+    """Backfills resumed, kept in the history and rejected
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'icat.db')
+        createCatalog(self.path, collections=30, objects=200)
+        self.server = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.paths = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.conf = Conf()
+        self.conf.icat_dsn = self.path
+        self.conf.accounts = [(ZONE + '/user1', 'acc'),
+                              (ZONE + '/user2', 'bad')]
+        self.conf.base_url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.conf.domain = 'eudat'
+        self.conf.user = 'u'
+        self.conf.password = 'p'
+        self.args = collectorArgs(
+            backfill=str(START), interval='1000', test=False, batch_size=5,
+            configpath=os.path.join(self.root, 'collector.cfg'),
+            backfill_state='', lock_file='', lock_max_age=24,
+            coalesce=False, history=os.path.join(self.root, 'history.db'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def _run(self):
+        eurep = EUDATAccounting(self.conf, logging.getLogger('test'))
+        return runSingleFlight(self.args, eurep.reportBackfill, self.args)
+
+    def test_resume(self):
+        """a resumed upload sends the rest, all records reach the history
+        """
+        self.assertRaises(SystemExit, self._run)
+        sent = len(self.server.paths)
+        self.server.RequestHandlerClass = AcceptingHandler
+        records = self._run()
+        failed = len([p for p in self.server.paths[:sent] if '/bad/' in p])
+        self.assertEqual(len(self.server.paths) - sent, failed)
+        self.assertEqual(len(records), sent)
+        store = HistoryStore(self.args.history)
+        try:
+            self.assertEqual(store.accounts(), [('acc', 'storage'),
+                                                ('bad', 'storage')])
+            self.assertEqual(len(store.series('bad')), len(records) // 2)
+        finally:
+            store.close()
+        # past usage is no result for a coalescing run
+        self.assertFalse(os.path.exists(self.args.configpath +
+                                        LOCK_SUFFIX + RESULT_SUFFIX))
+
+    def test_deadline(self):
+        """a backfill cut short by the deadline is not uploaded
+        """
+        self.args.deadline = 1e-9
+        self.assertRaises(SystemExit, self._run)
+        self.assertEqual(self.server.paths, [])
+
+    def test_rejected(self):
+        """backfills are neither grouped nor partial
+        """
+        self.conf.group_by = ['owner']
+        self.assertRaises(SystemExit, self._run)
+        self.assertRaises(SystemExit, Application,
+                          ['iRODScollector', '--backfill', '2020-01-01',
+                           '--partial', 'flag'])
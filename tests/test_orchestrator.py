@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of runCollectors running several collectors at once"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+try:
+    from BaseHTTPServer import HTTPServer
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer
+
+from eudat.accounting.client.orchestrator import Application
+
+from test_api import RecordingHandler
+
+COLLECTORS = """
+[Logging]
+log_file=%(root)s/collectors.log
+[Report]
+user=u
+password=p
+workers=3
+[Orchestrator]
+collectors=%(names)s
+"""
+
+COLLECTOR = """
+[collector:%(name)s]
+type=posix
+config=%(root)s/%(name)s.cfg
+"""
+
+POSIX = """
+[Logging]
+log_file=%(root)s/%(name)s.log
+[Report]
+base_url=%(url)s
+domain=eudat
+account=%(account)s
+user=u
+password=p
+service_uuid=s
+[Directories]
+dlist=%(root)s/%(name)s
+"""
+
+
+class OrchestratorTest(unittest.TestCase):
+    """Collecting concurrently and uploading over a pool of connections
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.config = os.path.join(self.root, 'collectors.cfg')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def _configure(self, collectors):
+        """writes the configuration of the (name, account) `collectors`
+        with a tree of as many files of 100 bytes as the name is long;
+        collectors without an account have no configuration file"""
+        values = {'root': self.root, 'url': self.url,
+                  'names': ' '.join(name for name, account in collectors)}
+        with open(self.config, 'w') as f:
+            f.write(COLLECTORS % values)
+            for name, account in collectors:
+                values.update(name=name, account=account)
+                f.write(COLLECTOR % values)
+                if account is None:
+                    continue
+                with open(os.path.join(self.root, name + '.cfg'), 'w') as c:
+                    c.write(POSIX % values)
+                os.mkdir(os.path.join(self.root, name))
+                for i in range(len(name)):
+                    with open(os.path.join(self.root, name, str(i)),
+                              'wb') as data:
+                        data.write(b'x' * 100)
+
+    def _run(self, *options):
+        return Application(['runCollectors', '-c', self.config] +
+                           list(options)).run()
+
+    def test_upload(self):
+        """the records of all collectors are uploaded, keys made unique
+        """
+        self._configure([('one', 'acc1'), ('three', 'acc3')])
+        records = self._run('-k', 'k')
+        self.assertEqual(sorted((r.account, r.number, r.value, r.key)
+                                for r in records),
+                         [('acc1', 3, 300, 'k-one'),
+                          ('acc3', 5, 500, 'k-three')])
+        self.assertEqual(sorted(path.split('/')[2]
+                                for path in self.server.paths),
+                         ['acc1', 'acc3'])
+
+    def test_failures(self):
+        """failing collectors and uploads make the run fail at the end
+        """
+        self._configure([('one', 'acc1'), ('two', 'bad'),
+                         ('broken', None)])
+        self.assertRaises(SystemExit, self._run)
+        # the others are uploaded anyway
+        self.assertEqual(sorted(path.split('/')[2]
+                                for path in self.server.paths),
+                         ['acc1', 'bad'])
+
+    def test_dry_run(self):
+        """nothing is uploaded in test mode
+        """
+        self._configure([('one', 'acc1')])
+        self.assertEqual(len(self._run('-t')), 1)
+        self.assertEqual(self.server.paths, [])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the POSIXcollector tree walker"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from argparse import Namespace
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.client.POSIXcollector import TreeWalker, \
+    EUDATAccounting
+
+
+class TreeWalkerTest(unittest.TestCase):
+    """Counting files and sizes of a small generated tree
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for sub in ('a', os.path.join('a', 'b'), 'c'):
+            os.mkdir(os.path.join(self.root, sub))
+        self._write(os.path.join('a', 'one'), 100)
+        self._write(os.path.join('a', 'b', 'two'), 200)
+        self._write(os.path.join('c', 'three'), 300)
+        os.link(os.path.join(self.root, 'a', 'one'),
+                os.path.join(self.root, 'c', 'one'))
+        os.symlink(os.path.join(self.root, 'c', 'three'),
+                   os.path.join(self.root, 'a', 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, size):
+        with open(os.path.join(self.root, path), 'wb') as f:
+            f.write(b'x' * size)
+
+    def test_apparent_size(self):
+        """hard links are counted once and symlinks are skipped
+        """
+        for workers in (1, 4):
+            walker = TreeWalker(workers=workers)
+            self.assertEqual(walker.walk([self.root]), (3, 600))
+            self.assertEqual(walker.errors, 0)
+
+    def test_allocated_size(self):
+        files, size = TreeWalker(allocated=True).walk([self.root])
+        self.assertEqual(files, 3)
+        self.assertEqual(size % 512, 0)
+
+    def test_hard_links_across_paths(self):
+        """hard linked files are deduplicated across all paths
+        """
+        files, size = TreeWalker().walk([os.path.join(self.root, 'a'),
+                                         os.path.join(self.root, 'c')])
+        self.assertEqual((files, size), (3, 600))
+
+    def test_overlapping_paths(self):
+        """paths below another one are walked only once
+        """
+        os.symlink(os.path.join(self.root, 'a'),
+                   os.path.join(self.root, 'alias'))
+        paths = [os.path.join(self.root, 'a', 'b'), self.root + os.sep,
+                 os.path.join(self.root, 'a'),
+                 os.path.join(self.root, 'alias')]
+        for workers in (1, 4):
+            self.assertEqual(TreeWalker(workers=workers).walk(paths),
+                             (3, 600))
+
+    @unittest.skipIf(hasattr(os, 'geteuid') and os.geteuid() == 0,
+                     "root reads all directories")
+    def test_unreadable(self):
+        """totals missing unreadable directories are partial
+        """
+        os.chmod(os.path.join(self.root, 'a', 'b'), 0)
+        try:
+            walker = TreeWalker()
+            self.assertEqual(walker.walk([self.root]), (2, 400))
+            self.assertEqual(walker.errors, 1)
+            conf = Namespace(directories=self.root, workers=2,
+                             size='apparent', one_filesystem=False,
+                             account='acc')
+            eurep = EUDATAccounting(conf, logging.getLogger('test'))
+            args = Namespace(partial='skip', comment='')
+            self.assertRaises(SystemExit, eurep.collectRecords, args)
+            args.partial = 'flag'
+            record = eurep.collectRecords(args)[0]
+            self.assertEqual((record.number, record.value), (2, 400))
+            self.assertEqual(record.comment, 'partial (1 files or '
+                             'directories could not be read)')
+        finally:
+            os.chmod(os.path.join(self.root, 'a', 'b'), 0o755)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the --profile option"""
+
+import argparse
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+from multiprocessing.pool import ThreadPool
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.client import profiling
+
+
+def sizeInWorker(n):
+    return sum(range(n))
+
+
+def collect():
+    pool = ThreadPool(3)
+    try:
+        return pool.map(sizeInWorker, [10000] * 6)
+    finally:
+        pool.close()
+
+
+class ProfilingTest(unittest.TestCase):
+    """The work done in thread pools shows up in the profiles
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_cprofile(self):
+        output = os.path.join(self.root, 'run.prof')
+        args = argparse.Namespace(profile='cprofile', profile_output=output)
+        self.assertEqual(profiling.runProfiled(args, collect),
+                         [sum(range(10000))] * 6)
+        functions = [name for filename, line, name
+                     in pstats.Stats(output).stats]
+        self.assertTrue('collect' in functions)
+        self.assertTrue('sizeInWorker' in functions)
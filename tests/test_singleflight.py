@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the lock files preventing overlapping collector runs"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from eudat.accounting.client.record import AccountingRecord
+from eudat.accounting.client.singleflight import LockFile, RunInProgress, \
+    runSingleFlight, LOCK_SUFFIX, SKIPPED_EXIT_CODE
+
+
+class LockFileTest(unittest.TestCase):
+    """Taking, refusing and breaking locks
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'collector.cfg.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _fake_holder(self, pid, started):
+        with open(self.path, 'w') as f:
+            json.dump({'pid': pid, 'host': socket.gethostname(),
+                       'started': started}, f)
+
+    def test_single_owner(self):
+        """a second lock on the same file is refused until released
+        """
+        first = LockFile(self.path)
+        second = LockFile(self.path)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertEqual(second.holder()['pid'], os.getpid())
+        first.release()
+        self.assertTrue(second.acquire())
+
+    def test_dead_owner(self):
+        """the lock of a process that is gone is removed
+        """
+        pid = os.fork()
+        if not pid:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self._fake_holder(pid, time.time())
+        self.assertTrue(LockFile(self.path).acquire())
+
+    def test_too_old(self):
+        """a lock older than the maximum age is removed
+        """
+        self._fake_holder(os.getpid(), time.time() - 7200)
+        self.assertFalse(LockFile(self.path, max_age=3).acquire())
+        self.assertTrue(LockFile(self.path, max_age=1).acquire())
+
+    def test_break_once(self):
+        """of many runs finding the same stale lock only one takes it
+        """
+        self._fake_holder(os.getpid(), time.time() - 7200)
+        locks = [LockFile(self.path, max_age=1) for i in range(20)]
+        taken = []
+        start = threading.Event()
+
+        def slowCheck(lock):
+            # widens the window between checking and breaking the lock
+            def isStale():
+                stale = LockFile._isStale(lock)
+                time.sleep(0.01)
+                return stale
+            return isStale
+
+        for lock in locks:
+            lock._isStale = slowCheck(lock)
+
+        def acquire(lock):
+            start.wait()
+            if lock.acquire():
+                taken.append(lock)
+
+        threads = [threading.Thread(target=acquire, args=(lock,))
+                   for lock in locks]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(taken), 1)
+        self.assertEqual(LockFile(self.path).holder()['started'],
+                         taken[0].started)
+
+    def test_release_taken_over(self):
+        """a run whose lock was broken does not remove its successor's
+        """
+        first = LockFile(self.path)
+        second = LockFile(self.path, max_age=0)
+        self.assertTrue(first.acquire())
+        self.assertTrue(second.acquire())
+        first.release()
+        self.assertEqual(second.holder()['started'], second.started)
+        second.release()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class SingleFlightTest(unittest.TestCase):
+    """Runs overlapping with another one
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = os.path.join(self.root, 'collector.cfg')
+        self.args = argparse.Namespace(lock_file='', configpath=self.config,
+                                       lock_max_age=24, coalesce=False,
+                                       lock_poll_interval=0.01, test=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_skipped(self):
+        """a skipped run raises RunInProgress and exits with its status
+        """
+        lock = LockFile(self.config + LOCK_SUFFIX)
+        self.assertTrue(lock.acquire())
+        self.assertRaises(RunInProgress, runSingleFlight, self.args,
+                          lambda: [])
+        with open(self.config, 'w') as f:
+            f.write('[Logging]\nlog_file=%s/collector.log\n' % self.root)
+        # the console script logs into the current directory
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.assertEqual(subprocess.call(
+            [sys.executable, '-c', 'from eudat.accounting.client.'
+             'POSIXcollector import main; main()', '-c', self.config],
+            cwd=self.root, env=env), SKIPPED_EXIT_CODE)
+        lock.release()
+        self.assertEqual(runSingleFlight(self.args, lambda: ['r']), ['r'])
+
+    def _holder(self, func):
+        """runs `func` holding the lock in a thread until `finish` is set"""
+        args = argparse.Namespace(**vars(self.args))
+        args.test = False
+        self.holding = threading.Event()
+        self.finish = threading.Event()
+
+        def hold():
+            self.holding.set()
+            self.finish.wait()
+            return func()
+
+        def run():
+            try:
+                runSingleFlight(args, hold)
+            except ValueError:
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.holding.wait()
+        # finishes once the coalescing run is waiting
+        threading.Timer(0.2, self.finish.set).start()
+        return thread
+
+    def test_coalesce(self):
+        """a coalescing run waits for the holder and returns its result
+        """
+        records = [AccountingRecord('acc', 1024, number=3)]
+        thread = self._holder(lambda: records)
+        self.args.coalesce = True
+        called = []
+        result = runSingleFlight(self.args, lambda: called.append(1))
+        thread.join()
+        self.assertEqual(result, [records[0].toQueryString()])
+        self.assertEqual(called, [])
+
+    def test_coalesce_no_result(self):
+        """a coalescing run whose holder failed runs itself
+        """
+        def fail():
+            raise ValueError('failed')
+
+        # the result of an earlier run is not reused either
+        LockFile(self.config + LOCK_SUFFIX).storeResult(
+            [AccountingRecord('acc', 1)])
+        thread = self._holder(fail)
+        self.args.coalesce = True
+        result = runSingleFlight(self.args,
+                                 lambda: [self.finish.is_set()])
+        thread.join()
+        self.assertEqual(result, [True])